@@ -1,34 +1,39 @@
 # api/base_client.py
 import logging
-import time
 from typing import Any, Dict, Optional
+from api.retry import call_with_retry, get_retry_stats
+from api.circuit_breaker import get_circuit_breaker
 
 logger = logging.getLogger(__name__)
 
 class APIClient:
     """Bazowa klasa dla klientów API z wspólną funkcjonalnością"""
     
-    def __init__(self, max_retries: int = 3, retry_delay: float = 1.0):
+    upstream = "api"
+    
+    def __init__(self, max_retries: int = 3, retry_delay: float = 1.0, max_retry_delay: float = 20.0):
         self.max_retries = max_retries
         self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.circuit_breaker = get_circuit_breaker(self.upstream)
     
     async def _request_with_retry(self, request_func, *args, **kwargs) -> Any:
-        """Wykonuje żądanie z logiką ponawiania"""
-        retries = 0
-        last_error = None
-        
-        while retries < self.max_retries:
-            try:
-                return await request_func(*args, **kwargs)
-            except Exception as e:
-                retries += 1
-                last_error = e
-                logger.warning(f"Żądanie API nie powiodło się (próba {retries}/{self.max_retries}): {str(e)}")
-                
-                if retries < self.max_retries:
-                    sleep_time = self.retry_delay * (2 ** (retries - 1))
-                    logger.info(f"Ponowna próba za {sleep_time:.2f} sekund...")
-                    time.sleep(sleep_time)
-                    
-        logger.error(f"Żądanie API nie powiodło się po {self.max_retries} próbach: {str(last_error)}")
-        raise last_error
\ No newline at end of file
+        """Wykonuje żądanie z nieblokującą logiką ponawiania"""
+        return await call_with_retry(
+            self.upstream,
+            request_func,
+            *args,
+            max_retries=self.max_retries,
+            base_delay=self.retry_delay,
+            max_delay=self.max_retry_delay,
+            breaker=self.circuit_breaker,
+            **kwargs
+        )
+    
+    def get_retry_stats(self) -> Dict[str, Any]:
+        """Zwraca liczniki ponowień dla upstreamu tego klienta"""
+        return get_retry_stats(self.upstream)
+    
+    def get_circuit_status(self) -> Dict[str, Any]:
+        """Zwraca stan wyłącznika obwodu dla upstreamu tego klienta"""
+        return self.circuit_breaker.get_status()
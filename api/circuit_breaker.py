@@ -0,0 +1,156 @@
+# api/circuit_breaker.py
+"""
+Wyłącznik obwodu (circuit breaker) per upstream - szybkie odrzucanie żądań,
+gdy zewnętrzna usługa ma awarię, zamiast czekania na kolejne ponowienia
+"""
+import logging
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Tuple
+from config import CIRCUIT_BREAKER_SETTINGS
+
+logger = logging.getLogger(__name__)
+
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+
+class CircuitOpenError(Exception):
+    """Zgłaszany natychmiast, gdy obwód dla upstreamu jest otwarty"""
+
+    def __init__(self, upstream: str, retry_in: float):
+        self.upstream = upstream
+        self.retry_in = max(0.0, retry_in)
+        super().__init__(f"Usługa {upstream} jest chwilowo niedostępna (ponów za {self.retry_in:.0f} s)")
+
+class CircuitBreaker:
+    """
+    Wyłącznik obwodu ze stanami closed/open/half-open
+
+    Obwód otwiera się, gdy w oknie czasowym `window` odsetek błędów przekroczy
+    `failure_rate_threshold` przy co najmniej `min_calls` wywołaniach. Po czasie
+    `open_timeout` przepuszcza `half_open_max_calls` żądań próbnych.
+    """
+
+    def __init__(self, name: str, failure_rate_threshold: float = 0.5, window: float = 30.0,
+                 min_calls: int = 10, open_timeout: float = 15.0, half_open_max_calls: int = 2):
+        self.name = name
+        self.failure_rate_threshold = failure_rate_threshold
+        self.window = window
+        self.min_calls = min_calls
+        self.open_timeout = open_timeout
+        self.half_open_max_calls = half_open_max_calls
+
+        self.state = STATE_CLOSED
+        self._outcomes: Deque[Tuple[float, bool]] = deque()
+        self._opened_at = 0.0
+        self._half_open_in_flight = 0
+        self._half_open_successes = 0
+        self.stats = {"rejected": 0, "opened": 0, "successes": 0, "failures": 0}
+
+    def _trim(self, now: float) -> None:
+        cutoff = now - self.window
+        while self._outcomes and self._outcomes[0][0] < cutoff:
+            self._outcomes.popleft()
+
+    def _transition(self, state: str) -> None:
+        if state == self.state:
+            return
+        logger.warning(f"Obwód {self.name}: {self.state} -> {state}")
+        self.state = state
+        if state == STATE_OPEN:
+            self._opened_at = time.monotonic()
+            self.stats["opened"] += 1
+        elif state == STATE_HALF_OPEN:
+            self._half_open_in_flight = 0
+            self._half_open_successes = 0
+        elif state == STATE_CLOSED:
+            self._outcomes.clear()
+
+    def retry_in(self) -> float:
+        """Liczba sekund do następnej próby w stanie otwartym"""
+        if self.state != STATE_OPEN:
+            return 0.0
+        return self.open_timeout - (time.monotonic() - self._opened_at)
+
+    def before_call(self) -> None:
+        """
+        Sprawdza, czy żądanie może zostać wykonane
+
+        Raises:
+            CircuitOpenError: Gdy obwód jest otwarty lub limit prób półotwartych jest wyczerpany
+        """
+        if self.state == STATE_OPEN:
+            if self.retry_in() > 0:
+                self.stats["rejected"] += 1
+                raise CircuitOpenError(self.name, self.retry_in())
+            self._transition(STATE_HALF_OPEN)
+
+        if self.state == STATE_HALF_OPEN:
+            if self._half_open_in_flight >= self.half_open_max_calls:
+                self.stats["rejected"] += 1
+                raise CircuitOpenError(self.name, 1.0)
+            self._half_open_in_flight += 1
+
+    def record_success(self) -> None:
+        """Rejestruje udane wywołanie"""
+        self.stats["successes"] += 1
+        if self.state == STATE_HALF_OPEN:
+            self._half_open_in_flight = max(0, self._half_open_in_flight - 1)
+            self._half_open_successes += 1
+            if self._half_open_successes >= self.half_open_max_calls:
+                self._transition(STATE_CLOSED)
+            return
+
+        now = time.monotonic()
+        self._trim(now)
+        self._outcomes.append((now, True))
+
+    def release_probe(self) -> None:
+        """Zwalnia miejsce próby półotwartej, której wynik jest nieznany (np. przerwane wywołanie)"""
+        if self.state == STATE_HALF_OPEN:
+            self._half_open_in_flight = max(0, self._half_open_in_flight - 1)
+
+    def record_failure(self) -> None:
+        """Rejestruje nieudane wywołanie (błąd po stronie upstreamu)"""
+        self.stats["failures"] += 1
+        if self.state == STATE_HALF_OPEN:
+            self._transition(STATE_OPEN)
+            return
+
+        now = time.monotonic()
+        self._trim(now)
+        self._outcomes.append((now, False))
+
+        if len(self._outcomes) >= self.min_calls:
+            failures = sum(1 for _, ok in self._outcomes if not ok)
+            if failures / len(self._outcomes) >= self.failure_rate_threshold:
+                self._transition(STATE_OPEN)
+
+    def is_available(self) -> bool:
+        """Czy upstream przyjmie teraz żądanie (bez rezerwowania próby)"""
+        return self.state == STATE_CLOSED or self.retry_in() <= 0
+
+    def get_status(self) -> Dict[str, Any]:
+        """Zwraca stan obwodu do monitoringu"""
+        return {
+            "state": self.state,
+            "retry_in": round(max(0.0, self.retry_in()), 1),
+            "window_calls": len(self._outcomes),
+            **self.stats
+        }
+
+_breakers: Dict[str, CircuitBreaker] = {}
+
+def get_circuit_breaker(upstream: str) -> CircuitBreaker:
+    """Zwraca współdzielony wyłącznik obwodu dla upstreamu"""
+    if upstream not in _breakers:
+        settings = CIRCUIT_BREAKER_SETTINGS.get(upstream, CIRCUIT_BREAKER_SETTINGS["default"])
+        _breakers[upstream] = CircuitBreaker(upstream, **settings)
+    return _breakers[upstream]
+
+def get_circuit_status(upstream: Optional[str] = None) -> Dict[str, Any]:
+    """Zwraca stan jednego lub wszystkich obwodów"""
+    if upstream is not None:
+        return get_circuit_breaker(upstream).get_status()
+    return {name: breaker.get_status() for name, breaker in _breakers.items()}
@@ -2,36 +2,199 @@
 import asyncio
 import time
 import logging
-from typing import List, Dict, Any, AsyncGenerator
+from typing import List, Dict, Any, AsyncGenerator, Optional
 from openai import AsyncOpenAI
 from api.base_client import APIClient
-from config import OPENAI_API_KEY, DEFAULT_MODEL, DALL_E_MODEL
+from config import OPENAI_API_KEY, DEFAULT_MODEL, DALL_E_MODEL, OPENAI_RATE_LIMITS
 
 logger = logging.getLogger(__name__)
 
+# Szacowana długość odpowiedzi, gdy wywołanie nie określa max_tokens
+DEFAULT_COMPLETION_TOKENS_ESTIMATE = 512
+
+class TokenBucket:
+    """Kubełek tokenów odnawiany liniowo do pojemności w ciągu minuty"""
+    
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+    
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+    
+    def wait_time(self, amount: float) -> float:
+        """Liczba sekund, po której w kubełku będzie `amount` tokenów"""
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+    
+    def consume(self, amount: float) -> None:
+        """Pobiera tokeny (saldo może zejść poniżej zera przy korekcie po fakcie)"""
+        self._refill()
+        self.tokens -= amount
+    
+    def sync(self, limit: Optional[float], remaining: Optional[float]) -> None:
+        """Dostosowuje kubełek do limitów zgłoszonych przez API"""
+        self._refill()
+        if limit:
+            self.capacity = float(limit)
+            self.rate = self.capacity / 60.0
+        if remaining is not None:
+            self.tokens = min(self.tokens, float(remaining), self.capacity)
+
+class ModelRateLimiter:
+    """
+    Ogranicznik żądań per model (RPM i TPM) oparty na kubełkach tokenów
+    
+    Opóźnia żądanie tylko wtedy, gdy kubełek jest pusty, i uczy się faktycznych
+    limitów organizacji z nagłówków x-ratelimit-* odpowiedzi OpenAI.
+    """
+    
+    def __init__(self, limits: Dict[str, Dict[str, Optional[int]]] = OPENAI_RATE_LIMITS):
+        self.limits = limits
+        self._buckets: Dict[str, Dict[str, Optional[TokenBucket]]] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self.stats = {"acquired": 0, "delayed": 0, "wait_seconds": 0.0}
+    
+    def _limits_for(self, model: str) -> Dict[str, Optional[int]]:
+        """Zwraca limity dla modelu (dokładne dopasowanie lub najdłuższy prefiks)"""
+        if model in self.limits:
+            return self.limits[model]
+        prefixes = [key for key in self.limits if key != "default" and model.startswith(key)]
+        if prefixes:
+            return self.limits[max(prefixes, key=len)]
+        return self.limits["default"]
+    
+    def _buckets_for(self, model: str) -> Dict[str, Optional[TokenBucket]]:
+        if model not in self._buckets:
+            limits = self._limits_for(model)
+            self._buckets[model] = {
+                "requests": TokenBucket(limits["rpm"]) if limits.get("rpm") else None,
+                "tokens": TokenBucket(limits["tpm"]) if limits.get("tpm") else None
+            }
+            self._locks[model] = asyncio.Lock()
+        return self._buckets[model]
+    
+    async def acquire(self, model: str, estimated_tokens: int = 0) -> None:
+        """Czeka, aż dla modelu będzie dostępne jedno żądanie i `estimated_tokens` tokenów"""
+        buckets = self._buckets_for(model)
+        requests_bucket, tokens_bucket = buckets["requests"], buckets["tokens"]
+        
+        # Blokada per model zachowuje kolejność oczekujących żądań
+        async with self._locks[model]:
+            waited = 0.0
+            while True:
+                wait = 0.0
+                if requests_bucket:
+                    wait = max(wait, requests_bucket.wait_time(1))
+                if tokens_bucket and estimated_tokens:
+                    wait = max(wait, tokens_bucket.wait_time(estimated_tokens))
+                if wait <= 0:
+                    break
+                waited += wait
+                await asyncio.sleep(wait)
+            
+            if requests_bucket:
+                requests_bucket.consume(1)
+            if tokens_bucket and estimated_tokens:
+                tokens_bucket.consume(estimated_tokens)
+        
+        self.stats["acquired"] += 1
+        if waited:
+            self.stats["delayed"] += 1
+            self.stats["wait_seconds"] += waited
+            logger.info(f"Ogranicznik OpenAI opóźnił żądanie do {model} o {waited:.2f} s")
+    
+    def record_usage(self, model: str, estimated_tokens: int, actual_tokens: Optional[int]) -> None:
+        """Koryguje kubełek tokenów o różnicę między szacunkiem a faktycznym zużyciem"""
+        tokens_bucket = self._buckets_for(model)["tokens"]
+        if tokens_bucket and actual_tokens is not None:
+            tokens_bucket.consume(actual_tokens - estimated_tokens)
+    
+    def update_from_headers(self, model: str, headers: Any) -> None:
+        """Synchronizuje kubełki z nagłówkami x-ratelimit-* odpowiedzi"""
+        if not headers:
+            return
+        buckets = self._buckets_for(model)
+        
+        for kind in ("requests", "tokens"):
+            limit = _parse_int(headers.get(f"x-ratelimit-limit-{kind}"))
+            remaining = _parse_int(headers.get(f"x-ratelimit-remaining-{kind}"))
+            if limit is None and remaining is None:
+                continue
+            if buckets[kind] is None and limit:
+                buckets[kind] = TokenBucket(limit)
+            if buckets[kind] is not None:
+                buckets[kind].sync(limit, remaining)
+
+def _parse_int(value: Optional[str]) -> Optional[int]:
+    try:
+        return int(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+def estimate_prompt_tokens(messages: List[Dict[str, Any]]) -> int:
+    """Przybliżona liczba tokenów promptu (ok. 4 znaki na token + narzut na wiadomość)"""
+    total = 0
+    for message in messages:
+        content = message.get("content") or ""
+        if isinstance(content, list):
+            content = " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+        total += len(content) // 4 + 4
+    return total + 2
+
 class OpenAIClient(APIClient):
     """Klient API OpenAI z obsługą błędów i ponawianiem"""
     
+    upstream = "openai"
+    
     def __init__(self, api_key: str = OPENAI_API_KEY, max_retries: int = 3, retry_delay: float = 1.0):
         super().__init__(max_retries, retry_delay)
         from httpx import AsyncClient
         http_client = AsyncClient()
         self.client = AsyncOpenAI(api_key=api_key, http_client=http_client)
+        self.rate_limiter = ModelRateLimiter()
         logger.info(f"Klient OpenAI zainicjalizowany z kluczem API: {'ważny' if api_key else 'brak'}")
     
+    async def _create_with_rate_limit(self, create_raw, model: str, estimated_tokens: int, **kwargs) -> Any:
+        """Pojedyncza próba żądania: limiter, wywołanie i nauka limitów z nagłówków"""
+        await self.rate_limiter.acquire(model, estimated_tokens)
+        try:
+            raw_response = await create_raw(model=model, **kwargs)
+        except Exception as e:
+            response = getattr(e, "response", None)
+            self.rate_limiter.update_from_headers(model, getattr(response, "headers", None))
+            raise
+        
+        self.rate_limiter.update_from_headers(model, raw_response.headers)
+        return raw_response.parse()
+    
     async def chat_completion(self, messages: List[Dict[str, str]], model: str = DEFAULT_MODEL, stream: bool = False, **kwargs) -> Any:
         """Generuje odpowiedź czatu z API OpenAI"""
         try:
-            if "gpt-4" in model and not stream:
-                await asyncio.sleep(0.5)
-                
-            return await self._request_with_retry(
-                self.client.chat.completions.create,
-                model=model,
+            estimated_tokens = estimate_prompt_tokens(messages) + (kwargs.get("max_tokens") or DEFAULT_COMPLETION_TOKENS_ESTIMATE)
+            
+            response = await self._request_with_retry(
+                self._create_with_rate_limit,
+                self.client.chat.completions.with_raw_response.create,
+                model,
+                estimated_tokens,
                 messages=messages,
                 stream=stream,
                 **kwargs
             )
+            
+            usage = getattr(response, "usage", None)
+            if usage is not None:
+                self.rate_limiter.record_usage(model, estimated_tokens, usage.total_tokens)
+            
+            return response
         except Exception as e:
             logger.error(f"Błąd API OpenAI: {str(e)}")
             raise
@@ -44,17 +207,23 @@ class OpenAIClient(APIClient):
     async def chat_completion_stream(self, messages: List[Dict[str, str]], model: str = DEFAULT_MODEL, **kwargs) -> AsyncGenerator[str, None]:
         """Generuje strumieniową odpowiedź czatu"""
         stream = await self.chat_completion(messages, model, stream=True, **kwargs)
-        
-        async for chunk in stream:
-            if chunk.choices and chunk.choices[0].delta.content:
-                yield chunk.choices[0].delta.content
+
+        try:
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        finally:
+            # Przerwana generacja - zamknij połączenie HTTP, aby OpenAI przestało generować tokeny
+            await stream.close()
     
     async def generate_image(self, prompt: str, model: str = DALL_E_MODEL, size: str = "1024x1024", n: int = 1, **kwargs) -> str:
         """Generuje obraz za pomocą DALL-E"""
         try:
             response = await self._request_with_retry(
-                self.client.images.generate,
-                model=model,
+                self._create_with_rate_limit,
+                self.client.images.with_raw_response.generate,
+                model,
+                0,
                 prompt=prompt,
                 n=n,
                 size=size,
@@ -63,4 +232,8 @@ class OpenAIClient(APIClient):
             return response.data[0].url
         except Exception as e:
             logger.error(f"Błąd generowania obrazu: {str(e)}")
-            raise
\ No newline at end of file
+            raise
+    
+    async def close(self) -> None:
+        """Zamyka klienta HTTP OpenAI"""
+        await self.client.close()
@@ -0,0 +1,172 @@
+# api/realtime_client.py
+"""
+Strumień zmian w tabelach bazy danych - Supabase Realtime (postgres_changes)
+lub lokalny zamiennik publikujący zmiany w obrębie procesu
+"""
+import asyncio
+import inspect
+import json
+import logging
+from typing import Any, Callable, Dict, List, Optional
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+# Zdarzenie wysyłane do subskrybentów po (ponownym) połączeniu - zmiany
+# z okresu rozłączenia mogły zostać utracone, więc pamięci podręczne trzeba wyczyścić
+EVENT_RESET = "RESET"
+
+ChangeCallback = Callable[[str, Dict[str, Any]], Any]
+
+class LocalChangeFeed:
+    """Lokalny strumień zmian (pub/sub w obrębie procesu)"""
+
+    def __init__(self, table: str):
+        self.table = table
+        self._subscribers: List[ChangeCallback] = []
+
+    def subscribe(self, callback: ChangeCallback) -> None:
+        """Rejestruje funkcję wywoływaną jako callback(event, record)"""
+        self._subscribers.append(callback)
+
+    async def publish(self, event: str, record: Optional[Dict[str, Any]] = None) -> None:
+        """Przekazuje zmianę wszystkim subskrybentom"""
+        for callback in self._subscribers:
+            try:
+                result = callback(event, record or {})
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:
+                logger.error(f"Błąd subskrybenta zmian tabeli {self.table}: {e}")
+
+    async def start(self) -> None:
+        """Lokalny strumień nie wymaga połączenia"""
+
+    async def stop(self) -> None:
+        """Lokalny strumień nie wymaga połączenia"""
+
+class RealtimeChangeFeed(LocalChangeFeed):
+    """
+    Subskrypcja postgres_changes przez websocket Supabase Realtime (protokół Phoenix)
+
+    Zmiany wykonane przez inne instancje bota lub funkcje Edge (np. webhooki Stripe)
+    trafiają do subskrybentów jako callback("INSERT" | "UPDATE" | "DELETE", record).
+    Po każdym połączeniu wysyłane jest zdarzenie RESET.
+    """
+
+    def __init__(self, url: str, key: str, table: str, schema: str = "public",
+                 heartbeat_interval: float = 25.0, max_backoff: float = 30.0):
+        super().__init__(table)
+        self.url = url
+        self.key = key
+        self.schema = schema
+        self.heartbeat_interval = heartbeat_interval
+        self.max_backoff = max_backoff
+        self.connected = False
+        self._ref = 0
+        self._task: Optional[asyncio.Task] = None
+        self._session = None
+
+    @property
+    def websocket_url(self) -> str:
+        base = self.url.rstrip('/').replace("https://", "wss://").replace("http://", "ws://")
+        return f"{base}/realtime/v1/websocket?apikey={self.key}&vsn=1.0.0"
+
+    @property
+    def topic(self) -> str:
+        return f"realtime:{self.schema}:{self.table}"
+
+    def _next_ref(self) -> str:
+        self._ref += 1
+        return str(self._ref)
+
+    def _message(self, topic: str, event: str, payload: Dict[str, Any]) -> str:
+        return json.dumps({"topic": topic, "event": event, "payload": payload, "ref": self._next_ref()})
+
+    async def start(self) -> None:
+        """Uruchamia nasłuchiwanie w tle (z automatycznym ponownym łączeniem)"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Zatrzymuje nasłuchiwanie i zamyka połączenie"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+        self.connected = False
+
+    async def _run(self) -> None:
+        backoff = 1.0
+        self._session = aiohttp.ClientSession()
+        while True:
+            try:
+                async with self._session.ws_connect(self.websocket_url, heartbeat=None) as ws:
+                    await self._join(ws)
+                    backoff = 1.0
+                    await self._listen(ws)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Połączenie Realtime dla {self.table} przerwane: {e}")
+
+            self.connected = False
+            logger.info(f"Ponowne łączenie z Realtime za {backoff:.0f} sekund...")
+            await asyncio.sleep(backoff)
+            backoff = min(self.max_backoff, backoff * 2)
+
+    async def _join(self, ws) -> None:
+        payload = {
+            "config": {
+                "broadcast": {"self": False},
+                "presence": {"key": ""},
+                "postgres_changes": [{"event": "*", "schema": self.schema, "table": self.table}]
+            },
+            "access_token": self.key
+        }
+        await ws.send_str(self._message(self.topic, "phx_join", payload))
+
+    async def _listen(self, ws) -> None:
+        heartbeat = asyncio.create_task(self._heartbeat(ws))
+        try:
+            async for msg in ws:
+                if msg.type != aiohttp.WSMsgType.TEXT:
+                    if msg.type in (aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.ERROR):
+                        break
+                    continue
+                await self._handle(json.loads(msg.data))
+        finally:
+            heartbeat.cancel()
+
+    async def _heartbeat(self, ws) -> None:
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            await ws.send_str(self._message("phoenix", "heartbeat", {}))
+
+    async def _handle(self, message: Dict[str, Any]) -> None:
+        event = message.get("event")
+        payload = message.get("payload") or {}
+
+        if event == "phx_reply" and message.get("topic") == self.topic:
+            if payload.get("status") == "ok":
+                if not self.connected:
+                    self.connected = True
+                    logger.info(f"Nasłuchiwanie zmian tabeli {self.table} przez Realtime")
+                    await self.publish(EVENT_RESET)
+            else:
+                logger.error(f"Realtime odrzucił subskrypcję {self.table}: {payload.get('response')}")
+        elif event == "postgres_changes":
+            data = payload.get("data") or {}
+            change_type = data.get("type", "UPDATE")
+            record = data.get("record") or data.get("old_record") or {}
+            await self.publish(change_type, record)
+        elif event in ("phx_error", "phx_close") and message.get("topic") == self.topic:
+            raise ConnectionError(f"Kanał Realtime {self.topic} zamknięty ({event})")
+        elif event == "system" and payload.get("status") == "error":
+            logger.error(f"Błąd Realtime dla {self.table}: {payload.get('message')}")
@@ -0,0 +1,293 @@
+# api/retry.py
+"""
+Silnik ponawiania żądań do zewnętrznych API: klasyfikacja błędów,
+opóźnienia z dekorelowanym jitterem, budżety ponowień i liczniki per upstream
+"""
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from email.utils import parsedate_to_datetime
+from typing import Any, Deque, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Kody HTTP, które warto ponowić
+RETRYABLE_STATUS_CODES = {408, 425, 429, 500, 502, 503, 504}
+
+# Nazwy klas wyjątków oznaczających przekroczenie czasu lub zerwane połączenie
+# (openai, httpx, aiohttp, requests) - sprawdzane po nazwie, aby nie importować bibliotek
+TRANSIENT_ERROR_NAMES = {
+    "TimeoutError",
+    "TimeoutException",
+    "ReadTimeout",
+    "WriteTimeout",
+    "ConnectTimeout",
+    "PoolTimeout",
+    "ConnectError",
+    "ReadError",
+    "RemoteProtocolError",
+    "APITimeoutError",
+    "APIConnectionError",
+    "ServerDisconnectedError",
+    "ClientConnectionError",
+    "ClientOSError",
+    "ConnectionError",
+    "ConnectionResetError",
+}
+
+@dataclass
+class ErrorClassification:
+    """Wynik klasyfikacji błędu"""
+    retryable: bool
+    reason: str
+    status_code: Optional[int] = None
+    retry_after: Optional[float] = None
+
+def _get_status_code(error: Exception) -> Optional[int]:
+    """Wyciąga kod HTTP z wyjątku (openai, httpx, postgrest)"""
+    status = getattr(error, "status_code", None)
+    if status is None:
+        response = getattr(error, "response", None)
+        status = getattr(response, "status_code", None) or getattr(response, "status", None)
+    if status is None:
+        # postgrest.APIError przechowuje kod jako tekst - zwykle SQLSTATE (np. "23505"),
+        # a nie kod HTTP; tylko trzycyfrowy kod HTTP jest traktowany jako status
+        code = getattr(error, "code", None)
+        if isinstance(code, str) and len(code) == 3 and code.isdigit() and 100 <= int(code) < 600:
+            status = int(code)
+    try:
+        return int(status) if status is not None else None
+    except (TypeError, ValueError):
+        return None
+
+def _get_retry_after(error: Exception) -> Optional[float]:
+    """Odczytuje nagłówek Retry-After (sekundy lub data HTTP)"""
+    retry_after = getattr(error, "retry_after", None)
+    if isinstance(retry_after, (int, float)):
+        return float(retry_after)
+
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return float(value) / 1000.0
+        except ValueError:
+            pass
+
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+def classify_error(error: Exception) -> ErrorClassification:
+    """
+    Klasyfikuje błąd jako możliwy do ponowienia lub krytyczny
+
+    Args:
+        error: Wyjątek zgłoszony przez klienta API
+
+    Returns:
+        ErrorClassification: Informacja czy ponawiać, powód i ewentualny Retry-After
+    """
+    if isinstance(error, asyncio.CancelledError):
+        return ErrorClassification(False, "cancelled")
+
+    status = _get_status_code(error)
+    if status is not None:
+        if status == 429:
+            return ErrorClassification(True, "rate_limited", status, _get_retry_after(error))
+        if status in RETRYABLE_STATUS_CODES:
+            return ErrorClassification(True, f"http_{status}", status, _get_retry_after(error))
+        if 400 <= status < 500:
+            return ErrorClassification(False, f"http_{status}", status)
+        if status >= 500:
+            return ErrorClassification(True, f"http_{status}", status, _get_retry_after(error))
+
+    for cls in type(error).__mro__:
+        if cls.__name__ in TRANSIENT_ERROR_NAMES:
+            return ErrorClassification(True, "timeout" if "Timeout" in cls.__name__ else "connection")
+
+    return ErrorClassification(False, type(error).__name__)
+
+class DecorrelatedJitterBackoff:
+    """Opóźnienia z dekorelowanym jitterem: sleep = min(cap, random(base, prev * 3))"""
+
+    def __init__(self, base: float = 1.0, cap: float = 20.0):
+        self.base = base
+        self.cap = cap
+        self._previous = base
+
+    def next_delay(self) -> float:
+        """Zwraca kolejne opóźnienie w sekundach"""
+        delay = min(self.cap, random.uniform(self.base, self._previous * 3))
+        self._previous = delay
+        return delay
+
+class RetryBudget:
+    """
+    Budżet ponowień per upstream - ponowienia nie mogą przekroczyć
+    określonego procentu żądań z ostatniego okna czasowego
+    """
+
+    def __init__(self, ratio: float = 0.2, window: float = 10.0, min_retries_per_window: int = 10):
+        self.ratio = ratio
+        self.window = window
+        self.min_retries_per_window = min_retries_per_window
+        self._requests: Deque[float] = deque()
+        self._retries: Deque[float] = deque()
+
+    def _trim(self, now: float) -> None:
+        cutoff = now - self.window
+        while self._requests and self._requests[0] < cutoff:
+            self._requests.popleft()
+        while self._retries and self._retries[0] < cutoff:
+            self._retries.popleft()
+
+    def record_request(self) -> None:
+        """Rejestruje pierwsze podejście do żądania"""
+        now = time.monotonic()
+        self._trim(now)
+        self._requests.append(now)
+
+    def try_acquire_retry(self) -> bool:
+        """Sprawdza i rezerwuje miejsce na ponowienie w budżecie"""
+        now = time.monotonic()
+        self._trim(now)
+        allowed = max(self.min_retries_per_window, int(len(self._requests) * self.ratio))
+        if len(self._retries) >= allowed:
+            return False
+        self._retries.append(now)
+        return True
+
+@dataclass
+class RetryStats:
+    """Liczniki żądań i ponowień dla jednego upstreamu"""
+    requests: int = 0
+    retries: int = 0
+    successes: int = 0
+    failures: int = 0
+    budget_exhausted: int = 0
+    retry_wait_seconds: float = 0.0
+    reasons: Dict[str, int] = field(default_factory=dict)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "retries": self.retries,
+            "successes": self.successes,
+            "failures": self.failures,
+            "budget_exhausted": self.budget_exhausted,
+            "retry_wait_seconds": round(self.retry_wait_seconds, 3),
+            "reasons": dict(self.reasons),
+        }
+
+# Współdzielone budżety i liczniki - kilka klientów tego samego upstreamu korzysta z jednego budżetu
+_budgets: Dict[str, RetryBudget] = {}
+_stats: Dict[str, RetryStats] = {}
+
+def get_retry_budget(upstream: str) -> RetryBudget:
+    """Zwraca budżet ponowień dla upstreamu"""
+    if upstream not in _budgets:
+        _budgets[upstream] = RetryBudget()
+    return _budgets[upstream]
+
+def get_retry_stats(upstream: Optional[str] = None) -> Dict[str, Any]:
+    """Zwraca liczniki ponowień dla jednego lub wszystkich upstreamów"""
+    if upstream is not None:
+        return _stats.setdefault(upstream, RetryStats()).as_dict()
+    return {name: stats.as_dict() for name, stats in _stats.items()}
+
+def _stats_for(upstream: str) -> RetryStats:
+    return _stats.setdefault(upstream, RetryStats())
+
+async def call_with_retry(upstream: str, request_func, *args, max_retries: int = 3,
+                          base_delay: float = 1.0, max_delay: float = 20.0, breaker=None, **kwargs) -> Any:
+    """
+    Wykonuje żądanie z nieblokującym ponawianiem
+
+    Args:
+        upstream: Nazwa upstreamu (np. "openai", "supabase")
+        request_func: Funkcja asynchroniczna wykonująca żądanie
+        max_retries: Maksymalna liczba prób (łącznie z pierwszą)
+        base_delay: Bazowe opóźnienie w sekundach
+        max_delay: Maksymalne opóźnienie w sekundach
+        breaker: Opcjonalny CircuitBreaker sprawdzany przed każdą próbą
+
+    Returns:
+        Any: Wynik request_func
+    """
+    stats = _stats_for(upstream)
+    budget = get_retry_budget(upstream)
+    backoff = DecorrelatedJitterBackoff(base_delay, max_delay)
+
+    stats.requests += 1
+    budget.record_request()
+    attempt = 0
+
+    while True:
+        attempt += 1
+        if breaker is not None:
+            try:
+                breaker.before_call()
+            except Exception:
+                stats.failures += 1
+                raise
+        try:
+            result = await request_func(*args, **kwargs)
+            stats.successes += 1
+            if breaker is not None:
+                breaker.record_success()
+            return result
+        except asyncio.CancelledError:
+            # Przerwane wywołanie nie jest ani sukcesem, ani awarią - zwolnij miejsce próby półotwartej
+            if breaker is not None:
+                breaker.release_probe()
+            raise
+        except Exception as e:
+            classification = classify_error(e)
+            if breaker is not None:
+                # Błędy klienta (4xx) nie świadczą o awarii upstreamu
+                if classification.retryable:
+                    breaker.record_failure()
+                else:
+                    breaker.record_success()
+
+            if not classification.retryable or attempt >= max_retries:
+                stats.failures += 1
+                if classification.retryable:
+                    logger.error(f"Żądanie do {upstream} nie powiodło się po {attempt} próbach: {str(e)}")
+                else:
+                    logger.warning(f"Błąd krytyczny {upstream} ({classification.reason}), bez ponawiania: {str(e)}")
+                raise
+
+            if not budget.try_acquire_retry():
+                stats.failures += 1
+                stats.budget_exhausted += 1
+                logger.warning(f"Budżet ponowień dla {upstream} wyczerpany, rezygnuję: {str(e)}")
+                raise
+
+            delay = backoff.next_delay()
+            if classification.retry_after is not None:
+                delay = max(delay, min(classification.retry_after, max_delay))
+
+            stats.retries += 1
+            stats.retry_wait_seconds += delay
+            stats.reasons[classification.reason] = stats.reasons.get(classification.reason, 0) + 1
+
+            logger.warning(f"Żądanie do {upstream} nie powiodło się (próba {attempt}/{max_retries}, "
+                           f"{classification.reason}): {str(e)}")
+            logger.info(f"Ponowna próba za {delay:.2f} sekund...")
+            await asyncio.sleep(delay)
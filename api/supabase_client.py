@@ -1,18 +1,38 @@
 # api/supabase_client.py
 import logging
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Union
+import httpx
 from supabase import create_client
 from api.base_client import APIClient
-from config import SUPABASE_URL, SUPABASE_KEY
+from config import (
+    SUPABASE_URL, SUPABASE_KEY, SUPABASE_HTTP_TIMEOUT, SUPABASE_HTTP_MAX_CONNECTIONS,
+    SUPABASE_HTTP_MAX_KEEPALIVE, SUPABASE_HTTP_KEEPALIVE_EXPIRY, SUPABASE_HTTP2
+)
 
 logger = logging.getLogger(__name__)
 
+def _http2_available() -> bool:
+    """Sprawdza, czy zainstalowano obsługę HTTP/2 dla httpx (pakiet h2)"""
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
 class SupabaseClient(APIClient):
     """Klient API Supabase z obsługą błędów i ponawianiem"""
     
-    def __init__(self, url: str = SUPABASE_URL, key: str = SUPABASE_KEY, max_retries: int = 3, retry_delay: float = 1.0):
+    upstream = "supabase"
+    
+    def __init__(self, url: str = SUPABASE_URL, key: str = SUPABASE_KEY, max_retries: int = 3, retry_delay: float = 1.0,
+                 http_client: Optional[httpx.AsyncClient] = None):
         super().__init__(max_retries, retry_delay)
         
+        self.url = url
+        self.key = key
+        self.http = http_client or self._create_http_client()
+        
+        # Synchroniczny klient supabase-py pozostaje tylko dla starego kodu korzystającego z niego bezpośrednio
         try:
             self.client = create_client(url, key)
             logger.info("Pomyślnie zainicjalizowano klienta Supabase")
@@ -20,6 +40,32 @@ class SupabaseClient(APIClient):
             logger.error(f"Błąd inicjalizacji klienta Supabase: {e}")
             self.client = self._create_dummy_client()
     
+    def _create_http_client(self) -> Optional[httpx.AsyncClient]:
+        """Tworzy współdzielony, asynchroniczny klient HTTP z pulą połączeń do PostgREST"""
+        if not self.url or not self.key:
+            logger.error("Brak SUPABASE_URL lub SUPABASE_KEY - zapytania do bazy danych będą pomijane")
+            return None
+        
+        use_http2 = SUPABASE_HTTP2 and _http2_available()
+        if SUPABASE_HTTP2 and not use_http2:
+            logger.warning("HTTP/2 niedostępne (brak pakietu h2) - używam HTTP/1.1 z keep-alive")
+        
+        return httpx.AsyncClient(
+            base_url=f"{self.url.rstrip('/')}/rest/v1",
+            headers={
+                "apikey": self.key,
+                "Authorization": f"Bearer {self.key}",
+                "Content-Type": "application/json"
+            },
+            http2=use_http2,
+            timeout=httpx.Timeout(SUPABASE_HTTP_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=SUPABASE_HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=SUPABASE_HTTP_MAX_KEEPALIVE,
+                keepalive_expiry=SUPABASE_HTTP_KEEPALIVE_EXPIRY
+            )
+        )
+    
     def _create_dummy_client(self) -> Any:
         """Tworzy zastępczy klient dla płynnej degradacji"""
         class DummyClient:
@@ -37,41 +83,116 @@ class SupabaseClient(APIClient):
         
         return DummyClient()
     
-    async def query(self, table: str, query_type: str = "select", 
-                   columns: str = "*", filters: Optional[Dict] = None,
-                   data: Optional[Dict] = None, order_by: Optional[str] = None,
-                   limit: Optional[int] = None) -> Dict:
-        """Wykonuje zapytanie do Supabase"""
-        query = self.client.table(table)
+    @staticmethod
+    def _format_filter_value(value: Any) -> str:
+        """Formatuje wartość filtra równości w składni PostgREST"""
+        if value is None:
+            return "is.null"
+        if isinstance(value, bool):
+            return f"eq.{str(value).lower()}"
+        return f"eq.{value}"
+    
+    def _build_params(self, columns: Optional[str] = None, filters: Optional[Dict] = None,
+                      order_by: Optional[str] = None, limit: Optional[int] = None) -> List[tuple]:
+        """Buduje parametry zapytania PostgREST"""
+        params = []
         
-        # Budowanie zapytania
-        if query_type == "select":
-            query = query.select(columns)
-        elif query_type == "insert" and data:
-            query = query.insert(data)
-        elif query_type == "update" and data:
-            query = query.update(data)
-        elif query_type == "delete":
-            query = query.delete()
+        if columns:
+            params.append(("select", columns))
         
-        # Stosowanie filtrów
         if filters:
             for key, value in filters.items():
-                query = query.eq(key, value)
+                params.append((key, self._format_filter_value(value)))
         
-        # Stosowanie sortowania
         if order_by:
             desc = order_by.startswith("-")
             field = order_by[1:] if desc else order_by
-            query = query.order(field, desc=desc)
+            params.append(("order", f"{field}.{'desc' if desc else 'asc'}"))
         
-        # Stosowanie limitu
         if limit:
-            query = query.limit(limit)
+            params.append(("limit", str(limit)))
+        
+        return params
+    
+    async def _execute(self, method: str, path: str, params: Optional[List[tuple]] = None,
+                       json: Optional[Union[Dict, List]] = None, prefer: Optional[str] = None) -> Any:
+        """Wykonuje pojedyncze żądanie HTTP do PostgREST"""
+        headers = {"Prefer": prefer} if prefer else None
+        response = await self.http.request(method, path, params=params, json=json, headers=headers)
+        response.raise_for_status()
+        
+        if not response.content:
+            return []
+        return response.json()
+    
+    async def query(self, table: str, query_type: str = "select", 
+                   columns: str = "*", filters: Optional[Dict] = None,
+                   data: Optional[Union[Dict, List[Dict]]] = None, order_by: Optional[str] = None,
+                   limit: Optional[int] = None, on_conflict: Optional[str] = None) -> List[Dict]:
+        """
+        Wykonuje zapytanie do Supabase
+        
+        Args:
+            on_conflict: kolumna unikalna - wstawienie pomija wiersze, które już istnieją (klucz idempotencji)
+        """
+        if self.http is None:
+            logger.warning("Brak połączenia z bazą danych - pomijam zapytanie")
+            return []
+        
+        # Budowanie zapytania
+        if query_type == "select":
+            method, prefer = "GET", None
+            params = self._build_params(columns, filters, order_by, limit)
+        elif query_type == "insert" and data:
+            method, prefer = "POST", "return=representation"
+            params = self._build_params(columns)
+            if on_conflict:
+                prefer += ",resolution=ignore-duplicates"
+                params.append(("on_conflict", on_conflict))
+        elif query_type == "update" and data:
+            method, prefer = "PATCH", "return=representation"
+            params = self._build_params(columns, filters)
+        elif query_type == "delete":
+            method, prefer = "DELETE", "return=representation"
+            params = self._build_params(columns, filters)
+        else:
+            raise ValueError(f"Nieobsługiwany typ zapytania: {query_type}")
         
         try:
-            response = await self._request_with_retry(query.execute)
-            return response.data
+            return await self._request_with_retry(
+                self._execute, method, f"/{table}", params=params,
+                json=data if query_type in ("insert", "update") else None, prefer=prefer
+            )
         except Exception as e:
             logger.error(f"Błąd zapytania Supabase: {e}")
-            raise
\ No newline at end of file
+            raise
+    
+    async def rpc(self, function_name: str, params: Optional[Dict[str, Any]] = None, retry: bool = True) -> Any:
+        """
+        Wywołuje funkcję Postgres (POST /rpc/<nazwa>)
+        
+        Ponowienia są bezpieczne tylko dla funkcji idempotentnych - funkcje
+        zmieniające dane powinny przyjmować klucz idempotencji (np. p_request_id).
+        
+        Args:
+            retry: False - pojedyncza próba z pominięciem wyłącznika obwodu (wywołania
+                   z własnym limitem czasu, np. odnawianie dzierżawy lidera)
+        """
+        if self.http is None:
+            logger.warning(f"Brak połączenia z bazą danych - pomijam wywołanie {function_name}")
+            return None
+        
+        try:
+            if not retry:
+                return await self._execute("POST", f"/rpc/{function_name}", json=params or {})
+            return await self._request_with_retry(
+                self._execute, "POST", f"/rpc/{function_name}", json=params or {}
+            )
+        except Exception as e:
+            logger.error(f"Błąd wywołania funkcji {function_name} w Supabase: {e}")
+            raise
+    
+    async def close(self) -> None:
+        """Zamyka pulę połączeń HTTP"""
+        if self.http is not None:
+            await self.http.aclose()
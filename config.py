@@ -1,4 +1,6 @@
 import os
+import re
+import socket
 from dotenv import load_dotenv
 
 # Ładowanie zmiennych środowiskowych z pliku .env
@@ -13,11 +15,75 @@ BOT_VERSION = "1.0.0"
 # Konfiguracja Telegram
 TELEGRAM_TOKEN = os.getenv('TELEGRAM_TOKEN')
 
+# Tryb webhook (gdy ustawiono WEBHOOK_URL) - wiele instancji bota za load balancerem zamiast long pollingu
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')  # Publiczny adres bazowy, np. https://bot.example.com
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram/webhook')
+# Sekret weryfikowany w nagłówku X-Telegram-Bot-Api-Secret-Token (wspólny dla wszystkich instancji)
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8080'))
+# Liczba zadań przekazujących odebrane aktualizacje do przetwarzania i rozmiar kolejki wejściowej
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', '4'))
+WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', '10000'))
+# Liczba równoległych połączeń, którymi Telegram dostarcza aktualizacje (1-100)
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', '40'))
+# Czy instancja rejestruje webhook w Telegramie przy starcie
+WEBHOOK_REGISTER = os.getenv('WEBHOOK_REGISTER', 'true').lower() == 'true'
+# Liczba instancji za load balancerem - przy więcej niż jednej WEBHOOK_SECRET jest wymagany
+WEBHOOK_INSTANCES = int(os.getenv('WEBHOOK_INSTANCES', '1'))
+
+# Procesy robocze (shardy): przy SHARD_WORKERS > 1 nadzorca odbiera aktualizacje i kieruje je
+# do procesów według ID użytkownika (spójne haszowanie)
+SHARD_WORKERS = int(os.getenv('SHARD_WORKERS', '0'))
+SHARD_QUEUE_SIZE = int(os.getenv('SHARD_QUEUE_SIZE', '1000'))
+# Po ilu sekundach niedostępności shardu jego użytkownicy trafiają do pozostałych procesów
+SHARD_REBALANCE_AFTER = float(os.getenv('SHARD_REBALANCE_AFTER', '30'))
+# Maksymalna liczba aktualizacji buforowanych na czas restartu procesu roboczego
+SHARD_BUFFER_LIMIT = int(os.getenv('SHARD_BUFFER_LIMIT', '10000'))
+SHARD_METRICS_INTERVAL = float(os.getenv('SHARD_METRICS_INTERVAL', '60'))
+# Numer shardu bieżącego procesu roboczego (ustawiany przez nadzorcę)
+SHARD_ID = os.getenv('BOT_SHARD_ID')
+
+# Identyfikator instancji bota (właściciel dzierżawy lidera i wpisów skrzynki aktualizacji).
+# Stały BOT_INSTANCE_ID wyznacza też pliki zrzutu i skrzynki instancji - domyślny zmienia się przy każdym restarcie
+INSTANCE_ID = os.getenv('BOT_INSTANCE_ID') or f"{socket.gethostname()}-{os.getpid()}"
+
+def _instance_file(path: str, setting: str) -> str:
+    """Dodaje do nazwy pliku stały identyfikator instancji (pliki wczytywane po restarcie)"""
+    if not os.getenv('BOT_INSTANCE_ID'):
+        raise ValueError(
+            f"Ustaw BOT_INSTANCE_ID (stały dla instancji) lub wyłącz {setting} - "
+            "wiele instancji nie może dzielić jednego pliku"
+        )
+    root, ext = os.path.splitext(path)
+    return f"{root}.{re.sub(r'[^A-Za-z0-9_.-]', '_', INSTANCE_ID)}{ext}"
+
+# Wybór lidera w trybie long polling: tylko lider wywołuje getUpdates, pozostałe instancje
+# czekają w gotowości (rezerwa). Wartości: sqlite (jeden host), supabase (wiele hostów), pusta - wyłączony.
+# Skrzynka aktualizacji jest lokalnym plikiem SQLite - przy supabase (instancje na różnych hostach)
+# nie ma gwarancji dokładnie jednokrotnej obsługi: niedokończone aktualizacje lidera, który uległ
+# awarii, wznowi dopiero jego ponowne uruchomienie na tym samym hoście
+LEADER_ELECTION = os.getenv('LEADER_ELECTION', '').lower()
+LEADER_LEASE_NAME = os.getenv('LEADER_LEASE_NAME', 'telegram-polling')
+LEADER_LEASE_FILE = os.getenv('LEADER_LEASE_FILE', 'leader_lease.sqlite3')
+# Czas ważności dzierżawy (sekundy) - po awarii lidera rezerwa przejmuje go najpóźniej po tym czasie
+LEADER_LEASE_TTL = float(os.getenv('LEADER_LEASE_TTL', '6'))
+
 # Konfiguracja OpenAI
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 DEFAULT_MODEL = "gpt-4o"  # Domyślny model OpenAI
 DALL_E_MODEL = "dall-e-3"  # Model do generowania obrazów
 
+# Limity OpenAI organizacji per model (żądania i tokeny na minutę); None = bez limitu.
+# Wartości startowe - klient dostosowuje je do nagłówków x-ratelimit-* z odpowiedzi.
+OPENAI_RATE_LIMITS = {
+    "gpt-3.5-turbo": {"rpm": 3500, "tpm": 160000},
+    "gpt-4": {"rpm": 500, "tpm": 10000},
+    "gpt-4o": {"rpm": 500, "tpm": 30000},
+    "dall-e-3": {"rpm": 7, "tpm": None},
+    "default": {"rpm": 500, "tpm": 30000}
+}
+
 # Predefiniowane szablony promptów
 DEFAULT_SYSTEM_PROMPT = "Jesteś pomocnym asystentem AI."
 
@@ -187,6 +253,13 @@ CHAT_MODES = {
 SUPABASE_URL = os.getenv('SUPABASE_URL')
 SUPABASE_KEY = os.getenv('SUPABASE_KEY')
 
+# Pula połączeń HTTP do PostgREST (współdzielona przez wszystkie repozytoria)
+SUPABASE_HTTP_TIMEOUT = float(os.getenv('SUPABASE_HTTP_TIMEOUT', '10'))
+SUPABASE_HTTP_MAX_CONNECTIONS = int(os.getenv('SUPABASE_HTTP_MAX_CONNECTIONS', '50'))
+SUPABASE_HTTP_MAX_KEEPALIVE = int(os.getenv('SUPABASE_HTTP_MAX_KEEPALIVE', '20'))
+SUPABASE_HTTP_KEEPALIVE_EXPIRY = float(os.getenv('SUPABASE_HTTP_KEEPALIVE_EXPIRY', '30'))
+SUPABASE_HTTP2 = os.getenv('SUPABASE_HTTP2', 'true').lower() == 'true'
+
 # Konfiguracja subskrypcji - zmiana na model ilości wiadomości
 MESSAGE_PLANS = {
     100: {"name": "Pakiet Podstawowy", "price": 25.00},
@@ -195,8 +268,109 @@ MESSAGE_PLANS = {
     1000: {"name": "Pakiet Biznes", "price": 130.00}
 }
 
-# Maksymalna długość kontekstu (historia konwersacji)
-MAX_CONTEXT_MESSAGES = 20
+# Wyłączniki obwodu dla zewnętrznych usług (okno i czasy w sekundach)
+CIRCUIT_BREAKER_SETTINGS = {
+    "default": {"failure_rate_threshold": 0.5, "window": 30.0, "min_calls": 10, "open_timeout": 15.0, "half_open_max_calls": 2},
+    "openai": {"failure_rate_threshold": 0.5, "window": 30.0, "min_calls": 8, "open_timeout": 20.0, "half_open_max_calls": 2},
+    "supabase": {"failure_rate_threshold": 0.5, "window": 20.0, "min_calls": 10, "open_timeout": 10.0, "half_open_max_calls": 3},
+    "payments": {"failure_rate_threshold": 0.5, "window": 60.0, "min_calls": 4, "open_timeout": 30.0, "half_open_max_calls": 1}
+}
+
+# Maksymalna liczba wiadomości historii pobieranych z bazy - o tym, ile z nich
+# trafi do modelu, decyduje budżet tokenów z MODEL_CONTEXT_BUDGETS
+MAX_CONTEXT_MESSAGES = 50
+
+# Czas (w sekundach), po którym nierozliczona rezerwacja kredytów może zostać zwolniona
+CREDIT_RESERVATION_TTL = int(os.getenv('CREDIT_RESERVATION_TTL', '900'))
+# Co ile sekund instancja zwalnia wygasłe rezerwacje (release_expired_credit_reservations)
+CREDIT_RESERVATION_SWEEP_INTERVAL = float(os.getenv('CREDIT_RESERVATION_SWEEP_INTERVAL', '60'))
+
+# Pamięć podręczna sald (TTL w sekundach jako zabezpieczenie przed utraconymi powiadomieniami)
+BALANCE_CACHE_TTL = float(os.getenv('BALANCE_CACHE_TTL', '30'))
+BALANCE_CACHE_MAX_USERS = int(os.getenv('BALANCE_CACHE_MAX_USERS', '50000'))
+# Źródło unieważnień salda: "realtime" (Supabase Realtime) lub "local" (tylko w obrębie procesu)
+BALANCE_INVALIDATION = os.getenv('BALANCE_INVALIDATION', 'realtime').lower()
+REALTIME_HEARTBEAT_INTERVAL = float(os.getenv('REALTIME_HEARTBEAT_INTERVAL', '25'))
+
+# Pamięć podręczna historii: ostatnie N wiadomości per konwersacja, LRU po konwersacjach
+HISTORY_CACHE_MESSAGES = MAX_CONTEXT_MESSAGES
+HISTORY_CACHE_MAX_CONVERSATIONS = int(os.getenv('HISTORY_CACHE_MAX_CONVERSATIONS', '2000'))
+HISTORY_CACHE_MAX_BYTES = int(os.getenv('HISTORY_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+
+# Kolejka zapisów w tle: zapis co N ms lub co M wierszy, plik zrzutu chroni przed utratą przy awarii
+WRITE_BEHIND_FLUSH_INTERVAL_MS = int(os.getenv('WRITE_BEHIND_FLUSH_INTERVAL_MS', '200'))
+WRITE_BEHIND_BATCH_ROWS = int(os.getenv('WRITE_BEHIND_BATCH_ROWS', '100'))
+WRITE_BEHIND_MAX_ROWS = int(os.getenv('WRITE_BEHIND_MAX_ROWS', '10000'))
+WRITE_BEHIND_MAX_RETRIES = int(os.getenv('WRITE_BEHIND_MAX_RETRIES', '5'))
+# Pusta wartość wyłącza plik zrzutu
+WRITE_BEHIND_SPILL_FILE = os.getenv('WRITE_BEHIND_SPILL_FILE', 'write_behind_spill.jsonl')
+if WRITE_BEHIND_SPILL_FILE and SHARD_ID is not None:
+    # Każdy proces roboczy ma własny plik zrzutu
+    _spill_root, _spill_ext = os.path.splitext(WRITE_BEHIND_SPILL_FILE)
+    WRITE_BEHIND_SPILL_FILE = f"{_spill_root}.shard{SHARD_ID}{_spill_ext}"
+if WRITE_BEHIND_SPILL_FILE and (LEADER_ELECTION or WEBHOOK_INSTANCES > 1):
+    # Instancje na jednym hoście nie mogą dzielić pliku zrzutu (przepisanie pliku przez jedną
+    # gubi wiersze drugiej); plik jest wczytywany po restarcie, więc nazwa musi być stała
+    WRITE_BEHIND_SPILL_FILE = _instance_file(WRITE_BEHIND_SPILL_FILE, "WRITE_BEHIND_SPILL_FILE")
+# Wiersze odrzucone przez bazę błędem trwałym (nie są ponawiane); domyślnie obok pliku zrzutu
+WRITE_BEHIND_DEAD_LETTER_FILE = os.getenv('WRITE_BEHIND_DEAD_LETTER_FILE') or (
+    f"{os.path.splitext(WRITE_BEHIND_SPILL_FILE)[0]}.dead.jsonl" if WRITE_BEHIND_SPILL_FILE else None
+)
+
+# Pamięć podręczna aktywnych konwersacji (user_id, theme_id) i okres zbiorczego zapisu last_message_at (sekundy)
+CONVERSATION_CACHE_TTL = float(os.getenv('CONVERSATION_CACHE_TTL', '300'))
+CONVERSATION_CACHE_MAX_ENTRIES = int(os.getenv('CONVERSATION_CACHE_MAX_ENTRIES', '50000'))
+CONVERSATION_TOUCH_INTERVAL = float(os.getenv('CONVERSATION_TOUCH_INTERVAL', '5'))
+
+# Limity edycji wiadomości (Telegram: ok. 1 edycja/s na czat, ok. 30 wiadomości/s na bota)
+EDIT_RATE_PER_CHAT = float(os.getenv('EDIT_RATE_PER_CHAT', '1'))
+EDIT_RATE_GLOBAL = float(os.getenv('EDIT_RATE_GLOBAL', '30'))
+
+# Równoległa obsługa aktualizacji: globalny limit jednocześnie obsługiwanych aktualizacji
+# i limit aktualizacji przyjętych do kolejek (aktualizacje jednego użytkownika są obsługiwane po kolei)
+UPDATE_CONCURRENCY = int(os.getenv('UPDATE_CONCURRENCY', '64'))
+UPDATE_QUEUE_LIMIT = int(os.getenv('UPDATE_QUEUE_LIMIT', '4096'))
+
+# Trwała skrzynka aktualizacji (SQLite): pomijanie powtórnie dostarczonych aktualizacji
+# i wznawianie niedokończonych po restarcie; pusta wartość wyłącza skrzynkę
+UPDATE_INBOX_FILE = os.getenv('UPDATE_INBOX_FILE', 'update_inbox.sqlite3')
+if UPDATE_INBOX_FILE and SHARD_ID is not None:
+    # Każdy proces roboczy ma własną skrzynkę
+    _inbox_root, _inbox_ext = os.path.splitext(UPDATE_INBOX_FILE)
+    UPDATE_INBOX_FILE = f"{_inbox_root}.shard{SHARD_ID}{_inbox_ext}"
+if UPDATE_INBOX_FILE and WEBHOOK_INSTANCES > 1:
+    # Instancja przy starcie przejmuje wszystkie niedokończone wpisy swojej skrzynki - instancje
+    # webhooka nie znają nawzajem swojego stanu, więc każda ma własny plik. Przy wyborze lidera
+    # plik jest wspólny: lider przejmuje wpisy tylko instancji bez ważnej dzierżawy członkostwa
+    UPDATE_INBOX_FILE = _instance_file(UPDATE_INBOX_FILE, "UPDATE_INBOX_FILE")
+# Dziennik nadzorcy shardów: aktualizacja jest zapisywana przed potwierdzeniem jej Telegramowi
+# i oznaczana jako przekazana, gdy proces roboczy zapisze ją we własnej skrzynce
+SHARD_INBOX_FILE = None
+if UPDATE_INBOX_FILE and SHARD_ID is None:
+    _inbox_root, _inbox_ext = os.path.splitext(UPDATE_INBOX_FILE)
+    SHARD_INBOX_FILE = f"{_inbox_root}.supervisor{_inbox_ext}"
+# Jak długo pamiętane są obsłużone update_id (sekundy) i limit prób obsługi jednej aktualizacji
+UPDATE_INBOX_RETENTION = float(os.getenv('UPDATE_INBOX_RETENTION', '86400'))
+UPDATE_INBOX_MAX_ATTEMPTS = int(os.getenv('UPDATE_INBOX_MAX_ATTEMPTS', '3'))
+# Jak długo zatrzymywana aplikacja czeka na zadania w tle (np. generacje) przed zamknięciem klienta bota i skrzynki (sekundy)
+BACKGROUND_TASKS_SHUTDOWN_TIMEOUT = float(os.getenv('BACKGROUND_TASKS_SHUTDOWN_TIMEOUT', '30'))
+
+# Trwały stan użytkowników (tryb, model, język, temat, menu) w SQLite; pusta wartość wyłącza zapis
+BOT_STATE_FILE = os.getenv('BOT_STATE_FILE', 'bot_state.sqlite3')
+if BOT_STATE_FILE and SHARD_ID is not None:
+    _state_root, _state_ext = os.path.splitext(BOT_STATE_FILE)
+    BOT_STATE_FILE = f"{_state_root}.shard{SHARD_ID}{_state_ext}"
+# Co ile sekund zapisywane są zmienione czaty i po ilu sekundach bezczynności czat jest usuwany z pamięci
+BOT_STATE_FLUSH_INTERVAL = float(os.getenv('BOT_STATE_FLUSH_INTERVAL', '5'))
+BOT_STATE_IDLE_TIMEOUT = float(os.getenv('BOT_STATE_IDLE_TIMEOUT', '1800'))
+
+# Budżet tokenów promptu (system + historia + bieżąca wiadomość) dla każdego modelu z AVAILABLE_MODELS
+MODEL_CONTEXT_BUDGETS = {
+    "gpt-3.5-turbo": {"context_window": 16385, "max_prompt_tokens": 6000},
+    "gpt-4": {"context_window": 8192, "max_prompt_tokens": 4000},
+    "gpt-4o": {"context_window": 128000, "max_prompt_tokens": 12000},
+    "default": {"context_window": 8192, "max_prompt_tokens": 4000}
+}
 
 # Program referencyjny
 REFERRAL_CREDITS = 50  # Kredyty za zaproszenie nowego użytkownika
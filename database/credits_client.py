@@ -1,19 +1,42 @@
-from services.api_service import APIService
-from services.repository_service import RepositoryService
+from services.container import container
 
-# Utworzenie globalnych instancji
-api_service = APIService()
-repository_service = RepositoryService(api_service.supabase)
+def __getattr__(name):
+    """Udostępnia współdzielone serwisy pod starymi nazwami globalnymi"""
+    if name == "api_service":
+        return container.api_service
+    if name == "repository_service":
+        return container.repository_service
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # Funkcje dla kompatybilności wstecznej
 async def get_user_credits(user_id):
     """Funkcja dla kompatybilności wstecznej"""
-    return await repository_service.credit_repository.get_user_credits(user_id)
+    return await container.repository_service.credit_repository.get_user_credits(user_id)
 
 async def add_user_credits(user_id, amount, description=None):
     """Funkcja dla kompatybilności wstecznej"""
-    return await repository_service.credit_repository.add_user_credits(user_id, amount, description)
+    return await container.repository_service.credit_repository.add_user_credits(user_id, amount, description)
 
 async def deduct_user_credits(user_id, amount, description=None):
     """Funkcja dla kompatybilności wstecznej"""
-    return await repository_service.credit_repository.deduct_user_credits(user_id, amount, description)
\ No newline at end of file
+    return await container.repository_service.credit_repository.deduct_user_credits(user_id, amount, description)
+
+async def check_user_credits(user_id, amount_needed):
+    """Funkcja dla kompatybilności wstecznej"""
+    return await container.repository_service.credit_repository.check_user_credits(user_id, amount_needed)
+
+async def reserve_user_credits(user_id, amount, description=None):
+    """Blokuje kredyty na czas operacji i zwraca CreditReservation"""
+    return await container.repository_service.credit_repository.reserve_credits(user_id, amount, description)
+
+async def settle_credit_reservation(reservation, amount=None):
+    """Rozlicza rezerwację kredytów"""
+    return await container.repository_service.credit_repository.settle_reservation(reservation, amount)
+
+async def release_credit_reservation(reservation):
+    """Zwalnia rezerwację kredytów"""
+    return await container.repository_service.credit_repository.release_reservation(reservation)
+
+async def get_user_credit_stats(user_id):
+    """Funkcja dla kompatybilności wstecznej"""
+    return await container.repository_service.credit_repository.get_user_credit_stats(user_id)
@@ -1,8 +1,8 @@
 """
 Definicje modeli danych dla bazy danych
 """
-from dataclasses import dataclass
-from datetime import datetime
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
 from typing import Optional, List, Dict, Any
 
 @dataclass
@@ -91,6 +91,7 @@ class Message:
     is_from_user: bool = True
     model_used: Optional[str] = None
     created_at: Optional[datetime] = None
+    client_id: Optional[str] = None  # klucz idempotencji zapisu w tle
     
     @classmethod
     def from_dict(cls, data: Dict[str, Any]) -> 'Message':
@@ -124,4 +125,52 @@ class PromptTemplate:
                     data['created_at'].replace('Z', '+00:00')
                 )
         
-        return cls(**data)
\ No newline at end of file
+        return cls(**data)
+
+@dataclass
+class CreditReservation:
+    """Rezerwacja kredytów na czas trwania operacji AI"""
+    user_id: int
+    amount: int
+    id: Optional[str] = None
+    description: Optional[str] = None
+    status: str = "held"  # held, settled, released, insufficient, error
+    balance: int = 0  # saldo po ostatniej operacji na rezerwacji
+    charged: int = 0
+    error: Optional[Exception] = field(default=None, repr=False)
+    
+    @property
+    def is_held(self) -> bool:
+        """Czy kredyty są zablokowane i czekają na rozliczenie"""
+        return self.status == "held"
+    
+    @property
+    def balance_before(self) -> int:
+        """Saldo sprzed rezerwacji"""
+        if self.status == "settled":
+            return self.balance + self.charged
+        return self.balance + self.amount if self.is_held else self.balance
+
+@dataclass
+class UserSnapshot:
+    """Migawka stanu użytkownika ładowana raz na aktualizację"""
+    user_id: int
+    language: str = "pl"
+    credits: Optional[int] = None
+    subscription_end_date: Optional[datetime] = None
+    conversation: Optional[Conversation] = None
+    current_mode: str = "no_mode"
+    current_model: Optional[str] = None
+    credit_cost: int = 1
+    loaded: bool = False  # False, gdy dane z bazy nie zostały pobrane
+    
+    @property
+    def has_active_subscription(self) -> bool:
+        """Czy użytkownik ma aktywną subskrypcję lub dodatnie saldo kredytów"""
+        if self.subscription_end_date is not None:
+            end_date = self.subscription_end_date
+            if end_date.tzinfo is None:
+                end_date = end_date.replace(tzinfo=timezone.utc)
+            if end_date > datetime.now(timezone.utc):
+                return True
+        return (self.credits or 0) > 0
\ No newline at end of file
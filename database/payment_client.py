@@ -7,6 +7,7 @@ import json
 import requests
 from typing import Dict, List, Optional, Any, Tuple
 from datetime import datetime, timedelta
+from api.circuit_breaker import get_circuit_breaker, CircuitOpenError
 
 logger = logging.getLogger(__name__)
 
@@ -15,6 +16,52 @@ SUPABASE_URL = os.getenv('SUPABASE_URL')
 SUPABASE_KEY = os.getenv('SUPABASE_KEY')
 TELEGRAM_BOT_USERNAME = os.getenv('TELEGRAM_BOT_USERNAME', 'mypremium_bot')
 
+# Limit czasu wywołania Edge Function (sekundy)
+EDGE_FUNCTION_TIMEOUT = 15
+
+PAYMENTS_UNAVAILABLE_MESSAGE = "Płatności są chwilowo niedostępne. Spróbuj ponownie za kilka minut."
+
+def _call_edge_function(function_name: str, payload: Dict[str, Any]) -> requests.Response:
+    """
+    Wywołuje Edge Function Supabase przez wyłącznik obwodu płatności
+    
+    Args:
+        function_name (str): Nazwa funkcji (np. stripe-payment)
+        payload (Dict): Dane przesyłane w treści żądania
+    
+    Returns:
+        requests.Response: Odpowiedź funkcji
+    
+    Raises:
+        CircuitOpenError: Gdy obwód płatności jest otwarty
+    """
+    breaker = get_circuit_breaker("payments")
+    breaker.before_call()
+    
+    try:
+        response = requests.post(
+            f"{SUPABASE_URL}/functions/v1/{function_name}",
+            json=payload,
+            headers={
+                "Authorization": f"Bearer {SUPABASE_KEY}",
+                "Content-Type": "application/json"
+            },
+            timeout=EDGE_FUNCTION_TIMEOUT
+        )
+    except requests.RequestException:
+        breaker.record_failure()
+        raise
+    except BaseException:
+        breaker.release_probe()
+        raise
+    
+    if response.status_code >= 500:
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+    
+    return response
+
 def get_available_payment_methods(user_language: str) -> List[Dict[str, Any]]:
     """
     Pobiera dostępne metody płatności dla określonego języka użytkownika
@@ -125,19 +172,12 @@ def create_stripe_payment(user_id: int, package_id: int, is_subscription: bool =
         function_name = "stripe-subscription" if is_subscription else "stripe-payment"
         
         # Wywołaj Edge Function
-        response = requests.post(
-            f"{SUPABASE_URL}/functions/v1/{function_name}",
-            json={
-                "user_id": user_id,
-                "package_id": package_id,
-                "success_url": success_url,
-                "cancel_url": cancel_url
-            },
-            headers={
-                "Authorization": f"Bearer {SUPABASE_KEY}",
-                "Content-Type": "application/json"
-            }
-        )
+        response = _call_edge_function(function_name, {
+            "user_id": user_id,
+            "package_id": package_id,
+            "success_url": success_url,
+            "cancel_url": cancel_url
+        })
         
         if response.status_code == 200:
             data = response.json()
@@ -147,6 +187,9 @@ def create_stripe_payment(user_id: int, package_id: int, is_subscription: bool =
                 return False, "Błąd: brak URL w odpowiedzi."
         else:
             return False, f"Błąd podczas tworzenia sesji płatności: {response.text}"
+    except CircuitOpenError as e:
+        logger.warning(f"Pominięto tworzenie sesji płatności Stripe: {e}")
+        return False, PAYMENTS_UNAVAILABLE_MESSAGE
     except Exception as e:
         logger.error(f"Wyjątek podczas tworzenia sesji płatności Stripe: {e}")
         return False, f"Wystąpił błąd: {str(e)}"
@@ -209,13 +252,9 @@ def cancel_subscription(subscription_id: int) -> bool:
         # Anuluj subskrypcję w Stripe
         if subscription['payment_method_id'] in [1, 2]:  # Stripe lub Stripe Subskrypcja
             # Wywołaj Edge Function do anulowania subskrypcji
-            cancel_response = requests.post(
-                f"{SUPABASE_URL}/functions/v1/stripe-cancel-subscription",
-                json={"subscription_id": external_subscription_id},
-                headers={
-                    "Authorization": f"Bearer {SUPABASE_KEY}",
-                    "Content-Type": "application/json"
-                }
+            cancel_response = _call_edge_function(
+                "stripe-cancel-subscription",
+                {"subscription_id": external_subscription_id}
             )
             
             if cancel_response.status_code != 200:
@@ -239,6 +278,9 @@ def cancel_subscription(subscription_id: int) -> bool:
         )
         
         return update_response.status_code == 204
+    except CircuitOpenError as e:
+        logger.warning(f"Pominięto anulowanie subskrypcji {subscription_id}: {e}")
+        return False
     except Exception as e:
         logger.error(f"Wyjątek podczas anulowania subskrypcji: {e}")
         return False
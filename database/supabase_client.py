@@ -1,18 +1,50 @@
-from services.api_service import APIService
-from services.repository_service import RepositoryService
+from dataclasses import asdict
+from services.container import container
+from database.models import Conversation
 
-# Utworzenie globalnych instancji
-api_service = APIService()
-repository_service = RepositoryService(api_service.supabase)
+def __getattr__(name):
+    """Udostępnia współdzielone serwisy pod starymi nazwami globalnymi"""
+    if name == "api_service":
+        return container.api_service
+    if name == "repository_service":
+        return container.repository_service
+    if name == "supabase":
+        # Dla bezpośredniego dostępu, jeśli potrzebne
+        return container.api_service.supabase.client
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-# Zmienne dla kompatybilności wstecznej
-supabase = api_service.supabase.client  # Dla bezpośredniego dostępu, jeśli potrzebne
+def get_supabase_client():
+    """Zwraca klienta Supabase bieżącego kontenera (rozwiązywany przy każdym wywołaniu)"""
+    return container.api_service.supabase.client
 
 # Funkcje dla kompatybilności wstecznej
 async def get_or_create_user(user_id, username=None, first_name=None, last_name=None, language_code=None):
     """Funkcja dla kompatybilności wstecznej"""
-    return await repository_service.user_repository.get_or_create(user_id, username, first_name, last_name, language_code)
+    return await container.repository_service.user_repository.get_or_create(user_id, username, first_name, last_name, language_code)
 
 async def get_active_conversation(user_id):
     """Funkcja dla kompatybilności wstecznej"""
-    return await repository_service.conversation_repository.get_active_conversation(user_id)
\ No newline at end of file
+    return await container.repository_service.conversation_repository.get_active_conversation(user_id)
+
+async def get_active_themed_conversation(user_id, theme_id):
+    """Funkcja dla kompatybilności wstecznej"""
+    return await container.repository_service.conversation_repository.get_active_conversation(user_id, theme_id)
+
+async def create_new_conversation(user_id):
+    """Funkcja dla kompatybilności wstecznej - nowa konwersacja staje się aktywną"""
+    conversation_repository = container.repository_service.conversation_repository
+    conversation_repository.invalidate_active_conversation(user_id)
+    return await conversation_repository.create(Conversation(user_id=user_id))
+
+def invalidate_active_conversation(user_id):
+    """Zapomina aktywne konwersacje użytkownika (np. po zmianie tematu)"""
+    container.repository_service.conversation_repository.invalidate_active_conversation(user_id)
+
+async def save_message(conversation_id, user_id, content, is_from_user=True, model_used=None):
+    """Funkcja dla kompatybilności wstecznej"""
+    return await container.repository_service.message_repository.save_message(conversation_id, user_id, content, is_from_user, model_used)
+
+async def get_conversation_history(conversation_id, limit=20):
+    """Funkcja dla kompatybilności wstecznej - zwraca ostatnie wiadomości jako słowniki"""
+    messages = await container.repository_service.message_repository.get_conversation_history(conversation_id, limit)
+    return [asdict(message) for message in messages]
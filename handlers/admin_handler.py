@@ -32,7 +32,8 @@ async def get_user_info(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     # Pobierz informacje o użytkowniku
-    from database.supabase_client import supabase
+    from database.supabase_client import get_supabase_client
+    supabase = get_supabase_client()
     
     response = supabase.table('users').select('*').eq('id', target_user_id).execute()
     
@@ -57,7 +57,8 @@ async def add_package(update: Update, context: ContextTypes.DEFAULT_TYPE):
         price = float(remaining_args[1])
         
         # Dodaj lub aktualizuj pakiet w bazie
-        from database.supabase_client import supabase
+        from database.supabase_client import get_supabase_client
+        supabase = get_supabase_client()
         
         # Sprawdź czy pakiet już istnieje
         response = supabase.table('credit_packages').select('*').eq('id', package_id).execute()
@@ -110,7 +111,8 @@ async def list_packages(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     try:
         # Pobierz pakiety z bazy
-        from database.supabase_client import supabase
+        from database.supabase_client import get_supabase_client
+        supabase = get_supabase_client()
         response = supabase.table('credit_packages').select('*').order('id', desc=False).execute()
         
         if not response.data:
@@ -163,7 +165,8 @@ async def toggle_package(update: Update, context: ContextTypes.DEFAULT_TYPE):
         package_id = int(context.args[0])
         
         # Pobierz pakiet z bazy
-        from database.supabase_client import supabase
+        from database.supabase_client import get_supabase_client
+        supabase = get_supabase_client()
         response = supabase.table('credit_packages').select('*').eq('id', package_id).execute()
         
         if not response.data:
@@ -205,7 +208,8 @@ async def add_default_packages(update: Update, context: ContextTypes.DEFAULT_TYP
         packages = CREDIT_PACKAGES
         
         # Dodaj każdy pakiet do bazy danych
-        from database.supabase_client import supabase
+        from database.supabase_client import get_supabase_client
+        supabase = get_supabase_client()
         added_count = 0
         updated_count = 0
         
@@ -17,7 +17,7 @@ async def restart_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         chat_id = update.effective_chat.id
         
         # Resetowanie konwersacji - tworzymy nową konwersację i czyścimy kontekst
-        conversation = create_new_conversation(user_id)
+        conversation = await create_new_conversation(user_id)
         
         # Zachowujemy wybrane ustawienia użytkownika (język, model)
         user_data = {}
@@ -184,7 +184,7 @@ async def new_chat(update: Update, context: ContextTypes.DEFAULT_TYPE):
     language = get_user_language(context, user_id)
     
     # Utwórz nową konwersację
-    conversation = create_new_conversation(user_id)
+    conversation = await create_new_conversation(user_id)
     
     if conversation:
         # Oznacz czat jako zainicjowany
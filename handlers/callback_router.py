@@ -8,6 +8,7 @@ from telegram.ext import ContextTypes
 from utils.user_utils import get_user_language
 from utils.menu import update_menu, store_menu_state
 from utils.translations import get_text
+from utils.generation_registry import STOP_CALLBACK, generation_registry
 
 logger = logging.getLogger(__name__)
 
@@ -29,6 +30,11 @@ async def route_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Log the callback for debugging
     logger.debug(f"Received callback: {query.data} from user {user_id}")
     
+    # Stop button of an in-flight AI response - acknowledged with its own toast
+    if query.data == STOP_CALLBACK:
+        await query.answer(get_text("generation_stopped_toast", language))
+        return await generation_registry.cancel(user_id, "stop")
+    
     # First, acknowledge the callback to remove waiting state
     await query.answer()
     
@@ -236,6 +242,7 @@ async def route_mode_selection_callback(update: Update, context: ContextTypes.DE
 async def route_quick_action_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Routes quick action callbacks"""
     query = update.callback_query
+    user_id = query.from_user.id
     language = get_user_language(context, user_id)
     
     if query.data == "quick_new_chat":
@@ -244,38 +251,21 @@ async def route_quick_action_callback(update: Update, context: ContextTypes.DEFA
             # Create a new conversation
             from database.supabase_client import create_new_conversation
             from utils.user_utils import mark_chat_initialized
+            from services.user_snapshot import ensure_user_snapshot
             
-            conversation = create_new_conversation(query.from_user.id)
-            mark_chat_initialized(context, query.from_user.id)
+            snapshot = await ensure_user_snapshot(context, user_id)
+            snapshot.conversation = await create_new_conversation(user_id)
+            mark_chat_initialized(context, user_id)
             
             await query.answer(get_text("new_chat_created", language))
             
             # Close the menu
             await query.message.delete()
             
-            # Determine current mode and cost
-            from config import DEFAULT_MODEL, AVAILABLE_MODELS, CHAT_MODES, CREDIT_COSTS
-            user_id = query.from_user.id
-            
-            # Default values
-            current_mode = "no_mode"
-            model_to_use = DEFAULT_MODEL
-            credit_cost = CREDIT_COSTS["message"].get(model_to_use, 1)
-            
-            # Get user's selected mode if available
-            if 'user_data' in context.chat_data and user_id in context.chat_data['user_data']:
-                user_data = context.chat_data['user_data'][user_id]
-                
-                # Check for current mode
-                if 'current_mode' in user_data and user_data['current_mode'] in CHAT_MODES:
-                    current_mode = user_data['current_mode']
-                    model_to_use = CHAT_MODES[current_mode].get("model", DEFAULT_MODEL)
-                    credit_cost = CHAT_MODES[current_mode]["credit_cost"]
-                
-                # Check for current model (overrides mode's model)
-                if 'current_model' in user_data and user_data['current_model'] in AVAILABLE_MODELS:
-                    model_to_use = user_data['current_model']
-                    credit_cost = CREDIT_COSTS["message"].get(model_to_use, CREDIT_COSTS["message"]["default"])
+            # Current mode, model and cost from the user snapshot
+            from config import AVAILABLE_MODELS
+            model_to_use = snapshot.current_model
+            credit_cost = snapshot.credit_cost
             
             # Get friendly model name
             model_name = AVAILABLE_MODELS.get(model_to_use, model_to_use)
@@ -307,8 +297,10 @@ async def route_quick_action_callback(update: Update, context: ContextTypes.DEFA
         try:
             # Get active conversation
             from database.supabase_client import get_active_conversation
+            from services.user_snapshot import ensure_user_snapshot
             
-            conversation = get_active_conversation(query.from_user.id)
+            snapshot = await ensure_user_snapshot(context, user_id)
+            conversation = snapshot.conversation or await get_active_conversation(user_id)
             
             if conversation:
                 await query.answer(get_text("returning_to_last_chat", language, default="Powrót do ostatniej rozmowy"))
@@ -320,7 +312,7 @@ async def route_quick_action_callback(update: Update, context: ContextTypes.DEFA
                 
                 # Create new conversation
                 from database.supabase_client import create_new_conversation
-                create_new_conversation(query.from_user.id)
+                snapshot.conversation = await create_new_conversation(user_id)
                 
                 # Close menu
                 await query.message.delete()
@@ -9,7 +9,7 @@ from database.credits_client import get_user_credits
 from utils.user_utils import get_user_language
 
 # Prosta tymczasowa implementacja funkcji activate_code
-def activate_code(user_id, code):
+async def activate_code(user_id, code):
     """
     Aktywuje kod dla użytkownika (tymczasowa implementacja)
     
@@ -23,11 +23,11 @@ def activate_code(user_id, code):
     # Obsługa przykładowych kodów dla demonstracji
     if code == "DEMO100":
         from database.credits_client import add_user_credits
-        add_user_credits(user_id, 100, f"Aktywacja kodu {code}")
+        await add_user_credits(user_id, 100, f"Aktywacja kodu {code}")
         return True, 100
     elif code == "DEMO500":
         from database.credits_client import add_user_credits
-        add_user_credits(user_id, 500, f"Aktywacja kodu {code}")
+        await add_user_credits(user_id, 500, f"Aktywacja kodu {code}")
         return True, 500
         
     return False, 0
@@ -51,11 +51,11 @@ async def code_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     code = context.args[0].upper()  # Konwertuj na wielkie litery dla spójności
     
     # Aktywuj kod
-    success, credits = activate_code(user_id, code)
+    success, credits = await activate_code(user_id, code)
     
     if success:
         # Pobierz aktualny stan kredytów
-        total_credits = get_user_credits(user_id)
+        total_credits = await get_user_credits(user_id)
         
         await update.message.reply_text(
             get_text("activation_code_success", language, 
@@ -1,3 +1,4 @@
+import asyncio
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 from telegram.constants import ParseMode, ChatAction
@@ -6,12 +7,14 @@ from utils.user_utils import get_user_language
 from utils.menu import update_menu
 from utils.translations import get_text
 from utils.credit_warnings import format_credit_usage_report
-from utils.tips import get_random_tip, should_show_tip
-from database.credits_client import get_user_credits, check_user_credits, deduct_user_credits
-from database.supabase_client import save_message, get_active_conversation, get_conversation_history, increment_messages_used
+from utils.tips import get_random_tip, get_contextual_tip, should_show_tip
+from utils.error_handler import get_operation_error_text
+from database.credits_client import reserve_user_credits, settle_credit_reservation, release_credit_reservation
+from database.supabase_client import save_message, get_active_conversation, get_conversation_history
 from utils.openai_client import generate_image_dall_e, analyze_document, analyze_image, chat_completion_stream, prepare_messages_from_history
-from config import CREDIT_COSTS, MAX_CONTEXT_MESSAGES, CHAT_MODES
-import datetime
+from config import CREDIT_COSTS, MAX_CONTEXT_MESSAGES, CHAT_MODES, DEFAULT_MODEL
+from utils.message_pager import PaginatedStream
+from utils.generation_registry import generation_registry, run_uninterrupted, settle_cancelled_generation, stop_keyboard
 
 async def _process_operation(update, context, operation_type, operation_func, user_id, credit_cost, 
                              process_args, success_handler, error_handler=None):
@@ -19,26 +22,30 @@ async def _process_operation(update, context, operation_type, operation_func, us
     language = get_user_language(context, user_id)
     query = update.callback_query
     
-    # Check user credits
-    credits = get_user_credits(user_id)
-    if not check_user_credits(user_id, credit_cost):
-        error_msg = create_header("Brak wystarczających kredytów", "error") + \
-                    "W międzyczasie twój stan kredytów zmienił się i nie masz już wystarczającej liczby kredytów."
+    # Reserve credits up front - balance check and hold in one atomic call
+    operation_desc = get_text(f"{operation_type}_operation", language, default=operation_type)
+    reservation = await reserve_user_credits(user_id, credit_cost, operation_desc)
+    
+    if not reservation.is_held:
+        if reservation.status == "error":
+            error_msg = create_header(f"Błąd {operation_type}", "error") + get_operation_error_text(reservation.error, language)
+        else:
+            error_msg = create_header("Brak wystarczających kredytów", "error") + \
+                        "W międzyczasie twój stan kredytów zmienił się i nie masz już wystarczającej liczby kredytów."
         await update_menu(query, error_msg, InlineKeyboardMarkup([[InlineKeyboardButton("⬅️ Powrót", callback_data="menu_back_main")]]),
                           parse_mode=ParseMode.MARKDOWN)
         return
     
-    credits_before = credits
+    credits_before = reservation.balance_before
     
     try:
         # Call the operation function with its arguments
         result = await operation_func(**process_args)
         
-        # Deduct credits
-        operation_desc = get_text(f"{operation_type}_operation", language, default=operation_type)
-        deduct_user_credits(user_id, credit_cost, operation_desc)
+        # Settle the reservation - the resulting balance comes back with it
+        await settle_credit_reservation(reservation)
         
-        credits_after = get_user_credits(user_id)
+        credits_after = reservation.balance
         
         # Generate usage report
         usage_report = format_credit_usage_report(operation_type, credit_cost, credits_before, credits_after)
@@ -68,13 +75,12 @@ async def _process_operation(update, context, operation_type, operation_func, us
             )
     
     except Exception as e:
+        await release_credit_reservation(reservation)
         if error_handler:
             await error_handler(e)
         else:
-            error_msg = create_header(f"Błąd {operation_type}", "error") + \
-                      f"Wystąpił błąd podczas operacji: {str(e)}"
-            await update_menu(query, error_msg, InlineKeyboardMarkup([[InlineKeyboardButton("⬅️ Powrót", callback_data="menu_back_main")]]), 
-                             parse_mode=ParseMode.MARKDOWN)
+            error_msg = create_header(f"Błąd {operation_type}", "error") + get_operation_error_text(e, language)
+            await update_menu(query, error_msg, InlineKeyboardMarkup([[InlineKeyboardButton("⬅️ Powrót", callback_data="menu_back_main")]]))
 
 async def handle_image_confirmation(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Obsługuje potwierdzenie generowania obrazu"""
@@ -167,19 +173,11 @@ async def handle_document_confirmation(update: Update, context: ContextTypes.DEF
         credit_cost = CREDIT_COSTS["document"]
         
         async def success_handler(analysis, usage_report, tip_text):
-            result_message = create_header(f"Analiza dokumentu: {file_name}", "document")
-            
-            analysis_excerpt = analysis[:3000]
-            if len(analysis) > 3000:
-                analysis_excerpt += "...\n\n(Analiza została skrócona ze względu na długość)"
-            
-            result_message += analysis_excerpt + f"\n\n{usage_report}{tip_text}"
-            
-            await update_menu(
-                query,
-                result_message,
-                parse_mode=ParseMode.MARKDOWN
-            )
+            # Long analyses are continued in follow-up messages instead of being cut
+            pages = PaginatedStream(query.message, header=create_header(f"Analiza dokumentu: {file_name}", "document"),
+                                    parse_mode=ParseMode.MARKDOWN)
+            await pages.feed(analysis)
+            await pages.finish(f"\n\n{usage_report}{tip_text}")
         
         async def document_operation():
             file = await context.bot.get_file(document_id)
@@ -304,10 +302,35 @@ async def handle_message_confirmation(update: Update, context: ContextTypes.DEFA
                 current_mode = user_data['current_mode']
                 credit_cost = CHAT_MODES[current_mode]["credit_cost"]
         
+        model_to_use = CHAT_MODES[current_mode].get("model", DEFAULT_MODEL)
+        
+        if 'user_data' in context.chat_data and user_id in context.chat_data['user_data']:
+            user_data = context.chat_data['user_data'][user_id]
+            if 'current_model' in user_data:
+                model_to_use = user_data['current_model']
+                credit_cost = CREDIT_COSTS["message"].get(model_to_use, CREDIT_COSTS["message"]["default"])
+        
+        reservation = await reserve_user_credits(
+            user_id, credit_cost,
+            get_text("message_model", language, model=model_to_use, default=f"Wiadomość ({model_to_use})")
+        )
+        
+        if not reservation.is_held:
+            if reservation.status == "error":
+                error_text = get_operation_error_text(reservation.error, language)
+            else:
+                error_text = "W międzyczasie twój stan kredytów zmienił się i nie masz już wystarczającej liczby kredytów."
+            await status_message.edit_text(
+                create_header("Brak wystarczających kredytów", "error") + error_text,
+                parse_mode=ParseMode.MARKDOWN
+            )
+            return
+        
         try:
-            conversation = get_active_conversation(user_id)
-            conversation_id = conversation['id']
+            conversation = await get_active_conversation(user_id)
+            conversation_id = conversation.id
         except Exception as e:
+            await release_credit_reservation(reservation)
             await status_message.edit_text(
                 create_header("Błąd konwersacji", "error") +
                 "Wystąpił błąd przy pobieraniu konwersacji. Spróbuj ponownie.",
@@ -316,72 +339,79 @@ async def handle_message_confirmation(update: Update, context: ContextTypes.DEFA
             return
         
         try:
-            save_message(conversation_id, user_id, user_message, is_from_user=True)
+            await save_message(conversation_id, user_id, user_message, is_from_user=True)
         except Exception as e:
             pass
         
         try:
-            history = get_conversation_history(conversation_id, limit=MAX_CONTEXT_MESSAGES)
+            history = await get_conversation_history(conversation_id, limit=MAX_CONTEXT_MESSAGES)
         except Exception as e:
             history = []
         
-        model_to_use = CHAT_MODES[current_mode].get("model", DEFAULT_MODEL)
-        
-        if 'user_data' in context.chat_data and user_id in context.chat_data['user_data']:
-            user_data = context.chat_data['user_data'][user_id]
-            if 'current_model' in user_data:
-                model_to_use = user_data['current_model']
-                credit_cost = CREDIT_COSTS["message"].get(model_to_use, CREDIT_COSTS["message"]["default"])
-        
         system_prompt = CHAT_MODES[current_mode]["prompt"]
         
-        messages = prepare_messages_from_history(history, user_message, system_prompt)
-        
-        credits_before = get_user_credits(user_id)
+        messages = prepare_messages_from_history(history, user_message, system_prompt, model=model_to_use)
         
-        full_response = ""
-        buffer = ""
-        last_update = datetime.datetime.now().timestamp()
+        credits_before = reservation.balance_before
         
+        stop_markup = stop_keyboard(get_text("stop_generation_btn", language, default="⏹ Stop"))
         try:
             response_message = await status_message.edit_text(
                 create_header("Odpowiedź AI", "chat"),
-                parse_mode=ParseMode.MARKDOWN
+                parse_mode=ParseMode.MARKDOWN,
+                reply_markup=stop_markup
             )
+        except Exception:
+            await release_credit_reservation(reservation)
+            return
+        
+        async def generate(generation):
+            full_response = ""
+            stream = PaginatedStream(response_message, header=create_header("Odpowiedź AI", "chat"),
+                                     parse_mode=ParseMode.MARKDOWN, reply_markup=stop_markup)
             
-            async for chunk in chat_completion_stream(messages, model=model_to_use):
-                full_response += chunk
-                buffer += chunk
+            async def deliver_response():
+                await stream.finish()
                 
-                current_time = datetime.datetime.now().timestamp()
-                if current_time - last_update >= 1.0 or len(buffer) > 100:
-                    try:
-                        await response_message.edit_text(
-                            create_header("Odpowiedź AI", "chat") + full_response + "▌",
-                            parse_mode=ParseMode.MARKDOWN
-                        )
-                        buffer = ""
-                        last_update = current_time
-                    except Exception as e:
-                        pass
+                await save_message(conversation_id, user_id, full_response, is_from_user=False, model_used=model_to_use)
+                
+                await settle_credit_reservation(reservation)
+            
+            async def deliver_stopped():
+                # Charge only for the delivered part of the response
+                await settle_cancelled_generation(reservation, credit_cost, generation.delivered, model_to_use)
+                stopped_text = get_text("generation_stopped", language, default="⏹ _Generowanie przerwane_")
+                if generation.delivered:
+                    await stream.finish(f"\n\n{stopped_text}")
+                    await save_message(conversation_id, user_id, generation.delivered, is_from_user=False, model_used=model_to_use)
+                else:
+                    await stream.cancel()
+                    await response_message.edit_text(create_header("Odpowiedź AI", "chat") + stopped_text,
+                                                     parse_mode=ParseMode.MARKDOWN)
             
             try:
-                await response_message.edit_text(
-                    create_header("Odpowiedź AI", "chat") + full_response,
-                    parse_mode=ParseMode.MARKDOWN
-                )
+                async for chunk in chat_completion_stream(messages, model=model_to_use):
+                    full_response += chunk
+                    await stream.feed(chunk)
+                    generation.delivered = full_response
+            except asyncio.CancelledError:
+                # Generation stopped while streaming
+                await run_uninterrupted(deliver_stopped())
+                return
             except Exception as e:
-                await response_message.edit_text(
-                    create_header("Odpowiedź AI", "chat") + full_response,
-                    parse_mode=None
+                await stream.cancel()
+                await release_credit_reservation(reservation)
+                await status_message.edit_text(
+                    create_header("Błąd odpowiedzi", "error") +
+                    get_text("response_error", language, error=str(e)),
+                    parse_mode=ParseMode.MARKDOWN
                 )
+                return
             
-            save_message(conversation_id, user_id, full_response, is_from_user=False, model_used=model_to_use)
-            
-            deduct_user_credits(user_id, credit_cost, 
-                               get_text("message_model", language, model=model_to_use, default=f"Wiadomość ({model_to_use})"))
+            # The response is complete - a late stop must not leave it unsaved or unsettled
+            await run_uninterrupted(deliver_response())
             
-            credits_after = get_user_credits(user_id)
+            credits_after = reservation.balance
             
             usage_report = format_credit_usage_report(
                 "Wiadomość AI", 
@@ -418,15 +448,8 @@ async def handle_message_confirmation(update: Update, context: ContextTypes.DEFA
                     text=tip_message,
                     parse_mode=ParseMode.MARKDOWN
                 )
-            
-            increment_messages_used(user_id)
-            
-        except Exception as e:
-            await status_message.edit_text(
-                create_header("Błąd odpowiedzi", "error") +
-                get_text("response_error", language, error=str(e)),
-                parse_mode=ParseMode.MARKDOWN
-            )
+        
+        await generation_registry.start(user_id, generate, "generowanie odpowiedzi czatu")
     
     elif query.data == "cancel_operation":
         await update_menu(
@@ -8,6 +8,7 @@ from config import BOT_NAME
 from utils.translations import get_text
 from handlers.menu_handler import get_user_language
 import io
+from dataclasses import asdict
 
 async def export_conversation(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
@@ -26,21 +27,22 @@ async def export_conversation(update: Update, context: ContextTypes.DEFAULT_TYPE
     await update.message.chat.send_action(action=ChatAction.UPLOAD_DOCUMENT)
     
     # Pobierz aktywną konwersację
-    conversation = get_active_conversation(user_id)
+    conversation = await get_active_conversation(user_id)
     
     if not conversation:
         await status_message.edit_text(get_text("conversation_error", language))
         return
     
     # Pobierz historię konwersacji
-    history = get_conversation_history(conversation['id'])
+    history = await get_conversation_history(conversation.id)
     
     if not history:
         await status_message.edit_text(get_text("export_empty", language))
         return
     
     # Pobierz dane użytkownika
-    user_info = get_or_create_user(user_id)
+    user = await get_or_create_user(user_id)
+    user_info = asdict(user) if user else {}
     
     # Generuj PDF
     try:
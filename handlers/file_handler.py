@@ -4,22 +4,30 @@ from handlers.menu_handler import get_user_language
 from telegram.ext import ContextTypes
 from telegram.constants import ParseMode, ChatAction
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
-from database.supabase_client import check_active_subscription
 from utils.openai_client import analyze_document, analyze_image
 from utils.ui_elements import info_card, section_divider, feature_badge, progress_bar
 from utils.visual_styles import style_message, create_header, create_section, create_status_indicator
 from utils.tips import get_random_tip, should_show_tip
 from utils.credit_warnings import check_operation_cost, format_credit_usage_report
-from database.credits_client import check_user_credits, deduct_user_credits, get_user_credits
+from database.credits_client import get_user_credits, reserve_user_credits, settle_credit_reservation, release_credit_reservation
+from utils.error_handler import get_operation_error_text
+from services.user_snapshot import ensure_user_snapshot
+from utils.message_pager import PaginatedStream
 from config import CREDIT_COSTS
 
 async def _check_file_prerequisites(update, context, file_type, file_size_limit=25*1024*1024):
-    """Common prerequisites check for both document and photo handlers"""
+    """
+    Common prerequisites check for both document and photo handlers
+    
+    Returns:
+        int: Current credit balance, or None when the operation cannot proceed
+    """
     user_id = update.effective_user.id
+    snapshot = await ensure_user_snapshot(context, user_id)
     language = get_user_language(context, user_id)
     
     # Check subscription
-    if not check_active_subscription(user_id):
+    if snapshot.loaded and not snapshot.has_active_subscription:
         message = create_header("Subskrypcja wygasła", "warning") + \
                  "Twoja subskrypcja wygasła lub nie masz wystarczającej liczby kredytów, aby wykonać tę operację."
         
@@ -28,7 +36,7 @@ async def _check_file_prerequisites(update, context, file_type, file_size_limit=
             [InlineKeyboardButton("⬅️ " + get_text("back", language, default="Powrót"), callback_data="menu_back_main")]
         ]
         await update.message.reply_text(message, parse_mode=ParseMode.MARKDOWN, reply_markup=InlineKeyboardMarkup(keyboard))
-        return False
+        return None
     
     # Check size limit for documents
     if hasattr(update.message, 'document') and update.message.document and update.message.document.file_size > file_size_limit:
@@ -36,13 +44,13 @@ async def _check_file_prerequisites(update, context, file_type, file_size_limit=
                        f"Maksymalny rozmiar pliku to {file_size_limit/(1024*1024):.1f}MB. Twój plik ma " + \
                        f"{update.message.document.file_size/(1024*1024):.1f}MB."
         await update.message.reply_text(error_message, parse_mode=ParseMode.MARKDOWN)
-        return False
+        return None
     
-    # Check credits
+    # Check credits - a single read; the amount is reserved atomically when the operation starts
     credit_cost = CREDIT_COSTS[file_type]
-    credits = get_user_credits(user_id)
+    credits = snapshot.credits if snapshot.credits is not None else await get_user_credits(user_id)
     
-    if not check_user_credits(user_id, credit_cost):
+    if credits < credit_cost:
         warning_message = create_header("Brak wystarczających kredytów", "warning") + \
                          f"Nie masz wystarczającej liczby kredytów.\n\n" + \
                          f"▪️ Koszt operacji: *{credit_cost}* kredytów\n" + \
@@ -53,9 +61,9 @@ async def _check_file_prerequisites(update, context, file_type, file_size_limit=
             [InlineKeyboardButton("⬅️ " + get_text("back", language, default="Powrót"), callback_data="menu_back_main")]
         ]
         await update.message.reply_text(warning_message, parse_mode=ParseMode.MARKDOWN, reply_markup=InlineKeyboardMarkup(keyboard))
-        return False
+        return None
     
-    return True
+    return credits
 
 async def _handle_file_analysis(update, context, file_id, file_name, file_type, operation_name, 
                               analyze_func, credit_cost, mode="analyze", target_language=None):
@@ -71,7 +79,21 @@ async def _handle_file_analysis(update, context, file_id, file_name, file_type,
     
     await update.message.chat.send_action(action=ChatAction.TYPING)
     
-    credits_before = get_user_credits(user_id)
+    # Reserve credits for the duration of the analysis
+    reservation = await reserve_user_credits(
+        user_id, credit_cost, f"{operation_name}: {file_name if file_type == 'document' else ''}"
+    )
+    
+    if not reservation.is_held:
+        if reservation.status == "error":
+            error_message = create_header("Błąd operacji", "error") + get_operation_error_text(reservation.error, language)
+        else:
+            error_message = create_header("Brak wystarczających kredytów", "error") + \
+                           "W międzyczasie twój stan kredytów zmienił się i nie masz już wystarczającej liczby kredytów."
+        await message.edit_text(error_message, parse_mode=ParseMode.MARKDOWN)
+        return False
+    
+    credits_before = reservation.balance_before
     
     try:
         file = await context.bot.get_file(file_id)
@@ -82,34 +104,31 @@ async def _handle_file_analysis(update, context, file_id, file_name, file_type,
         else:  # photo
             result = await analyze_image(file_bytes, f"photo_{file_id}.jpg", mode, target_language)
         
-        deduct_user_credits(user_id, credit_cost, f"{operation_name}: {file_name if file_type == 'document' else ''}")
+        await settle_credit_reservation(reservation)
         
-        credits_after = get_user_credits(user_id)
+        credits_after = reservation.balance
         
         # Prepare result message with appropriate header
         if mode == "translate":
-            result_message = create_header("Tłumaczenie tekstu", "translation")
+            header = create_header("Tłumaczenie tekstu", "translation")
         elif file_type == "document":
-            result_message = create_header(f"Analiza dokumentu: {file_name}", "document")
+            header = create_header(f"Analiza dokumentu: {file_name}", "document")
         else:
-            result_message = create_header("Analiza zdjęcia", "analysis")
-        
-        # Handle long responses
-        if file_type == "document" and len(result) > 3000:
-            result = result[:3000] + "...\n\n(Analiza została skrócona ze względu na długość)"
-            
-        result_message += result
+            header = create_header("Analiza zdjęcia", "analysis")
         
         # Add usage report
         usage_report = format_credit_usage_report(operation_name, credit_cost, credits_before, credits_after)
-        result_message += f"\n\n{usage_report}"
+        footer = f"\n\n{usage_report}"
         
         # Add tip if appropriate
         if should_show_tip(user_id, context):
             tip = get_random_tip(file_type)
-            result_message += f"\n\n💡 *Porada:* {tip}"
+            footer += f"\n\n💡 *Porada:* {tip}"
         
-        await message.edit_text(result_message, parse_mode=ParseMode.MARKDOWN)
+        # Long results are continued in follow-up messages instead of being cut
+        pages = PaginatedStream(message, header=header, parse_mode=ParseMode.MARKDOWN)
+        await pages.feed(result)
+        await pages.finish(footer)
         
         # Show low credits warning if needed
         if credits_after < 5:
@@ -122,16 +141,16 @@ async def _handle_file_analysis(update, context, file_id, file_name, file_type,
         
         return True
     except Exception as e:
+        await release_credit_reservation(reservation)
         await message.edit_text(
-            create_header("Błąd operacji", "error") +
-            f"Wystąpił błąd podczas {operation_name.lower()}: {str(e)}",
-            parse_mode=ParseMode.MARKDOWN
+            create_header("Błąd operacji", "error") + get_operation_error_text(e, language)
         )
         return False
 
 async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Obsługa przesłanych dokumentów z ulepszoną prezentacją"""
-    if not await _check_file_prerequisites(update, context, "document"):
+    credits = await _check_file_prerequisites(update, context, "document")
+    if credits is None:
         return
     
     user_id = update.effective_user.id
@@ -139,7 +158,6 @@ async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
     document = update.message.document
     file_name = document.file_name
     credit_cost = CREDIT_COSTS["document"]
-    credits = get_user_credits(user_id)
     
     caption = update.message.caption or ""
     caption_lower = caption.lower()
@@ -211,14 +229,14 @@ async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Obsługa przesłanych zdjęć z ulepszoną prezentacją"""
-    if not await _check_file_prerequisites(update, context, "photo"):
+    credits = await _check_file_prerequisites(update, context, "photo")
+    if credits is None:
         return
     
     user_id = update.effective_user.id
     language = get_user_language(context, user_id)
     
     credit_cost = CREDIT_COSTS["photo"]
-    credits = get_user_credits(user_id)
     
     photo = update.message.photo[-1]
     
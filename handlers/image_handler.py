@@ -4,12 +4,13 @@ from telegram.constants import ParseMode, ChatAction
 from config import CREDIT_COSTS, DALL_E_MODEL
 from utils.translations import get_text
 from handlers.menu_handler import get_user_language
-from database.credits_client import check_user_credits, deduct_user_credits, get_user_credits
+from database.credits_client import reserve_user_credits, settle_credit_reservation, release_credit_reservation
 from utils.openai_client import generate_image_dall_e
 from utils.visual_styles import create_header, create_status_indicator
 from utils.credit_warnings import check_operation_cost, format_credit_usage_report
 from utils.tips import get_random_tip, should_show_tip
 from utils.menu import update_menu
+from utils.error_handler import get_operation_error_text
 
 async def generate_image(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Generuje obraz za pomocą DALL-E na podstawie opisu"""
@@ -17,22 +18,6 @@ async def generate_image(update: Update, context: ContextTypes.DEFAULT_TYPE):
     language = get_user_language(context, user_id)
     quality = "standard"
     credit_cost = CREDIT_COSTS["image"][quality]
-    credits = get_user_credits(user_id)
-    
-    if not check_user_credits(user_id, credit_cost):
-        warning_message = create_header("Brak wystarczających kredytów", "warning") + \
-            f"Nie masz wystarczającej liczby kredytów.\n\n" + \
-            f"▪️ Koszt operacji: *{credit_cost}* kredytów\n" + \
-            f"▪️ Twój stan kredytów: *{credits}* kredytów\n\n" + \
-            f"Potrzebujesz jeszcze *{credit_cost - credits}* kredytów."
-        
-        keyboard = [
-            [InlineKeyboardButton("💳 " + get_text("buy_credits_btn", language), callback_data="menu_credits_buy")],
-            [InlineKeyboardButton("⬅️ " + get_text("back", language, default="Powrót"), callback_data="menu_back_main")]
-        ]
-        
-        await update.message.reply_text(warning_message, parse_mode=ParseMode.MARKDOWN, reply_markup=InlineKeyboardMarkup(keyboard))
-        return
     
     if not context.args or len(' '.join(context.args)) < 3:
         usage_message = create_header("Generowanie obrazów", "image") + \
@@ -55,8 +40,37 @@ async def generate_image(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     prompt = ' '.join(context.args)
     
+    # Zablokuj kredyty na czas generowania obrazu
+    reservation = await reserve_user_credits(
+        user_id, credit_cost, get_text("image_generation", language, default="Generowanie obrazu")
+    )
+    
+    if reservation.status == "error":
+        await update.message.reply_text(get_operation_error_text(reservation.error, language))
+        return
+    
+    credits = reservation.balance_before
+    
+    if not reservation.is_held:
+        warning_message = create_header("Brak wystarczających kredytów", "warning") + \
+            f"Nie masz wystarczającej liczby kredytów.\n\n" + \
+            f"▪️ Koszt operacji: *{credit_cost}* kredytów\n" + \
+            f"▪️ Twój stan kredytów: *{credits}* kredytów\n\n" + \
+            f"Potrzebujesz jeszcze *{credit_cost - credits}* kredytów."
+        
+        keyboard = [
+            [InlineKeyboardButton("💳 " + get_text("buy_credits_btn", language), callback_data="menu_credits_buy")],
+            [InlineKeyboardButton("⬅️ " + get_text("back", language, default="Powrót"), callback_data="menu_back_main")]
+        ]
+        
+        await update.message.reply_text(warning_message, parse_mode=ParseMode.MARKDOWN, reply_markup=InlineKeyboardMarkup(keyboard))
+        return
+    
     cost_warning = check_operation_cost(user_id, credit_cost, credits, "Generowanie obrazu", context)
     if cost_warning['require_confirmation'] and cost_warning['level'] in ['warning', 'critical']:
+        # Kredyty zostaną zablokowane ponownie po potwierdzeniu
+        await release_credit_reservation(reservation)
+        
         warning_message = create_header("Potwierdzenie kosztu", "warning") + \
             cost_warning['message'] + "\n\nCzy chcesz kontynuować?"
         
@@ -78,11 +92,18 @@ async def generate_image(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     await update.message.chat.send_action(action=ChatAction.UPLOAD_PHOTO)
     
-    image_url = await generate_image_dall_e(prompt)
+    try:
+        image_url = await generate_image_dall_e(prompt)
+    except Exception:
+        image_url = None
     
+    # Pobierz kredyty tylko za wygenerowany obraz
     credits_before = credits
-    deduct_user_credits(user_id, credit_cost, get_text("image_generation", language, default="Generowanie obrazu"))
-    credits_after = get_user_credits(user_id)
+    if image_url:
+        await settle_credit_reservation(reservation)
+    else:
+        await release_credit_reservation(reservation)
+    credits_after = reservation.balance
     
     if image_url:
         await message.delete()
@@ -130,9 +151,11 @@ async def handle_image_confirmation(update: Update, context: ContextTypes.DEFAUL
         )
         
         credit_cost = CREDIT_COSTS["image"]["standard"]
-        credits = get_user_credits(user_id)
+        reservation = await reserve_user_credits(
+            user_id, credit_cost, get_text("image_generation", language, default="Generowanie obrazu")
+        )
         
-        if not check_user_credits(user_id, credit_cost):
+        if not reservation.is_held:
             await update_menu(
                 query,
                 create_header("Brak wystarczających kredytów", "error") +
@@ -142,10 +165,17 @@ async def handle_image_confirmation(update: Update, context: ContextTypes.DEFAUL
             )
             return
         
-        credits_before = credits
-        image_url = await generate_image_dall_e(prompt)
-        deduct_user_credits(user_id, credit_cost, get_text("image_generation", language, default="Generowanie obrazu"))
-        credits_after = get_user_credits(user_id)
+        credits_before = reservation.balance_before
+        try:
+            image_url = await generate_image_dall_e(prompt)
+        except Exception:
+            image_url = None
+        
+        if image_url:
+            await settle_credit_reservation(reservation)
+        else:
+            await release_credit_reservation(reservation)
+        credits_after = reservation.balance
         
         if image_url:
             caption = create_header("Wygenerowany obraz", "image") + f"*Prompt:* {prompt}\n"
@@ -8,6 +8,7 @@ from utils.translations import get_text
 from utils.user_utils import get_user_language, mark_chat_initialized
 from database.supabase_client import update_user_language, create_new_conversation
 from utils.menu import update_menu, store_menu_state, get_navigation_path
+from services.user_snapshot import ensure_user_snapshot
 
 logger = logging.getLogger(__name__)
 
@@ -91,7 +92,11 @@ async def handle_credits_section(update, context, navigation_path=""):
     user_id = query.from_user.id
     language = get_user_language(context, user_id)
     
-    credits = get_user_credits(user_id)
+    snapshot = await ensure_user_snapshot(context, user_id)
+    credits = snapshot.credits
+    if credits is None:
+        from database.credits_client import get_user_credits
+        credits = await get_user_credits(user_id)
     
     message_text = f"*{navigation_path or get_navigation_path('credits', language)}*\n\n"
     message_text += f"*Stan kredytów*\n\nDostępne kredyty: *{credits}*\n\n*Koszty operacji:*\n"
@@ -308,14 +313,15 @@ async def handle_history_callbacks(update: Update, context: ContextTypes.DEFAULT
     
     if query.data == "history_view":
         from database.supabase_client import get_active_conversation, get_conversation_history
-        conversation = get_active_conversation(user_id)
+        snapshot = await ensure_user_snapshot(context, user_id)
+        conversation = snapshot.conversation or await get_active_conversation(user_id)
         
         if not conversation:
             message_text = get_text("history_no_conversation", language, default="Brak aktywnej konwersacji.")
             await update_menu(query, message_text, InlineKeyboardMarkup([[InlineKeyboardButton("⬅️ Powrót", callback_data="menu_section_history")]]))
             return True
             
-        history = get_conversation_history(conversation['id'])
+        history = await get_conversation_history(conversation.id)
         
         if not history:
             message_text = get_text("history_empty", language, default="Historia jest pusta.")
@@ -341,7 +347,7 @@ async def handle_history_callbacks(update: Update, context: ContextTypes.DEFAULT
     
     elif query.data == "history_new":
         try:
-            conversation = create_new_conversation(user_id)
+            conversation = await create_new_conversation(user_id)
             mark_chat_initialized(context, user_id)
             message_text = "✅ Utworzono nową konwersację."
             await update_menu(query, message_text, InlineKeyboardMarkup([[InlineKeyboardButton("⬅️ Powrót", callback_data="menu_section_history")]]))
@@ -361,7 +367,7 @@ async def handle_history_callbacks(update: Update, context: ContextTypes.DEFAULT
     
     elif query.data == "history_confirm_delete":
         try:
-            conversation = create_new_conversation(user_id)
+            conversation = await create_new_conversation(user_id)
             message_text = "✅ Historia została pomyślnie usunięta."
             await update_menu(query, message_text, InlineKeyboardMarkup([[InlineKeyboardButton("⬅️ Powrót", callback_data="menu_section_history")]]))
         except Exception as e:
@@ -1,24 +1,43 @@
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 from telegram.constants import ParseMode, ChatAction
-from config import CHAT_MODES, DEFAULT_MODEL, MAX_CONTEXT_MESSAGES, CREDIT_COSTS
+from config import CHAT_MODES, MAX_CONTEXT_MESSAGES
 from utils.translations import get_text
-from utils.user_utils import get_user_language, is_chat_initialized, mark_chat_initialized
-from database.supabase_client import (
-    get_active_conversation, save_message, get_conversation_history, increment_messages_used
-)
-from database.credits_client import get_user_credits, check_user_credits, deduct_user_credits
+from utils.user_utils import get_user_language_async, is_chat_initialized, mark_chat_initialized
+from database.supabase_client import get_active_conversation, save_message, get_conversation_history
+from database.credits_client import reserve_user_credits, settle_credit_reservation, release_credit_reservation
 from utils.openai_client import chat_completion_stream, prepare_messages_from_history
 from utils.visual_styles import create_header, create_status_indicator
 from utils.credit_warnings import check_operation_cost, format_credit_usage_report
 from utils.tips import get_contextual_tip, get_random_tip, should_show_tip
-import datetime
+from utils.error_handler import get_operation_error_text
+from utils.background import run_in_background
+from services.user_snapshot import ensure_user_snapshot
+from utils.message_pager import PaginatedStream
+from utils.generation_registry import generation_registry, run_uninterrupted, settle_cancelled_generation, stop_keyboard
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+async def _load_conversation_context(user_id, conversation=None):
+    """Pobiera aktywną konwersację (jeśli nie ma jej w migawce) i jej historię"""
+    if conversation is None:
+        conversation = await get_active_conversation(user_id)
+    try:
+        history = await get_conversation_history(conversation.id, limit=MAX_CONTEXT_MESSAGES)
+    except Exception as e:
+        # Odpowiedź bez kontekstu jest lepsza niż brak odpowiedzi, ale błąd musi być widoczny w logach
+        logger.error(f"Błąd pobierania historii konwersacji {conversation.id}: {e}")
+        history = []
+    return conversation, history
 
 async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Obsługa wiadomości tekstowych od użytkownika ze strumieniowaniem odpowiedzi i ulepszonym formatowaniem"""
     user_id = update.effective_user.id
     user_message = update.message.text
-    language = get_user_language(context, user_id)
+    snapshot = await ensure_user_snapshot(context, user_id)
+    language = await get_user_language_async(context, user_id)
     
     # Sprawdź, czy użytkownik zainicjował czat
     if not is_chat_initialized(context, user_id):
@@ -43,21 +62,34 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
     
-    # Określ tryb i koszt kredytów
-    current_mode = "no_mode"
-    credit_cost = 1
+    # Tryb, model i koszt kredytów z migawki użytkownika
+    current_mode = snapshot.current_mode
+    model_to_use = snapshot.current_model
+    credit_cost = snapshot.credit_cost
+    
+    # Etap przygotowania - niezależne operacje wykonywane równolegle:
+    # blokada kredytów (sprawdzenie salda i blokada w jednym wywołaniu) oraz konwersacja z historią
+    reservation, conversation_context = await asyncio.gather(
+        reserve_user_credits(
+            user_id, credit_cost,
+            get_text("message_model", language, model=model_to_use, default=f"Wiadomość ({model_to_use})")
+        ),
+        _load_conversation_context(user_id, snapshot.conversation),
+        return_exceptions=True
+    )
+    
+    if isinstance(reservation, Exception):
+        await update.message.reply_text(get_operation_error_text(reservation, language))
+        return
     
-    if 'user_data' in context.chat_data and user_id in context.chat_data['user_data']:
-        user_data = context.chat_data['user_data'][user_id]
-        if 'current_mode' in user_data and user_data['current_mode'] in CHAT_MODES:
-            current_mode = user_data['current_mode']
-            credit_cost = CHAT_MODES[current_mode]["credit_cost"]
+    if reservation.status == "error":
+        await update.message.reply_text(get_operation_error_text(reservation.error, language))
+        return
     
-    # Get current credits
-    credits = get_user_credits(user_id)
+    credits = reservation.balance_before
     
     # Sprawdź, czy użytkownik ma wystarczającą liczbę kredytów
-    if not check_user_credits(user_id, credit_cost):
+    if not reservation.is_held:
         # Enhanced credit warning with visual indicators
         warning_message = create_header("Niewystarczające kredyty", "warning")
         warning_message += (
@@ -69,7 +101,7 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         # Add credit recommendation if available
         from utils.credit_warnings import get_credit_recommendation
-        recommendation = get_credit_recommendation(user_id, context)
+        recommendation = await get_credit_recommendation(user_id, context)
         if recommendation:
             from utils.visual_styles import create_section
             warning_message += "\n\n" + create_section("Rekomendowany pakiet", 
@@ -93,6 +125,9 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Check operation cost and show warning if needed
     cost_warning = check_operation_cost(user_id, credit_cost, credits, "Wiadomość AI", context)
     if cost_warning['require_confirmation'] and cost_warning['level'] in ['warning', 'critical']:
+        # Kredyty zostaną zablokowane ponownie po potwierdzeniu
+        await release_credit_reservation(reservation)
+        
         # Show warning and ask for confirmation
         warning_message = create_header("Potwierdzenie kosztu", "warning")
         warning_message += cost_warning['message'] + "\n\nCzy chcesz kontynuować?"
@@ -121,99 +156,99 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
     
-    # Pobierz lub utwórz aktywną konwersację
-    try:
-        conversation = get_active_conversation(user_id)
-        conversation_id = conversation['id']
-    except Exception as e:
+    # Aktywna konwersacja i historia pobrane w etapie przygotowania
+    if isinstance(conversation_context, Exception):
+        await release_credit_reservation(reservation)
         await update.message.reply_text(get_text("conversation_error", language))
         return
     
-    # Zapisz wiadomość użytkownika do bazy danych
-    try:
-        save_message(conversation_id, user_id, user_message, is_from_user=True)
-    except Exception as e:
-        pass
-    
-    # Wyślij informację, że bot pisze
-    await update.message.chat.send_action(action=ChatAction.TYPING)
-    
-    # Pobierz historię konwersacji
-    try:
-        history = get_conversation_history(conversation_id, limit=MAX_CONTEXT_MESSAGES)
-    except Exception as e:
-        history = []
+    conversation, history = conversation_context
+    conversation_id = conversation.id
     
-    # Określ model do użycia - domyślny lub z trybu czatu
-    model_to_use = CHAT_MODES[current_mode].get("model", DEFAULT_MODEL)
+    # Zapisz wiadomość użytkownika w tle - zapis nie blokuje generowania odpowiedzi
+    user_message_saved = run_in_background(
+        save_message(conversation_id, user_id, user_message, is_from_user=True),
+        "zapis wiadomości użytkownika"
+    )
     
-    # Jeśli użytkownik wybrał konkretny model, użyj go
-    if 'user_data' in context.chat_data and user_id in context.chat_data['user_data']:
-        user_data = context.chat_data['user_data'][user_id]
-        if 'current_model' in user_data:
-            model_to_use = user_data['current_model']
-            # Aktualizuj koszt kredytów na podstawie modelu
-            credit_cost = CREDIT_COSTS["message"].get(model_to_use, CREDIT_COSTS["message"]["default"])
+    # Wyślij informację, że bot pisze
+    run_in_background(update.message.chat.send_action(action=ChatAction.TYPING), "akcja pisania")
     
     # Przygotuj system prompt z wybranego trybu
     system_prompt = CHAT_MODES[current_mode]["prompt"]
     
     # Przygotuj wiadomości dla API OpenAI
-    messages = prepare_messages_from_history(history, user_message, system_prompt)
-    
-    # Wyślij początkową pustą wiadomość, którą będziemy aktualizować
-    response_message = await update.message.reply_text(get_text("generating_response", language))
+    messages = prepare_messages_from_history(history, user_message, system_prompt, model=model_to_use)
     
-    # Zainicjuj pełną odpowiedź
-    full_response = ""
-    buffer = ""
-    last_update = datetime.datetime.now().timestamp()
+    # Wyślij początkową pustą wiadomość, którą będziemy aktualizować (z przyciskiem przerwania)
+    stop_markup = stop_keyboard(get_text("stop_generation_btn", language, default="⏹ Stop"))
+    response_message = await update.message.reply_text(get_text("generating_response", language), reply_markup=stop_markup)
     
-    # Spróbuj wygenerować odpowiedź
-    try:
-        # Generuj odpowiedź strumieniowo
-        async for chunk in chat_completion_stream(messages, model=model_to_use):
-            full_response += chunk
-            buffer += chunk
+    # Generacja działa w tle - kolejne aktualizacje użytkownika (Stop, /newchat, nowa wiadomość) mogą ją przerwać
+    async def generate(generation):
+        # Zainicjuj pełną odpowiedź
+        full_response = ""
+        
+        # Edycje wiadomości przechodzą przez wspólny harmonogram (limity Telegrama);
+        # odpowiedzi dłuższe niż 4096 znaków są kontynuowane w kolejnych wiadomościach
+        stream = PaginatedStream(response_message, parse_mode=ParseMode.MARKDOWN, reply_markup=stop_markup)
+        
+        async def deliver_response():
+            # Aktualizuj wiadomość z pełną odpowiedzią bez kursora
+            await stream.finish()
             
-            # Aktualizuj wiadomość co 1 sekundę lub gdy bufor jest wystarczająco duży
-            current_time = datetime.datetime.now().timestamp()
-            if current_time - last_update >= 1.0 or len(buffer) > 100:
-                try:
-                    # Dodaj migający kursor na końcu wiadomości
-                    await response_message.edit_text(full_response + "▌", parse_mode=ParseMode.MARKDOWN)
-                    buffer = ""
-                    last_update = current_time
-                except Exception as e:
-                    pass
+            # Zapisz odpowiedź do bazy danych (po wiadomości użytkownika, aby zachować kolejność)
+            await asyncio.wait([user_message_saved])
+            await save_message(conversation_id, user_id, full_response, is_from_user=False, model_used=model_to_use)
+            
+            # Rozlicz zablokowane kredyty
+            await settle_credit_reservation(reservation)
+        
+        async def deliver_stopped():
+            # Kredyty tylko za dostarczoną część odpowiedzi
+            await settle_cancelled_generation(reservation, credit_cost, generation.delivered, model_to_use)
+            stopped_text = get_text("generation_stopped", language, default="⏹ _Generowanie przerwane_")
+            if generation.delivered:
+                await stream.finish(f"\n\n{stopped_text}")
+                await asyncio.wait([user_message_saved])
+                await save_message(conversation_id, user_id, generation.delivered, is_from_user=False, model_used=model_to_use)
+            else:
+                await stream.cancel()
+                await response_message.edit_text(stopped_text, parse_mode=ParseMode.MARKDOWN)
         
-        # Aktualizuj wiadomość z pełną odpowiedzią bez kursora
+        # Spróbuj wygenerować odpowiedź
         try:
-            await response_message.edit_text(full_response, parse_mode=ParseMode.MARKDOWN)
+            # Generuj odpowiedź strumieniowo
+            async for chunk in chat_completion_stream(messages, model=model_to_use):
+                full_response += chunk
+                
+                # Ostatnia wiadomość dostaje nowy fragment z migającym kursorem
+                await stream.feed(chunk)
+                generation.delivered = full_response
+        except asyncio.CancelledError:
+            # Przerwano generację w trakcie strumienia odpowiedzi
+            await run_uninterrupted(deliver_stopped())
+            return
         except Exception as e:
-            await response_message.edit_text(full_response)
+            await stream.cancel()
+            await release_credit_reservation(reservation)
+            await response_message.edit_text(get_operation_error_text(e, language))
+            return
         
-        # Zapisz odpowiedź do bazy danych
-        save_message(conversation_id, user_id, full_response, is_from_user=False, model_used=model_to_use)
+        # Odpowiedź jest kompletna - przerwanie nie może już zostawić jej niezapisanej lub nierozliczonej
+        await run_uninterrupted(deliver_response())
         
-        # Odejmij kredyty
-        deduct_user_credits(user_id, credit_cost, get_text("message_model", language, model=model_to_use, default=f"Wiadomość ({model_to_use})"))
-    except Exception as e:
-        await response_message.edit_text(get_text("response_error", language, error=str(e)))
-        return
-    
-    # Sprawdź aktualny stan kredytów
-    credits = get_user_credits(user_id)
-    if credits < 5:
-        # Dodaj przycisk doładowania kredytów
-        keyboard = [[InlineKeyboardButton(get_text("buy_credits_btn_with_icon", language, default="🛒 Kup kredyty"), callback_data="menu_credits_buy")]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        await update.message.reply_text(
-            f"*{get_text('low_credits_warning', language)}* {get_text('low_credits_message', language, credits=credits)}",
-            reply_markup=reply_markup,
-            parse_mode=ParseMode.MARKDOWN
-        )
+        # Stan kredytów po rozliczeniu jest znany z rezerwacji
+        credits = reservation.balance
+        if credits < 5:
+            # Dodaj przycisk doładowania kredytów
+            keyboard = [[InlineKeyboardButton(get_text("buy_credits_btn_with_icon", language, default="🛒 Kup kredyty"), callback_data="menu_credits_buy")]]
+            reply_markup = InlineKeyboardMarkup(keyboard)
+            
+            await update.message.reply_text(
+                f"*{get_text('low_credits_warning', language)}* {get_text('low_credits_message', language, credits=credits)}",
+                reply_markup=reply_markup,
+                parse_mode=ParseMode.MARKDOWN
+            )
     
-    # Zwiększ licznik wykorzystanych wiadomości
-    increment_messages_used(user_id)
\ No newline at end of file
+    await generation_registry.start(user_id, generate, "generowanie odpowiedzi czatu")
@@ -152,7 +152,7 @@ async def handle_mode_selection(update: Update, context: ContextTypes.DEFAULT_TY
     
     # Utwórz nową konwersację dla wybranego trybu
     try:
-        conversation = create_new_conversation(user_id)
+        conversation = await create_new_conversation(user_id)
         
         # Oznacz czat jako zainicjowany
         mark_chat_initialized(context, user_id)
@@ -46,7 +46,7 @@ async def handle_pdf_translation(update: Update, context: ContextTypes.DEFAULT_T
     result = await translate_pdf_first_paragraph(file_bytes)
     
     # Odejmij kredyty
-    deduct_user_credits(user_id, credit_cost, f"Tłumaczenie pliku PDF: {file_name}")
+    await deduct_user_credits(user_id, credit_cost, f"Tłumaczenie pliku PDF: {file_name}")
     
     # Przygotuj odpowiedź
     if result["success"]:
@@ -4,7 +4,7 @@ from telegram.ext import ContextTypes
 from telegram.constants import ParseMode
 from database.supabase_client import (
     create_conversation_theme, get_user_themes, 
-    get_theme_by_id, get_active_themed_conversation
+    get_theme_by_id, get_active_themed_conversation, invalidate_active_conversation
 )
 from utils.translations import get_text
 from handlers.menu_handler import get_user_language
@@ -58,7 +58,7 @@ async def create_new_theme(update: Update, context: ContextTypes.DEFAULT_TYPE, t
     context.chat_data['user_data'][user_id]['current_theme_name'] = theme['theme_name']
     
     # Utwórz konwersację dla tego tematu
-    conversation = get_active_themed_conversation(user_id, theme['id'])
+    conversation = await get_active_themed_conversation(user_id, theme['id'])
     
     # Odpowiedz użytkownikowi
     await update.message.reply_text(
@@ -152,7 +152,7 @@ async def handle_theme_callback(update: Update, context: ContextTypes.DEFAULT_TY
         
         # Utwórz nową konwersację bez tematu
         from database.supabase_client import create_new_conversation
-        conversation = create_new_conversation(user_id)
+        conversation = await create_new_conversation(user_id)
         
         await query.edit_message_text(
             "✅ Przełączono na rozmowę bez tematu.\n\n"
@@ -184,7 +184,8 @@ async def handle_theme_callback(update: Update, context: ContextTypes.DEFAULT_TY
         context.chat_data['user_data'][user_id]['current_theme_name'] = theme['theme_name']
         
         # Pobierz aktywną konwersację dla tego tematu
-        conversation = get_active_themed_conversation(user_id, theme['id'])
+        invalidate_active_conversation(user_id)
+        conversation = await get_active_themed_conversation(user_id, theme['id'])
         
         await query.edit_message_text(
             f"✅ Przełączono na temat: *{theme['theme_name']}*\n\n"
@@ -210,7 +211,7 @@ async def notheme_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     # Utwórz nową konwersację bez tematu
     from database.supabase_client import create_new_conversation
-    conversation = create_new_conversation(user_id)
+    conversation = await create_new_conversation(user_id)
     
     await update.message.reply_text(
         "✅ Przełączono na rozmowę bez tematu.\n\n"
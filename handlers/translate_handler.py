@@ -5,6 +5,7 @@ from utils.translations import get_text
 from utils.openai_client import analyze_image, analyze_document
 from database.credits_client import check_user_credits, deduct_user_credits, get_user_credits
 from handlers.menu_handler import get_user_language
+from utils.edit_scheduler import edit_scheduler
 import re
 
 
@@ -66,7 +67,7 @@ async def translate_photo(update: Update, context: ContextTypes.DEFAULT_TYPE, ph
     
     # Sprawdź, czy użytkownik ma wystarczającą liczbę kredytów
     credit_cost = 8  # Koszt tłumaczenia zdjęcia
-    if not check_user_credits(user_id, credit_cost):
+    if not await check_user_credits(user_id, credit_cost):
         await update.message.reply_text(get_text("subscription_expired", language))
         return
     
@@ -86,16 +87,17 @@ async def translate_photo(update: Update, context: ContextTypes.DEFAULT_TYPE, ph
     result = await analyze_image(file_bytes, f"photo_{photo.file_unique_id}.jpg", mode="translate", target_language=target_lang)
     
     # Odejmij kredyty
-    deduct_user_credits(user_id, credit_cost, f"Tłumaczenie tekstu ze zdjęcia na język {target_lang}")
+    await deduct_user_credits(user_id, credit_cost, f"Tłumaczenie tekstu ze zdjęcia na język {target_lang}")
     
     # Wyślij tłumaczenie
-    await message.edit_text(
+    await edit_scheduler.edit(
+        message,
         f"*{get_text('translation_result', language, default='Wynik tłumaczenia')}*\n\n{result}",
         parse_mode=ParseMode.MARKDOWN
     )
     
     # Sprawdź aktualny stan kredytów
-    credits = get_user_credits(user_id)
+    credits = await get_user_credits(user_id)
     if credits < 5:
         await update.message.reply_text(
             f"{get_text('low_credits_warning', language)} {get_text('low_credits_message', language, credits=credits)}",
@@ -109,7 +111,7 @@ async def translate_document(update: Update, context: ContextTypes.DEFAULT_TYPE,
     
     # Sprawdź, czy użytkownik ma wystarczającą liczbę kredytów
     credit_cost = 8  # Koszt tłumaczenia dokumentu
-    if not check_user_credits(user_id, credit_cost):
+    if not await check_user_credits(user_id, credit_cost):
         await update.message.reply_text(get_text("subscription_expired", language))
         return
     
@@ -136,16 +138,17 @@ async def translate_document(update: Update, context: ContextTypes.DEFAULT_TYPE,
     result = await analyze_document(file_bytes, file_name, mode="translate", target_language=target_lang)
     
     # Odejmij kredyty
-    deduct_user_credits(user_id, credit_cost, f"Tłumaczenie dokumentu na język {target_lang}: {file_name}")
+    await deduct_user_credits(user_id, credit_cost, f"Tłumaczenie dokumentu na język {target_lang}: {file_name}")
     
     # Wyślij tłumaczenie
-    await message.edit_text(
+    await edit_scheduler.edit(
+        message,
         f"*{get_text('translation_result', language, default='Wynik tłumaczenia')}*\n\n{result}",
         parse_mode=ParseMode.MARKDOWN
     )
     
     # Sprawdź aktualny stan kredytów
-    credits = get_user_credits(user_id)
+    credits = await get_user_credits(user_id)
     if credits < 5:
         await update.message.reply_text(
             f"{get_text('low_credits_warning', language)} {get_text('low_credits_message', language, credits=credits)}",
@@ -161,7 +164,7 @@ async def translate_text(update: Update, context: ContextTypes.DEFAULT_TYPE, tex
     
     # Sprawdź, czy użytkownik ma wystarczającą liczbę kredytów
     credit_cost = 3  # Koszt tłumaczenia tekstu
-    if not check_user_credits(user_id, credit_cost):
+    if not await check_user_credits(user_id, credit_cost):
         await update.message.reply_text(get_text("subscription_expired", language))
         return
     
@@ -189,19 +192,20 @@ async def translate_text(update: Update, context: ContextTypes.DEFAULT_TYPE, tex
     translation = await chat_completion(messages, model="gpt-3.5-turbo")
     
     # Odejmij kredyty
-    deduct_user_credits(user_id, credit_cost, f"Translation to {target_lang}")
+    await deduct_user_credits(user_id, credit_cost, f"Translation to {target_lang}")
     
     # Wyślij tłumaczenie
     source_lang_name = get_language_name(language)
     target_lang_name = get_language_name(target_lang)
     
-    await message.edit_text(
+    await edit_scheduler.edit(
+        message,
         f"*{get_text('translation_result', language, default='Translation result')}* ({source_lang_name} → {target_lang_name})\n\n{translation}",
         parse_mode=ParseMode.MARKDOWN
     )
     
     # Sprawdź aktualny stan kredytów
-    credits = get_user_credits(user_id)
+    credits = await get_user_credits(user_id)
     if credits < 5:
         await update.message.reply_text(
             f"{get_text('low_credits_warning', language)} {get_text('low_credits_message', language, credits=credits)}",
@@ -8,8 +8,18 @@ os.environ["HTTPX_SKIP_PROXY"] = "true"
 
 import logging
 logging.basicConfig(level=logging.INFO)
-from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, filters
-from config import TELEGRAM_TOKEN
+from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, TypeHandler, filters
+from config import TELEGRAM_TOKEN, UPDATE_CONCURRENCY, UPDATE_QUEUE_LIMIT
+from config import BOT_STATE_FILE, BOT_STATE_FLUSH_INTERVAL, BOT_STATE_IDLE_TIMEOUT
+from config import (
+    WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_HOST, WEBHOOK_PORT,
+    WEBHOOK_WORKERS, WEBHOOK_QUEUE_SIZE, WEBHOOK_MAX_CONNECTIONS, WEBHOOK_REGISTER, WEBHOOK_INSTANCES
+)
+from config import INSTANCE_ID, LEADER_ELECTION, LEADER_LEASE_NAME, LEADER_LEASE_FILE, LEADER_LEASE_TTL
+from config import (
+    SHARD_WORKERS, SHARD_QUEUE_SIZE, SHARD_REBALANCE_AFTER, SHARD_BUFFER_LIMIT, SHARD_METRICS_INTERVAL,
+    SHARD_INBOX_FILE
+)
 from telegram import Update
 from telegram.ext import ContextTypes
 
@@ -49,8 +59,47 @@ from handlers.file_handler import handle_document, handle_photo
 # Import centralnego routera callbacków
 from handlers.callback_router import route_callback
 
+# Współdzielone serwisy (klienci API, pule połączeń, repozytoria)
+from services.container import container
+from services.user_snapshot import load_user_snapshot
+from services.repository_service import begin_update_unit_of_work, end_update_unit_of_work, UNIT_OF_WORK_FLUSH_GROUP
+from utils.generation_registry import cancel_superseded_generation
+from services.update_processor import PerUserUpdateProcessor
+from services.state_persistence import SqlitePersistence
+from services.update_inbox import (
+    claim_update, complete_update, InboxUpdateQueue, UPDATE_INBOX_GROUP, UPDATE_INBOX_COMPLETE_GROUP
+)
+
 # Inicjalizacja aplikacji
-application = Application.builder().token(TELEGRAM_TOKEN).build()
+builder = (
+    Application.builder()
+    .token(TELEGRAM_TOKEN)
+    # Pobrane aktualizacje zapisywane w skrzynce przed kolejkowaniem (przetrwają awarię procesu)
+    .update_queue(InboxUpdateQueue())
+    # Różni użytkownicy obsługiwani równolegle, aktualizacje jednego użytkownika po kolei
+    .concurrent_updates(PerUserUpdateProcessor(UPDATE_CONCURRENCY, UPDATE_QUEUE_LIMIT))
+    .post_init(container.startup)
+    .post_stop(container.stop)
+    .post_shutdown(container.shutdown)
+)
+if BOT_STATE_FILE:
+    # Ustawienia użytkowników (context.chat_data) przetrwają restart
+    builder = builder.persistence(SqlitePersistence(BOT_STATE_FILE, BOT_STATE_FLUSH_INTERVAL, BOT_STATE_IDLE_TIMEOUT))
+application = builder.build()
+
+# Trwała skrzynka aktualizacji - rozpoczyna obsługę przed wszystkimi handlerami, potwierdza po zapisie zmian
+application.add_handler(TypeHandler(Update, claim_update), group=UPDATE_INBOX_GROUP)
+application.add_handler(TypeHandler(Update, complete_update), group=UPDATE_INBOX_COMPLETE_GROUP)
+
+# Przerwanie trwającej generacji odpowiedzi zastąpionej przez bieżącą aktualizację
+application.add_handler(TypeHandler(Update, cancel_superseded_generation), group=-3)
+
+# Jednostka pracy aktualizacji (mapa tożsamości odczytów, zbiorcze zapisy)
+application.add_handler(TypeHandler(Update, begin_update_unit_of_work), group=-2)
+application.add_handler(TypeHandler(Update, end_update_unit_of_work), group=UNIT_OF_WORK_FLUSH_GROUP)
+
+# Migawka użytkownika ładowana raz na aktualizację, przed wszystkimi handlerami
+application.add_handler(TypeHandler(Update, load_user_snapshot), group=-1)
 
 # Rejestracja handlerów komend
 application.add_handler(CommandHandler("start", start_command))
@@ -93,4 +142,36 @@ application.add_handler(MessageHandler(filters.PHOTO, handle_photo))
 # Uruchomienie bota
 if __name__ == "__main__":
     print("Bot uruchomiony. Naciśnij Ctrl+C, aby zatrzymać.")
-    application.run_polling()
\ No newline at end of file
+    if SHARD_WORKERS > 1:
+        # Nadzorca z procesami roboczymi - użytkownik zawsze obsługiwany przez ten sam proces
+        import asyncio
+        from services.sharding import serve_sharded
+        webhook = None
+        if WEBHOOK_URL:
+            webhook = {
+                "url": WEBHOOK_URL, "path": WEBHOOK_PATH, "secret_token": WEBHOOK_SECRET,
+                "host": WEBHOOK_HOST, "port": WEBHOOK_PORT, "workers": WEBHOOK_WORKERS,
+                "max_queue": WEBHOOK_QUEUE_SIZE, "max_connections": WEBHOOK_MAX_CONNECTIONS,
+                "register": WEBHOOK_REGISTER, "instances": WEBHOOK_INSTANCES
+            }
+        asyncio.run(serve_sharded(
+            TELEGRAM_TOKEN, SHARD_WORKERS, "main:application", SHARD_QUEUE_SIZE, SHARD_REBALANCE_AFTER,
+            SHARD_BUFFER_LIMIT, SHARD_METRICS_INTERVAL, webhook, SHARD_INBOX_FILE
+        ))
+    elif WEBHOOK_URL:
+        # Tryb webhook - wiele instancji za load balancerem
+        import asyncio
+        from services.webhook_server import serve_webhook
+        asyncio.run(serve_webhook(
+            application, WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_HOST, WEBHOOK_PORT,
+            WEBHOOK_WORKERS, WEBHOOK_QUEUE_SIZE, WEBHOOK_MAX_CONNECTIONS, WEBHOOK_REGISTER, WEBHOOK_INSTANCES
+        ))
+    elif LEADER_ELECTION:
+        # Lider pobiera aktualizacje, pozostałe instancje czekają w gotowości (wdrożenia bez przerwy)
+        import asyncio
+        from services.leader_election import serve_polling_with_leader_election
+        asyncio.run(serve_polling_with_leader_election(
+            application, LEADER_ELECTION, LEADER_LEASE_NAME, INSTANCE_ID, LEADER_LEASE_TTL, LEADER_LEASE_FILE
+        ))
+    else:
+        application.run_polling()
\ No newline at end of file
@@ -0,0 +1,20 @@
+# repositories/base_repository.py
+from abc import ABC, abstractmethod
+from typing import Generic, List, Optional, TypeVar
+
+T = TypeVar("T")
+
+class BaseRepository(ABC, Generic[T]):
+    """Bazowa klasa repozytoriów operujących na jednej tabeli Supabase"""
+    
+    @abstractmethod
+    async def get_by_id(self, id: int) -> Optional[T]:
+        """Pobiera obiekt po ID"""
+    
+    @abstractmethod
+    async def get_all(self) -> List[T]:
+        """Pobiera wszystkie obiekty"""
+    
+    @abstractmethod
+    async def create(self, entity: T) -> T:
+        """Tworzy nowy obiekt"""
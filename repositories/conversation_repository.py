@@ -1,20 +1,84 @@
 # repositories/conversation_repository.py
+import asyncio
 import logging
-from typing import List, Optional, Dict, Any
+import time
+from collections import OrderedDict
+from typing import Callable, List, Optional, Dict, Any, Tuple
 from datetime import datetime
 import pytz
 from database.models import Conversation
 from repositories.base_repository import BaseRepository
 from api.supabase_client import SupabaseClient
+from config import CONVERSATION_CACHE_TTL, CONVERSATION_CACHE_MAX_ENTRIES, CONVERSATION_TOUCH_INTERVAL
 
 logger = logging.getLogger(__name__)
 
+ConversationKey = Tuple[int, Optional[int]]
+
+class ActiveConversationCache:
+    """
+    Pamięć podręczna aktywnych konwersacji, klucz (user_id, theme_id)
+    
+    Wpis jest ustawiany przy pobraniu i utworzeniu konwersacji, a usuwany przy
+    rozpoczęciu nowego czatu, zmianie tematu i usunięciu historii. TTL chroni
+    przed zmianami wykonanymi przez inne instancje bota.
+    """
+    
+    def __init__(self, ttl: float = CONVERSATION_CACHE_TTL, max_entries: int = CONVERSATION_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[ConversationKey, Tuple[Conversation, float]]" = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0, "invalidations": 0}
+    
+    def get(self, user_id: int, theme_id: Optional[int] = None) -> Optional[Conversation]:
+        """Zwraca aktywną konwersację z cache lub None, jeśli brak lub wygasła"""
+        key = (user_id, theme_id)
+        entry = self._entries.get(key)
+        if entry is None or entry[1] < time.monotonic():
+            self.stats["misses"] += 1
+            return None
+        self._entries.move_to_end(key)
+        self.stats["hits"] += 1
+        return entry[0]
+    
+    def set(self, user_id: int, theme_id: Optional[int], conversation: Conversation) -> None:
+        """Zapisuje aktywną konwersację użytkownika"""
+        key = (user_id, theme_id)
+        self._entries[key] = (conversation, time.monotonic() + self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+    
+    def invalidate(self, user_id: int, theme_id: Optional[int] = None, all_themes: bool = False) -> None:
+        """Usuwa aktywną konwersację użytkownika (dla tematu lub wszystkich tematów)"""
+        keys = [key for key in self._entries if key[0] == user_id] if all_themes else [(user_id, theme_id)]
+        for key in keys:
+            if self._entries.pop(key, None) is not None:
+                self.stats["invalidations"] += 1
+    
+    def find(self, conversation_id: int) -> List[Conversation]:
+        """Zwraca obiekty konwersacji o podanym ID przechowywane w cache"""
+        return [conversation for conversation, _ in self._entries.values() if conversation.id == conversation_id]
+    
+    def for_user(self, user_id: int) -> List[Conversation]:
+        """Zwraca aktywne konwersacje użytkownika przechowywane w cache (wszystkie tematy)"""
+        return [conversation for key, (conversation, _) in self._entries.items() if key[0] == user_id]
+
 class ConversationRepository(BaseRepository[Conversation]):
     """Repozytorium dla operacji na konwersacjach"""
     
-    def __init__(self, client: SupabaseClient):
+    def __init__(self, client: SupabaseClient, active_cache: Optional[ActiveConversationCache] = None,
+                 touch_interval: float = CONVERSATION_TOUCH_INTERVAL):
         self.client = client
         self.table = "conversations"
+        self.active_cache = active_cache or ActiveConversationCache()
+        self.touch_interval = touch_interval
+        # Wywoływane jako on_conversation_reset(conversation_id) po usunięciu konwersacji lub rozpoczęciu
+        # nowego czatu, np. do unieważnienia historii w cache
+        self.on_conversation_reset: Optional[Callable[[int], None]] = None
+        # Znaczniki czasu ostatnich wiadomości czekające na zbiorczy zapis (id -> czas)
+        self._pending_touches: Dict[int, datetime] = {}
+        self._touch_task: Optional[asyncio.Task] = None
     
     async def get_by_id(self, id: int) -> Optional[Conversation]:
         """Pobiera konwersację po ID"""
@@ -62,7 +126,9 @@ class ConversationRepository(BaseRepository[Conversation]):
             )
             
             if result:
-                return Conversation.from_dict(result[0])
+                created = Conversation.from_dict(result[0])
+                self.active_cache.set(conversation.user_id, getattr(conversation, 'theme_id', None), created)
+                return created
             raise Exception("Błąd tworzenia konwersacji - brak odpowiedzi")
         except Exception as e:
             logger.error(f"Błąd tworzenia konwersacji: {e}")
@@ -95,6 +161,10 @@ class ConversationRepository(BaseRepository[Conversation]):
     
     async def delete(self, id: int) -> bool:
         """Usuwa konwersację po ID"""
+        for conversation in self.active_cache.find(id):
+            self.active_cache.invalidate(conversation.user_id, all_themes=True)
+        self._conversation_reset(id)
+        
         try:
             result = await self.client.query(
                 self.table,
@@ -108,13 +178,17 @@ class ConversationRepository(BaseRepository[Conversation]):
             return False
     
     async def get_active_conversation(self, user_id: int, theme_id: Optional[int] = None) -> Conversation:
-        """Pobiera aktywną konwersację dla użytkownika"""
+        """Pobiera aktywną konwersację dla użytkownika (z cache, jeśli dostępna)"""
+        cached = self.active_cache.get(user_id, theme_id)
+        if cached is not None:
+            return cached
+        
+        filters = {"user_id": user_id}
+        
+        if theme_id:
+            filters["theme_id"] = theme_id
+        
         try:
-            filters = {"user_id": user_id}
-            
-            if theme_id:
-                filters["theme_id"] = theme_id
-            
             result = await self.client.query(
                 self.table, 
                 query_type="select",
@@ -122,23 +196,78 @@ class ConversationRepository(BaseRepository[Conversation]):
                 order_by="-last_message_at", 
                 limit=1
             )
-            
-            if result:
-                return Conversation.from_dict(result[0])
-            
-            # Jeśli nie znaleziono konwersacji, utwórz nową
-            new_conversation = Conversation(user_id=user_id)
-            
-            if theme_id:
-                new_conversation.theme_id = theme_id
-            
-            return await self.create(new_conversation)
         except Exception as e:
+            # Błąd odczytu nie oznacza braku konwersacji - nie twórz nowej
             logger.error(f"Błąd pobierania aktywnej konwersacji dla użytkownika {user_id}: {e}")
-            # Utwórz nową konwersację jako awaryjną
-            new_conversation = Conversation(user_id=user_id)
-            
-            if theme_id:
-                new_conversation.theme_id = theme_id
-            
-            return await self.create(new_conversation)
\ No newline at end of file
+            raise
+        
+        if result:
+            conversation = Conversation.from_dict(result[0])
+            self.active_cache.set(user_id, theme_id, conversation)
+            return conversation
+        
+        # Jeśli nie znaleziono konwersacji, utwórz nową
+        new_conversation = Conversation(user_id=user_id)
+        
+        if theme_id:
+            new_conversation.theme_id = theme_id
+        
+        return await self.create(new_conversation)
+    
+    def invalidate_active_conversation(self, user_id: int) -> None:
+        """Zapomina aktywne konwersacje użytkownika (nowy czat, zmiana tematu, usunięcie historii)"""
+        for conversation in self.active_cache.for_user(user_id):
+            self._conversation_reset(conversation.id)
+        self.active_cache.invalidate(user_id, all_themes=True)
+    
+    def _conversation_reset(self, conversation_id: Optional[int]) -> None:
+        if self.on_conversation_reset is not None and conversation_id is not None:
+            self.on_conversation_reset(conversation_id)
+    
+    def touch(self, conversation_id: int, at: Optional[datetime] = None) -> None:
+        """Odnotowuje nową wiadomość - last_message_at jest zapisywany zbiorczo co touch_interval"""
+        at = at or datetime.now(pytz.UTC)
+        previous = self._pending_touches.get(conversation_id)
+        if previous is None or at > previous:
+            self._pending_touches[conversation_id] = at
+        
+        for conversation in self.active_cache.find(conversation_id):
+            conversation.last_message_at = at
+    
+    async def flush_touches(self) -> None:
+        """Zapisuje zgromadzone znaczniki last_message_at jednym wywołaniem touch_conversations"""
+        if not self._pending_touches:
+            return
+        
+        pending, self._pending_touches = self._pending_touches, {}
+        updates = [{"id": conversation_id, "last_message_at": at.isoformat()} for conversation_id, at in pending.items()]
+        try:
+            await self.client.rpc("touch_conversations", {"p_updates": updates})
+        except Exception as e:
+            logger.error(f"Błąd zapisu last_message_at dla {len(updates)} konwersacji: {e}")
+            # Przywróć znaczniki, chyba że w międzyczasie pojawiły się nowsze
+            for conversation_id, at in pending.items():
+                current = self._pending_touches.get(conversation_id)
+                if current is None or at > current:
+                    self._pending_touches[conversation_id] = at
+    
+    async def _touch_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.touch_interval)
+            await self.flush_touches()
+    
+    async def start(self) -> None:
+        """Uruchamia okresowy zapis last_message_at"""
+        if self._touch_task is None:
+            self._touch_task = asyncio.create_task(self._touch_loop())
+    
+    async def close(self) -> None:
+        """Zatrzymuje okresowy zapis i zapisuje pozostałe znaczniki"""
+        if self._touch_task is not None:
+            self._touch_task.cancel()
+            try:
+                await self._touch_task
+            except asyncio.CancelledError:
+                pass
+            self._touch_task = None
+        await self.flush_touches()
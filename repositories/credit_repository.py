@@ -1,35 +1,184 @@
 # repositories/credit_repository.py
+import asyncio
 import logging
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
 from typing import List, Dict, Optional, Tuple, Any
-from datetime import datetime, timedelta
-import pytz
 from api.supabase_client import SupabaseClient
+from api.retry import classify_error
+from api.realtime_client import EVENT_RESET
+from database.models import CreditReservation
+from config import (
+    CREDIT_RESERVATION_TTL, CREDIT_RESERVATION_SWEEP_INTERVAL, BALANCE_CACHE_TTL, BALANCE_CACHE_MAX_USERS
+)
 
 logger = logging.getLogger(__name__)
 
+# Odstępy (w sekundach) ponawiania rozliczeń rezerwacji nieudanych z powodu błędu bazy
+SETTLE_RETRY_INITIAL_DELAY = 2.0
+SETTLE_RETRY_MAX_DELAY = 60.0
+# Jak długo zamykanie repozytorium czeka na ponawiane rozliczenia
+SETTLE_CLOSE_TIMEOUT = 5.0
+
+def _parse_timestamp(value: Any) -> Optional[datetime]:
+    if isinstance(value, datetime) or value is None:
+        return value
+    try:
+        return datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except ValueError:
+        return None
+
+class BalanceCache:
+    """
+    Pamięć podręczna sald użytkowników
+    
+    Wartości są aktualizowane wynikami funkcji RPC (write-through) oraz zmianami
+    z Supabase Realtime. Krótki TTL zabezpiecza przed utraconymi powiadomieniami.
+    Każdy wpis pamięta czas zmiany salda w bazie (user_credits.updated_at) -
+    starsza wartość (np. spóźnione powiadomienie) nie nadpisuje nowszej.
+    """
+    
+    def __init__(self, ttl: float = BALANCE_CACHE_TTL, max_users: int = BALANCE_CACHE_MAX_USERS):
+        self.ttl = ttl
+        self.max_users = max_users
+        self._entries: "OrderedDict[int, Tuple[int, float, Optional[datetime]]]" = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0, "invalidations": 0, "stale": 0}
+    
+    def get(self, user_id: int) -> Optional[int]:
+        """Zwraca saldo z cache lub None, jeśli brak lub wygasło"""
+        entry = self._entries.get(user_id)
+        if entry is None or entry[1] < time.monotonic():
+            self.stats["misses"] += 1
+            return None
+        self._entries.move_to_end(user_id)
+        self.stats["hits"] += 1
+        return entry[0]
+    
+    def set(self, user_id: int, balance: Optional[int], updated_at: Any = None) -> None:
+        """
+        Zapisuje saldo użytkownika
+        
+        Args:
+            updated_at: czas zmiany salda w bazie; wartość starsza niż zapisana w cache jest pomijana
+        """
+        if balance is None:
+            return
+        changed_at = _parse_timestamp(updated_at)
+        entry = self._entries.get(user_id)
+        if changed_at is not None and entry is not None and entry[2] is not None and changed_at < entry[2]:
+            self.stats["stale"] += 1
+            return
+        self._entries[user_id] = (int(balance), time.monotonic() + self.ttl, changed_at)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_users:
+            self._entries.popitem(last=False)
+    
+    def invalidate(self, user_id: int) -> None:
+        """Usuwa saldo użytkownika z cache"""
+        if self._entries.pop(user_id, None) is not None:
+            self.stats["invalidations"] += 1
+    
+    def clear(self) -> None:
+        """Czyści cały cache"""
+        self._entries.clear()
+
 class CreditRepository:
     """Repozytorium dla operacji na kredytach użytkownika"""
     
-    def __init__(self, client: SupabaseClient):
+    def __init__(self, client: SupabaseClient, balance_cache: Optional[BalanceCache] = None):
         self.client = client
         self.credits_table = "user_credits"
         self.transactions_table = "credit_transactions"
         self.packages_table = "credit_packages"
+        self.balance_cache = balance_cache or BalanceCache()
+        self._expiry_task: Optional[asyncio.Task] = None
+        # Rozliczenia ponawiane w tle (id rezerwacji -> zadanie)
+        self._pending_settlements: Dict[str, asyncio.Task] = {}
+    
+    async def start(self) -> None:
+        """Uruchamia okresowe zwalnianie wygasłych rezerwacji (release_expired_credit_reservations)"""
+        if self._expiry_task is None:
+            self._expiry_task = asyncio.create_task(self._release_expired_loop())
+    
+    async def close(self) -> None:
+        """Zatrzymuje zwalnianie rezerwacji i czeka chwilę na ponawiane rozliczenia"""
+        if self._expiry_task is not None:
+            self._expiry_task.cancel()
+            await asyncio.gather(self._expiry_task, return_exceptions=True)
+            self._expiry_task = None
+        
+        pending = list(self._pending_settlements.values())
+        if pending:
+            await asyncio.wait(pending, timeout=SETTLE_CLOSE_TIMEOUT)
+            for reservation_id, task in list(self._pending_settlements.items()):
+                task.cancel()
+                logger.error(f"Rezerwacja {reservation_id} nie została rozliczona przed zamknięciem - "
+                             f"zostanie zwolniona po wygaśnięciu")
+    
+    async def _release_expired_loop(self) -> None:
+        while True:
+            await asyncio.sleep(CREDIT_RESERVATION_SWEEP_INTERVAL)
+            try:
+                released = await self.client.rpc("release_expired_credit_reservations")
+                if released:
+                    logger.warning(f"Zwolniono {released} wygasłych rezerwacji kredytów")
+            except Exception as e:
+                logger.error(f"Błąd zwalniania wygasłych rezerwacji kredytów: {e}")
+    
+    def on_balance_change(self, event: str, record: Dict[str, Any]) -> None:
+        """Obsługuje zmianę w tabeli user_credits (Realtime lub lokalny strumień zmian)"""
+        if event == EVENT_RESET:
+            self.balance_cache.clear()
+            return
+        
+        user_id = record.get('user_id')
+        if user_id is None:
+            return
+        
+        if event == "DELETE" or 'credits_amount' not in record:
+            self.balance_cache.invalidate(user_id)
+        else:
+            self.balance_cache.set(user_id, record['credits_amount'], record.get('updated_at'))
+    
+    async def _rpc_idempotent(self, function_name: str, params: Dict[str, Any]) -> Any:
+        """
+        Wywołuje funkcję zmieniającą saldo z kluczem idempotencji (p_request_id)
+        
+        Ponowienie wysłane, gdy pierwsze żądanie nadal trwa, może zakończyć się konfliktem
+        unikalności (HTTP 409), choć zmiana została zatwierdzona - wywołanie z tym samym
+        kluczem zwraca wtedy zapisany wynik (duplicate), a nie błąd.
+        """
+        try:
+            return await self.client.rpc(function_name, params)
+        except Exception as e:
+            if classify_error(e).status_code != 409:
+                raise
+            logger.warning(f"Konflikt klucza idempotencji w {function_name} - pobieram zapisany wynik")
+            return await self.client.rpc(function_name, params)
     
     async def get_user_credits(self, user_id: int) -> int:
-        """Pobiera bieżący stan kredytów użytkownika"""
+        """Pobiera bieżący stan kredytów użytkownika (z cache, jeśli dostępny)"""
+        cached = self.balance_cache.get(user_id)
+        if cached is not None:
+            return cached
+        
         try:
             result = await self.client.query(
                 self.credits_table, 
                 query_type="select",
-                columns="credits_amount", 
+                columns="credits_amount,updated_at", 
                 filters={"user_id": user_id}
             )
             
             if result:
-                return result[0].get('credits_amount', 0)
+                balance = result[0].get('credits_amount', 0)
+                self.balance_cache.set(user_id, balance, result[0].get('updated_at'))
+                return balance
             
-            await self.init_user_credits(user_id)
+            if await self.init_user_credits(user_id):
+                self.balance_cache.set(user_id, 0)
             return 0
         except Exception as e:
             logger.error(f"Błąd pobierania kredytów dla użytkownika {user_id}: {e}")
@@ -57,122 +206,226 @@ class CreditRepository:
             return False
     
     async def add_user_credits(self, user_id: int, amount: int, description: Optional[str] = None) -> bool:
-        """Dodaje kredyty użytkownikowi"""
+        """Dodaje kredyty użytkownikowi (atomowo, funkcja add_credits w bazie)"""
         try:
-            now = datetime.now(pytz.UTC).isoformat()
-            
-            # Pobierz aktualną liczbę kredytów
-            result = await self.client.query(
-                self.credits_table,
-                query_type="select", 
-                columns="credits_amount",
-                filters={"user_id": user_id}
-            )
-            
-            if result:
-                current_credits = result[0].get('credits_amount', 0)
-                
-                # Aktualizuj istniejący rekord
-                await self.client.query(
-                    self.credits_table,
-                    query_type="update",
-                    filters={"user_id": user_id},
-                    data={
-                        'credits_amount': current_credits + amount,
-                        'total_credits_purchased': self.client.client.raw(f'total_credits_purchased + {amount}'),
-                        'last_purchase_date': now
-                    }
-                )
-            else:
-                # Utwórz nowy rekord
-                current_credits = 0
-                await self.init_user_credits(user_id)
-                await self.client.query(
-                    self.credits_table,
-                    query_type="update",
-                    filters={"user_id": user_id},
-                    data={
-                        'credits_amount': amount,
-                        'total_credits_purchased': amount,
-                        'last_purchase_date': now
-                    }
-                )
-            
-            # Zapisz transakcję
-            if amount != 0:
-                await self.client.query(
-                    self.transactions_table,
-                    query_type="insert",
-                    data={
-                        'user_id': user_id,
-                        'transaction_type': 'add',
-                        'amount': amount,
-                        'credits_before': current_credits,
-                        'credits_after': current_credits + amount,
-                        'description': description,
-                        'created_at': now
-                    }
-                )
+            result = await self._rpc_idempotent("add_credits", {
+                "p_user_id": user_id,
+                "p_amount": amount,
+                "p_description": description,
+                "p_request_id": str(uuid.uuid4())
+            })
             
-            return True
+            if result and not result.get('duplicate'):
+                self.balance_cache.set(user_id, result.get('credits_after'), result.get('updated_at'))
+            return bool(result and result.get('success'))
         except Exception as e:
             logger.error(f"Błąd dodawania kredytów użytkownikowi {user_id}: {e}")
             return False
     
     async def deduct_user_credits(self, user_id: int, amount: int, description: Optional[str] = None) -> bool:
-        """Odejmuje kredyty użytkownikowi"""
+        """
+        Odejmuje kredyty użytkownikowi
+        
+        Sprawdzenie salda, odjęcie kredytów i zapis transakcji wykonuje funkcja
+        deduct_credits w jednym wywołaniu, więc równoległe żądania nie wydadzą
+        kredytów podwójnie.
+        """
         try:
-            # Pobierz aktualną liczbę kredytów
-            result = await self.client.query(
-                self.credits_table,
-                query_type="select", 
-                columns="credits_amount",
-                filters={"user_id": user_id}
-            )
-            
-            if not result:
-                return False
-            
-            current_credits = result[0].get('credits_amount', 0)
-            
-            # Sprawdź, czy użytkownik ma wystarczającą liczbę kredytów
-            if current_credits < amount:
-                return False
-            
-            # Odejmij kredyty
-            await self.client.query(
-                self.credits_table,
-                query_type="update",
-                filters={"user_id": user_id},
-                data={'credits_amount': current_credits - amount}
-            )
-            
-            # Zapisz transakcję
-            now = datetime.now(pytz.UTC).isoformat()
-            await self.client.query(
-                self.transactions_table,
-                query_type="insert",
-                data={
-                    'user_id': user_id,
-                    'transaction_type': 'deduct',
-                    'amount': amount,
-                    'credits_before': current_credits,
-                    'credits_after': current_credits - amount,
-                    'description': description,
-                    'created_at': now
-                }
-            )
+            result = await self._rpc_idempotent("deduct_credits", {
+                "p_user_id": user_id,
+                "p_amount": amount,
+                "p_description": description,
+                "p_request_id": str(uuid.uuid4())
+            })
             
-            return True
+            if result and not result.get('duplicate'):
+                self.balance_cache.set(user_id, result.get('credits_after'), result.get('updated_at'))
+            return bool(result and result.get('success'))
         except Exception as e:
             logger.error(f"Błąd odejmowania kredytów użytkownikowi {user_id}: {e}")
             return False
     
+    async def reserve_credits(self, user_id: int, amount: int, description: Optional[str] = None) -> CreditReservation:
+        """
+        Blokuje kredyty na czas operacji (jedno atomowe wywołanie reserve_credits)
+        
+        Returns:
+            CreditReservation: Rezerwacja ze statusem "held" i saldem po blokadzie,
+            "insufficient" z bieżącym saldem lub "error" przy błędzie bazy
+        """
+        reservation = CreditReservation(user_id=user_id, amount=amount, description=description)
+        try:
+            result = await self._rpc_idempotent("reserve_credits", {
+                "p_user_id": user_id,
+                "p_amount": amount,
+                "p_description": description,
+                "p_ttl_seconds": CREDIT_RESERVATION_TTL,
+                "p_request_id": str(uuid.uuid4())
+            })
+        except Exception as e:
+            logger.error(f"Błąd rezerwacji kredytów użytkownika {user_id}: {e}")
+            reservation.status = "error"
+            reservation.error = e
+            return reservation
+        
+        if not result:
+            # Brak odpowiedzi (np. brak połączenia z bazą) - nie wiadomo, czy kredyty zostały zablokowane
+            logger.error(f"Błąd rezerwacji kredytów użytkownika {user_id} - brak odpowiedzi")
+            reservation.status = "error"
+            reservation.error = Exception("Brak odpowiedzi bazy danych przy rezerwacji kredytów")
+            return reservation
+        
+        reservation.balance = result.get('credits_after') or 0
+        self.balance_cache.set(user_id, reservation.balance, result.get('updated_at'))
+        if result.get('success'):
+            reservation.id = result.get('reservation_id')
+        else:
+            reservation.status = "insufficient"
+        return reservation
+    
+    async def settle_reservation(self, reservation: CreditReservation, amount: Optional[int] = None) -> bool:
+        """
+        Rozlicza rezerwację - pobiera `amount` kredytów (domyślnie całą zablokowaną kwotę)
+        i zwraca resztę na saldo
+        
+        Operacja została już wykonana, więc rozliczenie nieudane z powodu błędu bazy
+        jest ponawiane w tle (funkcja settle_credit_reservation jest idempotentna),
+        zamiast oddawać zablokowane kredyty.
+        """
+        if not reservation.is_held:
+            return False
+        
+        try:
+            result = await self._settle_once(reservation, amount)
+        except Exception as e:
+            logger.error(f"Błąd rozliczenia rezerwacji {reservation.id} użytkownika {reservation.user_id}: {e} - "
+                         f"rozliczenie zostanie ponowione w tle")
+            self._retry_settlement(reservation, amount)
+            return False
+        
+        return self._apply_settlement(reservation, result)
+    
+    async def _settle_once(self, reservation: CreditReservation, amount: Optional[int]) -> Dict[str, Any]:
+        result = await self.client.rpc("settle_credit_reservation", {
+            "p_reservation_id": reservation.id,
+            "p_amount": amount
+        })
+        if not result:
+            raise Exception(f"Błąd rozliczenia rezerwacji {reservation.id} - brak odpowiedzi")
+        return result
+    
+    def _retry_settlement(self, reservation: CreditReservation, amount: Optional[int]) -> None:
+        if reservation.id in self._pending_settlements:
+            return
+        task = asyncio.create_task(self._settle_in_background(reservation, amount))
+        self._pending_settlements[reservation.id] = task
+        task.add_done_callback(lambda _: self._pending_settlements.pop(reservation.id, None))
+    
+    async def _settle_in_background(self, reservation: CreditReservation, amount: Optional[int]) -> None:
+        # Po wygaśnięciu rezerwacja jest zwalniana przez release_expired_credit_reservations
+        deadline = time.monotonic() + CREDIT_RESERVATION_TTL
+        delay = SETTLE_RETRY_INITIAL_DELAY
+        while True:
+            await asyncio.sleep(delay)
+            try:
+                result = await self._settle_once(reservation, amount)
+            except Exception as e:
+                if time.monotonic() + delay >= deadline:
+                    logger.error(f"Nie udało się rozliczyć rezerwacji {reservation.id} przed wygaśnięciem: {e}")
+                    return
+                delay = min(delay * 2, SETTLE_RETRY_MAX_DELAY)
+                continue
+            
+            if self._apply_settlement(reservation, result):
+                logger.info(f"Rozliczono rezerwację {reservation.id} po ponowieniu")
+            else:
+                logger.error(f"Rezerwacja {reservation.id} nie mogła zostać rozliczona (status: {result.get('status')})")
+            return
+    
+    def _apply_settlement(self, reservation: CreditReservation, result: Dict[str, Any]) -> bool:
+        if not result.get('success'):
+            return False
+        
+        reservation.status = "settled"
+        reservation.charged = result.get('charged', reservation.amount)
+        reservation.balance = result.get('credits_after', reservation.balance)
+        self.balance_cache.set(reservation.user_id, reservation.balance, result.get('updated_at'))
+        return True
+    
+    async def release_reservation(self, reservation: CreditReservation) -> bool:
+        """Zwalnia rezerwację i oddaje zablokowane kredyty"""
+        if not reservation.is_held:
+            return False
+        
+        try:
+            result = await self.client.rpc("release_credit_reservation", {
+                "p_reservation_id": reservation.id
+            })
+        except Exception as e:
+            logger.error(f"Błąd zwalniania rezerwacji {reservation.id} użytkownika {reservation.user_id}: {e}")
+            return False
+        
+        if not result or not result.get('success'):
+            return False
+        
+        reservation.status = "released"
+        reservation.balance = result.get('credits_after', reservation.balance + reservation.amount)
+        self.balance_cache.set(reservation.user_id, reservation.balance, result.get('updated_at'))
+        return True
+    
     async def check_user_credits(self, user_id: int, amount_needed: int) -> bool:
         """Sprawdza, czy użytkownik ma wystarczającą liczbę kredytów"""
         current_credits = await self.get_user_credits(user_id)
         return current_credits >= amount_needed
     
+    async def get_user_credit_stats(self, user_id: int, history_limit: int = 50) -> Dict[str, Any]:
+        """Pobiera statystyki kredytów użytkownika wraz z ostatnimi transakcjami"""
+        try:
+            credits_row, transactions = await asyncio.gather(
+                self.client.query(
+                    self.credits_table,
+                    query_type="select",
+                    columns="credits_amount,total_credits_purchased,total_spent,last_purchase_date",
+                    filters={"user_id": user_id}
+                ),
+                self.client.query(
+                    self.transactions_table,
+                    query_type="select",
+                    columns="transaction_type,amount,description,created_at",
+                    filters={"user_id": user_id},
+                    order_by="-created_at",
+                    limit=history_limit
+                )
+            )
+        except Exception as e:
+            logger.error(f"Błąd pobierania statystyk kredytów użytkownika {user_id}: {e}")
+            return {}
+        
+        row = credits_row[0] if credits_row else {}
+        usage_history = [
+            {
+                'type': t.get('transaction_type'),
+                'amount': t.get('amount', 0),
+                'description': t.get('description'),
+                'date': t.get('created_at') or ''
+            }
+            for t in transactions
+        ]
+        
+        deductions = [t for t in usage_history if t['type'] == 'deduct']
+        days = {t['date'][:10] for t in deductions if t['date']}
+        most_expensive = max(deductions, key=lambda t: t['amount'], default=None)
+        
+        return {
+            'credits': row.get('credits_amount', 0),
+            'total_purchased': row.get('total_credits_purchased') or 0,
+            'total_spent': float(row.get('total_spent') or 0),
+            'last_purchase': row.get('last_purchase_date'),
+            'avg_daily_usage': sum(t['amount'] for t in deductions) / max(1, len(days)),
+            'most_expensive_operation': most_expensive['description'] if most_expensive else None,
+            'usage_history': usage_history
+        }
+    
     async def get_credit_packages(self) -> List[Dict[str, Any]]:
         """Pobiera dostępne pakiety kredytów"""
         try:
@@ -205,72 +458,20 @@ class CreditRepository:
             return None
     
     async def purchase_credits(self, user_id: int, package_id: int) -> Tuple[bool, Optional[Dict[str, Any]]]:
-        """Dokonuje zakupu kredytów"""
+        """Dokonuje zakupu kredytów (atomowo, funkcja purchase_credits w bazie)"""
         try:
-            # Pobierz informacje o pakiecie
-            package = await self.get_package_by_id(package_id)
-            if not package:
-                return False, None
-            
-            # Dodaj kredyty użytkownikowi
-            now = datetime.now(pytz.UTC).isoformat()
-            description = f"Zakup pakietu {package['name']}"
-            
-            # Pobierz aktualny stan kredytów
-            result = await self.client.query(
-                self.credits_table,
-                query_type="select", 
-                columns="credits_amount",
-                filters={"user_id": user_id}
-            )
+            result = await self._rpc_idempotent("purchase_credits", {
+                "p_user_id": user_id,
+                "p_package_id": package_id,
+                "p_request_id": str(uuid.uuid4())
+            })
             
-            if result:
-                current_credits = result[0].get('credits_amount', 0)
-                
-                # Aktualizuj rekord użytkownika
-                await self.client.query(
-                    self.credits_table,
-                    query_type="update",
-                    filters={"user_id": user_id},
-                    data={
-                        'credits_amount': current_credits + package['credits'],
-                        'total_credits_purchased': self.client.client.raw(f'total_credits_purchased + {package["credits"]}'),
-                        'last_purchase_date': now,
-                        'total_spent': self.client.client.raw(f'total_spent + {package["price"]}')
-                    }
-                )
-            else:
-                # Jeśli rekord nie istnieje, utwórz go
-                current_credits = 0
-                await self.init_user_credits(user_id)
-                await self.client.query(
-                    self.credits_table,
-                    query_type="update",
-                    filters={"user_id": user_id},
-                    data={
-                        'credits_amount': package['credits'],
-                        'total_credits_purchased': package['credits'],
-                        'last_purchase_date': now,
-                        'total_spent': package['price']
-                    }
-                )
-            
-            # Zapisz transakcję
-            await self.client.query(
-                self.transactions_table,
-                query_type="insert",
-                data={
-                    'user_id': user_id,
-                    'transaction_type': 'purchase',
-                    'amount': package['credits'],
-                    'credits_before': current_credits,
-                    'credits_after': current_credits + package['credits'],
-                    'description': description,
-                    'created_at': now
-                }
-            )
+            if not result or not result.get('success'):
+                return False, None
             
-            return True, package
+            if not result.get('duplicate'):
+                self.balance_cache.set(user_id, result.get('credits_after'), result.get('updated_at'))
+            return True, result.get('package')
         except Exception as e:
             logger.error(f"Błąd zakupu kredytów: {e}")
-            return False, None
\ No newline at end of file
+            return False, None
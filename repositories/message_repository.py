@@ -1,20 +1,149 @@
 # repositories/message_repository.py
 import logging
-from typing import List, Optional, Dict, Any
+import uuid
+from collections import OrderedDict, deque
+from typing import Callable, Deque, List, Optional, Dict, Any
 from datetime import datetime
 import pytz
 from database.models import Message
 from repositories.base_repository import BaseRepository
 from api.supabase_client import SupabaseClient
+from config import HISTORY_CACHE_MESSAGES, HISTORY_CACHE_MAX_CONVERSATIONS, HISTORY_CACHE_MAX_BYTES
 
 logger = logging.getLogger(__name__)
 
+# Przybliżony narzut pamięci na jedną wiadomość w cache (obiekt, pola, deque)
+MESSAGE_OVERHEAD_BYTES = 300
+
+def _message_size(message: Message) -> int:
+    return len(message.content or "") * 2 + MESSAGE_OVERHEAD_BYTES
+
+class ConversationHistoryCache:
+    """
+    Pamięć podręczna ostatnich N wiadomości per konwersacja
+    
+    Każda konwersacja ma bufor pierścieniowy (deque z maxlen) zawierający
+    najnowsze wiadomości. Konwersacje są usuwane w kolejności LRU po
+    przekroczeniu liczby konwersacji lub limitu pamięci.
+    
+    Generacja konwersacji rośnie przy każdej zmianie (dopisanie, unieważnienie).
+    Wynik pobrania z bazy, w trakcie którego konwersacja się zmieniła, nie jest
+    zapisywany - starsze wiersze nie nadpisują nowszej zawartości cache.
+    """
+    
+    def __init__(self, messages_per_conversation: int = HISTORY_CACHE_MESSAGES,
+                 max_conversations: int = HISTORY_CACHE_MAX_CONVERSATIONS,
+                 max_bytes: int = HISTORY_CACHE_MAX_BYTES):
+        self.messages_per_conversation = messages_per_conversation
+        self.max_conversations = max_conversations
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[int, Deque[Message]]" = OrderedDict()
+        self._sizes: Dict[int, int] = {}
+        self.total_bytes = 0
+        # Generacje i liczba trwających pobrań - tylko dla konwersacji pobieranych z bazy
+        self._generations: Dict[int, int] = {}
+        self._fetches: Dict[int, int] = {}
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "stale_stores": 0}
+    
+    def get(self, conversation_id: int, limit: int) -> Optional[List[Message]]:
+        """Zwraca ostatnie `limit` wiadomości lub None, jeśli cache ich nie zawiera"""
+        entry = self._entries.get(conversation_id)
+        if entry is None or limit > self.messages_per_conversation:
+            self.stats["misses"] += 1
+            return None
+        
+        self._entries.move_to_end(conversation_id)
+        self.stats["hits"] += 1
+        messages = list(entry)
+        return messages[-limit:] if limit else messages
+    
+    def begin_fetch(self, conversation_id: int) -> int:
+        """Rozpoczyna pobieranie konwersacji z bazy - zwraca generację do przekazania do store()"""
+        self._fetches[conversation_id] = self._fetches.get(conversation_id, 0) + 1
+        return self._generations.setdefault(conversation_id, 0)
+    
+    def end_fetch(self, conversation_id: int) -> None:
+        """Kończy pobieranie (także nieudane) rozpoczęte przez begin_fetch()"""
+        remaining = self._fetches.pop(conversation_id, 1) - 1
+        if remaining > 0:
+            self._fetches[conversation_id] = remaining
+        else:
+            self._generations.pop(conversation_id, None)
+    
+    def _bump(self, conversation_id: int) -> None:
+        if conversation_id in self._generations:
+            self._generations[conversation_id] += 1
+    
+    def store(self, conversation_id: int, messages: List[Message], generation: Optional[int] = None) -> None:
+        """
+        Zapisuje najnowsze wiadomości konwersacji (od najstarszej) pobrane z bazy
+        
+        Args:
+            generation: wynik begin_fetch(); zapis jest pomijany, gdy konwersacja zmieniła się w trakcie pobierania
+        """
+        if generation is not None and self._generations.get(conversation_id) != generation:
+            self.stats["stale_stores"] += 1
+            return
+        self._remove(conversation_id)
+        entry: Deque[Message] = deque(maxlen=self.messages_per_conversation)
+        self._entries[conversation_id] = entry
+        self._sizes[conversation_id] = 0
+        for message in messages:
+            self._push(conversation_id, entry, message)
+        self._evict()
+    
+    def append(self, conversation_id: int, message: Message) -> None:
+        """Dopisuje nowo zapisaną wiadomość, jeśli konwersacja jest w cache"""
+        # Trwające pobranie mogło nie objąć tej wiadomości
+        self._bump(conversation_id)
+        entry = self._entries.get(conversation_id)
+        if entry is None:
+            return
+        self._entries.move_to_end(conversation_id)
+        self._push(conversation_id, entry, message)
+        self._evict()
+    
+    def _push(self, conversation_id: int, entry: Deque[Message], message: Message) -> None:
+        if len(entry) == entry.maxlen:
+            dropped = _message_size(entry[0])
+            self._sizes[conversation_id] -= dropped
+            self.total_bytes -= dropped
+        entry.append(message)
+        size = _message_size(message)
+        self._sizes[conversation_id] += size
+        self.total_bytes += size
+    
+    def invalidate(self, conversation_id: int) -> None:
+        """Usuwa konwersację z cache (także wynik trwającego pobrania)"""
+        self._bump(conversation_id)
+        self._remove(conversation_id)
+    
+    def _remove(self, conversation_id: int) -> None:
+        if self._entries.pop(conversation_id, None) is not None:
+            self.total_bytes -= self._sizes.pop(conversation_id, 0)
+    
+    def invalidate_message(self, message_id: int) -> None:
+        """Usuwa z cache konwersację zawierającą wiadomość o podanym ID"""
+        for conversation_id, entry in list(self._entries.items()):
+            if any(message.id == message_id for message in entry):
+                self.invalidate(conversation_id)
+    
+    def _evict(self) -> None:
+        while self._entries and (len(self._entries) > self.max_conversations or self.total_bytes > self.max_bytes):
+            conversation_id, _ = self._entries.popitem(last=False)
+            self.total_bytes -= self._sizes.pop(conversation_id, 0)
+            self.stats["evictions"] += 1
+
 class MessageRepository(BaseRepository[Message]):
     """Repozytorium dla operacji na wiadomościach"""
     
-    def __init__(self, client: SupabaseClient):
+    def __init__(self, client: SupabaseClient, history_cache: Optional[ConversationHistoryCache] = None,
+                 on_message_saved: Optional[Callable[[int, datetime], None]] = None):
         self.client = client
         self.table = "messages"
+        self.history_cache = history_cache or ConversationHistoryCache()
+        # Wywoływane jako on_message_saved(conversation_id, created_at), np. do aktualizacji last_message_at
+        self.on_message_saved = on_message_saved
     
     async def get_by_id(self, id: int) -> Optional[Message]:
         """Pobiera wiadomość po ID"""
@@ -102,40 +231,86 @@ class MessageRepository(BaseRepository[Message]):
                 filters={"id": id}
             )
             
+            self.history_cache.invalidate_message(id)
             return bool(result)
         except Exception as e:
             logger.error(f"Błąd usuwania wiadomości {id}: {e}")
             return False
     
     async def get_conversation_history(self, conversation_id: int, limit: int = 20) -> List[Message]:
-        """Pobiera historię wiadomości dla konwersacji"""
+        """Pobiera ostatnie `limit` wiadomości konwersacji (od najstarszej do najnowszej)"""
+        cached = self.history_cache.get(conversation_id, limit)
+        if cached is not None:
+            return cached
+        
+        generation = self.history_cache.begin_fetch(conversation_id)
         try:
+            # Pobierz najnowsze wiadomości malejąco i odwróć kolejność
+            fetch_limit = max(limit, self.history_cache.messages_per_conversation)
             result = await self.client.query(
                 self.table, 
                 query_type="select",
                 filters={"conversation_id": conversation_id},
-                order_by="created_at", 
-                limit=limit
+                order_by="-created_at", 
+                limit=fetch_limit
             )
             
-            return [Message.from_dict(data) for data in result]
+            messages = [Message.from_dict(data) for data in reversed(result)]
+            if fetch_limit == self.history_cache.messages_per_conversation:
+                self.history_cache.store(conversation_id, messages, generation)
+            
+            return messages[-limit:]
         except Exception as e:
             logger.error(f"Błąd pobierania historii konwersacji {conversation_id}: {e}")
             return []
+        finally:
+            self.history_cache.end_fetch(conversation_id)
     
     async def save_message(self, conversation_id: int, user_id: int, content: str, 
                          is_from_user: bool, model_used: Optional[str] = None) -> Optional[Message]:
-        """Zapisuje wiadomość do bazy danych"""
+        """
+        Zapisuje wiadomość do bazy danych
+        
+        Returns:
+            Optional[Message]: Zapisana wiadomość lub None, gdy zapis odłożono do kolejki w tle
+        """
         try:
             message = Message(
                 conversation_id=conversation_id,
                 user_id=user_id,
                 content=content,
                 is_from_user=is_from_user,
-                model_used=model_used
+                model_used=model_used,
+                created_at=datetime.now(pytz.UTC),
+                client_id=str(uuid.uuid4())
             )
             
-            return await self.create(message)
+            # Zapis trafia do jednostki pracy aktualizacji lub do kolejki zapisów w tle;
+            # historia w cache jest uzupełniana od razu, bez czekania na bazę
+            defer_insert = getattr(self.client, "defer_insert", None)
+            if defer_insert is not None:
+                row = {
+                    "conversation_id": conversation_id,
+                    "user_id": user_id,
+                    "content": content,
+                    "is_from_user": is_from_user,
+                    "model_used": model_used,
+                    "created_at": message.created_at.isoformat(),
+                    "client_id": message.client_id
+                }
+                if defer_insert(self.table, row):
+                    self.history_cache.append(conversation_id, message)
+                    self._message_saved(conversation_id, message.created_at)
+                    return None
+            
+            saved = await self.create(message)
+            self.history_cache.append(conversation_id, saved)
+            self._message_saved(conversation_id, message.created_at)
+            return saved
         except Exception as e:
             logger.error(f"Błąd zapisywania wiadomości: {e}")
-            return None
\ No newline at end of file
+            return None
+    
+    def _message_saved(self, conversation_id: int, created_at: datetime) -> None:
+        if self.on_message_saved is not None:
+            self.on_message_saved(conversation_id, created_at)
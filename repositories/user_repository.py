@@ -17,7 +17,7 @@ class UserRepository(BaseRepository[User]):
     async def get_by_id(self, id: int) -> Optional[User]:
         """Pobiera użytkownika po ID"""
         try:
-            result = await self.client.select(self.table, filters={"id": id})
+            result = await self.client.query(self.table, query_type="select", filters={"id": id})
             if result:
                 return User.from_dict(result[0])
             return None
@@ -28,7 +28,7 @@ class UserRepository(BaseRepository[User]):
     async def get_all(self) -> List[User]:
         """Pobiera wszystkich użytkowników"""
         try:
-            result = await self.client.select(self.table)
+            result = await self.client.query(self.table)
             return [User.from_dict(data) for data in result]
         except Exception as e:
             logger.error(f"Błąd pobierania wszystkich użytkowników: {e}")
@@ -46,8 +46,10 @@ class UserRepository(BaseRepository[User]):
                 "is_active": user.is_active
             }
             
-            result = await self.client.insert(self.table, user_data)
-            return User.from_dict(result)
+            result = await self.client.query(self.table, query_type="insert", data=user_data)
+            if result:
+                return User.from_dict(result[0])
+            raise Exception("Błąd tworzenia użytkownika - brak odpowiedzi")
         except Exception as e:
             logger.error(f"Błąd tworzenia użytkownika: {e}")
             raise
\ No newline at end of file
@@ -28,4 +28,9 @@ class APIService:
     
     async def generate_image(self, prompt: str) -> str:
         """Generuje obraz za pomocą DALL-E"""
-        return await self.openai.generate_image(prompt)
\ No newline at end of file
+        return await self.openai.generate_image(prompt)
+    
+    async def close(self) -> None:
+        """Zamyka połączenia wszystkich klientów API"""
+        await self.openai.close()
+        await self.supabase.close()
\ No newline at end of file
@@ -0,0 +1,36 @@
+# services/app_lifecycle.py
+"""
+Cykl życia Application poza run_polling (webhook, procesy robocze)
+"""
+import asyncio
+import signal
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+from telegram.ext import Application
+
+@asynccontextmanager
+async def running_application(application: Application) -> AsyncIterator[Application]:
+    """Inicjalizuje i uruchamia aplikację (z post_init), a na końcu zatrzymuje ją tak jak run_polling"""
+    await application.initialize()
+    if application.post_init is not None:
+        await application.post_init(application)
+    try:
+        await application.start()
+        yield application
+    finally:
+        if application.running:
+            await application.stop()
+        if application.post_stop is not None:
+            await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown is not None:
+            await application.post_shutdown(application)
+
+def stop_on_signals(stop_event: asyncio.Event) -> None:
+    """Ustawia stop_event po otrzymaniu SIGINT/SIGTERM"""
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:  # Windows
+            pass
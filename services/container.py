@@ -0,0 +1,105 @@
+# services/container.py
+import logging
+from typing import Optional
+from services.api_service import APIService
+from services.repository_service import RepositoryService
+from services.update_inbox import UpdateInbox
+from services.state_persistence import SqlitePersistence
+from utils.background import pending_background_tasks, wait_for_background_tasks
+from config import INSTANCE_ID, UPDATE_INBOX_FILE, UPDATE_INBOX_RETENTION, UPDATE_INBOX_MAX_ATTEMPTS
+from config import BACKGROUND_TASKS_SHUTDOWN_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+class ServiceContainer:
+    """
+    Leniwie inicjalizowany kontener współdzielonych serwisów
+    
+    Jedna instancja w procesie trzyma jednego klienta OpenAI, jedną pulę
+    połączeń do Supabase i jeden zestaw repozytoriów.
+    """
+    
+    def __init__(self):
+        self._api_service: Optional[APIService] = None
+        self._repository_service: Optional[RepositoryService] = None
+        self._update_inbox: Optional[UpdateInbox] = None
+        # False, gdy niedokończone aktualizacje wznawia dopiero wybrany lider
+        self.resume_updates_on_startup = True
+        self.started = False
+    
+    @property
+    def api_service(self) -> APIService:
+        """Zwraca współdzielony serwis API, tworząc go przy pierwszym użyciu"""
+        if self._api_service is None:
+            self._api_service = APIService()
+        return self._api_service
+    
+    @property
+    def repository_service(self) -> RepositoryService:
+        """Zwraca współdzielony serwis repozytoriów"""
+        if self._repository_service is None:
+            self._repository_service = RepositoryService(self.api_service.supabase)
+        return self._repository_service
+    
+    @property
+    def update_inbox(self) -> Optional[UpdateInbox]:
+        """Zwraca skrzynkę aktualizacji (None, gdy wyłączona w konfiguracji)"""
+        if self._update_inbox is None and UPDATE_INBOX_FILE:
+            self._update_inbox = UpdateInbox(
+                UPDATE_INBOX_FILE, UPDATE_INBOX_RETENTION, UPDATE_INBOX_MAX_ATTEMPTS, owner=INSTANCE_ID
+            )
+        return self._update_inbox
+    
+    async def startup(self, application=None) -> None:
+        """Inicjalizuje serwisy przy starcie aplikacji (Application.post_init)"""
+        if self.started:
+            return
+        
+        # Wymuś utworzenie klientów przed pierwszą aktualizacją
+        await self.repository_service.start()
+        
+        # Usuwanie z pamięci stanu bezczynnych użytkowników
+        if application is not None and isinstance(application.persistence, SqlitePersistence):
+            application.persistence.start(application)
+        
+        # Wznów aktualizacje niedokończone przed restartem (obsłużone po starcie aplikacji)
+        if application is not None and self.update_inbox is not None:
+            await self.update_inbox.start(application, resume=self.resume_updates_on_startup)
+        self.started = True
+        logger.info("Kontener serwisów uruchomiony")
+    
+    async def stop(self, application=None) -> None:
+        """
+        Czeka na zadania w tle po zatrzymaniu aplikacji (Application.post_stop)
+
+        Wywoływane przed Application.shutdown() - generacje mogą jeszcze wysłać odpowiedź
+        (klient HTTP bota jest otwarty), a zmiany chat_data trafią do zapisu stanu.
+        Wstrzymane przez nie aktualizacje są potwierdzane w otwartej jeszcze skrzynce.
+        """
+        await wait_for_background_tasks(timeout=BACKGROUND_TASKS_SHUTDOWN_TIMEOUT)
+        if pending_background_tasks():
+            logger.warning(f"Zatrzymanie bez oczekiwania na {pending_background_tasks()} zadań w tle")
+    
+    async def shutdown(self, application=None) -> None:
+        """Zamyka połączenia przy zatrzymaniu aplikacji (Application.post_shutdown)"""
+        if self._update_inbox is not None:
+            await self._update_inbox.close()
+        
+        if self._repository_service is not None:
+            await self._repository_service.close()
+        
+        if self._api_service is not None:
+            await self._api_service.close()
+        
+        self._repository_service = None
+        self._api_service = None
+        self._update_inbox = None
+        self.started = False
+        logger.info("Kontener serwisów zatrzymany")
+
+# Globalna instancja kontenera
+container = ServiceContainer()
+
+def get_container() -> ServiceContainer:
+    """Zwraca globalny kontener serwisów"""
+    return container
@@ -0,0 +1,258 @@
+# services/leader_election.py
+"""
+Wybór lidera dla long pollingu - tylko lider wywołuje getUpdates
+
+Instancje rywalizują o dzierżawę (lease) z czasem wygaśnięcia: w lokalnym pliku
+SQLite (jeden host) lub w tabeli bot_leases w Supabase (wiele hostów). Rezerwa
+ma uruchomioną aplikację (połączenia, pamięci podręczne, handlery) i zaczyna
+pobierać aktualizacje zaraz po przejęciu dzierżawy. Lider zamykany przy
+wdrożeniu zatwierdza pobrane aktualizacje i zwalnia dzierżawę przed dokończeniem
+obsługi, więc rezerwa przejmuje ją w ciągu jednego odnowienia.
+
+Niedokończone aktualizacje zakończonej instancji lider przejmuje ze skrzynki
+aktualizacji, która jest lokalnym plikiem SQLite. Gwarancja dokładnie jednokrotnej
+obsługi obejmuje więc tylko instancje na jednym hoście (wspólny plik skrzynki).
+Przy dzierżawach w Supabase instancje na różnych hostach nie widzą nawzajem swoich
+skrzynek - aktualizacje pobrane przez lidera, który uległ awarii, zostaną obsłużone
+dopiero po jego ponownym uruchomieniu z tym samym plikiem skrzynki.
+"""
+import asyncio
+import logging
+import sqlite3
+import time
+from typing import Optional
+from telegram.ext import Application
+from api.supabase_client import SupabaseClient
+from services.app_lifecycle import running_application, stop_on_signals
+
+logger = logging.getLogger(__name__)
+
+# Prefiks dzierżaw członkostwa - potwierdzają, że instancja działa (właściciel wpisów skrzynki)
+MEMBER_PREFIX = "member:"
+# Co ile sekund lider przejmuje niedokończone aktualizacje zakończonych instancji
+ADOPT_INTERVAL = 30.0
+
+class SqliteLease:
+    """Dzierżawy w lokalnym pliku SQLite (instancje na jednym hoście)"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._db = sqlite3.connect(path, isolation_level=None, timeout=1.0, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS leases (name TEXT PRIMARY KEY, holder TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+
+    async def acquire(self, name: str, holder: str, ttl: float) -> bool:
+        now = time.time()
+        cursor = self._db.execute(
+            "INSERT INTO leases (name, holder, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET holder = excluded.holder, expires_at = excluded.expires_at "
+            "WHERE leases.holder = excluded.holder OR leases.expires_at < ?",
+            (name, holder, now + ttl, now)
+        )
+        return cursor.rowcount == 1
+
+    async def release(self, name: str, holder: str) -> bool:
+        cursor = self._db.execute("DELETE FROM leases WHERE name = ? AND holder = ?", (name, holder))
+        return cursor.rowcount == 1
+
+    async def holder(self, name: str) -> Optional[str]:
+        row = self._db.execute(
+            "SELECT holder FROM leases WHERE name = ? AND expires_at >= ?", (name, time.time())
+        ).fetchone()
+        return row[0] if row else None
+
+    async def close(self) -> None:
+        self._db.close()
+
+class SupabaseLease:
+    """
+    Dzierżawy w tabeli bot_leases (funkcje acquire_bot_lease, release_bot_lease, bot_lease_holder)
+
+    Wywołania bez ponowień i wyłącznika obwodu - ponowienie po czasie ważności
+    dzierżawy nie ma sensu, a limit czasu odnowienia wyznacza LeaderElector.
+    """
+
+    def __init__(self, client: SupabaseClient):
+        self.client = client
+
+    async def acquire(self, name: str, holder: str, ttl: float) -> bool:
+        result = await self.client.rpc(
+            "acquire_bot_lease", {"p_name": name, "p_holder": holder, "p_ttl_seconds": ttl}, retry=False
+        )
+        return bool(result)
+
+    async def release(self, name: str, holder: str) -> bool:
+        result = await self.client.rpc("release_bot_lease", {"p_name": name, "p_holder": holder}, retry=False)
+        return bool(result)
+
+    async def holder(self, name: str) -> Optional[str]:
+        return await self.client.rpc("bot_lease_holder", {"p_name": name}, retry=False)
+
+    async def close(self) -> None:
+        pass
+
+class LeaderElector:
+    """
+    Odnawia dzierżawę członkostwa instancji i rywalizuje o dzierżawę lidera
+
+    Każde odnowienie ma limit czasu kończący się jedno odnowienie przed wygaśnięciem
+    dzierżawy lidera. Lider, który nie zdołał jej odnowić (błąd lub przekroczenie
+    czasu), od razu rezygnuje z przywództwa - nowy lider nie pobiera aktualizacji
+    równolegle ze starym.
+    """
+
+    def __init__(self, lease, name: str, holder: str, ttl: float = 6.0, renew_interval: Optional[float] = None):
+        self.lease = lease
+        self.name = name
+        self.holder = holder
+        self.ttl = ttl
+        self.renew_interval = renew_interval or ttl / 3
+        self.is_leader = False
+        # False po rezygnacji - instancja tylko odnawia członkostwo do zakończenia obsługi
+        self.campaigning = True
+        self.changed = asyncio.Event()
+        self._renewed_at = 0.0
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {"elected": 0, "demoted": 0, "renew_failures": 0}
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        while True:
+            await self._tick()
+            await asyncio.sleep(self.renew_interval)
+
+    async def _renew(self) -> bool:
+        await self.lease.acquire(MEMBER_PREFIX + self.holder, self.holder, self.ttl)
+        return self.campaigning and await self.lease.acquire(self.name, self.holder, self.ttl)
+
+    async def _tick(self) -> None:
+        # Czas sprzed wysłania żądania - baza liczy ważność dzierżawy najwcześniej od tej chwili
+        started = time.monotonic()
+        timeout = self.ttl - self.renew_interval
+        if self.is_leader:
+            timeout = min(timeout, self._renewed_at + self.ttl - self.renew_interval - started)
+        try:
+            if timeout <= 0:
+                raise asyncio.TimeoutError()
+            leader = await asyncio.wait_for(self._renew(), timeout)
+            if leader:
+                self._renewed_at = started
+            self._set_leader(leader)
+        except Exception as e:
+            self.stats["renew_failures"] += 1
+            reason = "przekroczono czas" if isinstance(e, asyncio.TimeoutError) else e
+            logger.error(f"Błąd odnowienia dzierżawy {self.name}: {reason}")
+            # Rezygnacja, zanim dzierżawa wygaśnie i przejmie ją inna instancja
+            if self.is_leader:
+                self._set_leader(False)
+
+    def _set_leader(self, leader: bool) -> None:
+        if leader == self.is_leader:
+            return
+        self.is_leader = leader
+        self.stats["elected" if leader else "demoted"] += 1
+        logger.warning(f"Instancja {self.holder} {'została liderem' if leader else 'nie jest już liderem'} ({self.name})")
+        self.changed.set()
+
+    async def is_alive(self, holder: str) -> bool:
+        """Sprawdza, czy instancja nadal odnawia dzierżawę członkostwa"""
+        try:
+            return await self.lease.holder(MEMBER_PREFIX + holder) == holder
+        except Exception as e:
+            logger.error(f"Nie udało się sprawdzić instancji {holder}: {e}")
+            # Przy wątpliwości nie przejmuj cudzych aktualizacji
+            return True
+
+    async def resign(self) -> None:
+        """Zwalnia dzierżawę lidera, nie przerywając odnawiania członkostwa"""
+        self.campaigning = False
+        was_leader, self.is_leader = self.is_leader, False
+        if was_leader:
+            try:
+                await self.lease.release(self.name, self.holder)
+                logger.info(f"Zwolniono dzierżawę {self.name}")
+            except Exception as e:
+                logger.error(f"Nie udało się zwolnić dzierżawy {self.name}: {e}")
+
+    async def stop(self) -> None:
+        """Kończy odnawianie i zwalnia dzierżawę członkostwa"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        try:
+            await self.lease.release(MEMBER_PREFIX + self.holder, self.holder)
+        except Exception as e:
+            logger.error(f"Nie udało się zwolnić dzierżawy członkostwa: {e}")
+        await self.lease.close()
+
+async def _follow_leadership(application: Application, elector: LeaderElector, stop_event: asyncio.Event) -> None:
+    """Pobiera aktualizacje tylko wtedy, gdy instancja jest liderem"""
+    from services.container import container
+
+    adopted_at = 0.0
+    while not stop_event.is_set():
+        elector.changed.clear()
+        polling = application.updater.running
+        if elector.is_leader and not polling:
+            # Niedokończone aktualizacje poprzedniego lidera (po awarii) - przed nowymi
+            if container.update_inbox is not None:
+                await container.update_inbox.resume(application, elector.is_alive)
+                adopted_at = time.monotonic()
+            await application.updater.start_polling()
+        elif not elector.is_leader and polling:
+            # Zatrzymanie zatwierdza pobrane aktualizacje - następca ich nie otrzyma
+            await application.updater.stop()
+        elif elector.is_leader and container.update_inbox is not None \
+                and time.monotonic() - adopted_at > ADOPT_INTERVAL:
+            # Poprzedni lider mógł się zakończyć, zanim dokończył obsługę
+            await container.update_inbox.resume(application, elector.is_alive)
+            adopted_at = time.monotonic()
+
+        stop_wait = asyncio.create_task(stop_event.wait())
+        change_wait = asyncio.create_task(elector.changed.wait())
+        await asyncio.wait([stop_wait, change_wait], timeout=ADOPT_INTERVAL, return_when=asyncio.FIRST_COMPLETED)
+        stop_wait.cancel()
+        change_wait.cancel()
+
+async def serve_polling_with_leader_election(application: Application, backend: str, lease_name: str,
+                                             holder: str, ttl: float, lease_file: str) -> None:
+    """Uruchamia bota jako lidera lub rezerwę do otrzymania SIGINT/SIGTERM"""
+    from services.container import container
+
+    if backend == "sqlite":
+        lease = SqliteLease(lease_file)
+    elif backend == "supabase":
+        lease = SupabaseLease(container.api_service.supabase)
+        logger.warning(
+            "Wybór lidera przez Supabase: skrzynka aktualizacji jest lokalna - brak gwarancji "
+            "dokładnie jednokrotnej obsługi aktualizacji między hostami"
+        )
+    else:
+        raise ValueError(f"Nieznany mechanizm wyboru lidera: {backend}")
+
+    # Niedokończone aktualizacje wznawia lider - rezerwa nie może przejąć aktualizacji działającego lidera
+    container.resume_updates_on_startup = False
+    elector = LeaderElector(lease, lease_name, holder, ttl)
+
+    stop_event = asyncio.Event()
+    stop_on_signals(stop_event)
+
+    try:
+        async with running_application(application):
+            elector.start()
+            logger.info(f"Instancja {holder} gotowa - oczekuje na dzierżawę {lease_name}")
+            try:
+                await _follow_leadership(application, elector, stop_event)
+            finally:
+                if application.updater.running:
+                    await application.updater.stop()
+                # Następca przejmuje pobieranie, zanim ta instancja dokończy obsługę aktualizacji
+                await elector.resign()
+    finally:
+        # Członkostwo trwa do końca obsługi - następca nie przejmie aktualizacji w toku
+        await elector.stop()
@@ -1,20 +1,246 @@
 # services/repository_service.py
+import copy
 import logging
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional, Tuple, Union
 from api.supabase_client import SupabaseClient
+from api.realtime_client import LocalChangeFeed, RealtimeChangeFeed
 from repositories.user_repository import UserRepository
 from repositories.conversation_repository import ConversationRepository
 from repositories.message_repository import MessageRepository
 from repositories.credit_repository import CreditRepository
+from services.user_snapshot import UserSnapshotLoader
+from services.write_behind import RowCallback, WriteBehindQueue
+from config import (
+    BALANCE_INVALIDATION, REALTIME_HEARTBEAT_INTERVAL,
+    WRITE_BEHIND_FLUSH_INTERVAL_MS, WRITE_BEHIND_BATCH_ROWS, WRITE_BEHIND_MAX_ROWS,
+    WRITE_BEHIND_MAX_RETRIES, WRITE_BEHIND_SPILL_FILE, WRITE_BEHIND_DEAD_LETTER_FILE
+)
 
 logger = logging.getLogger(__name__)
 
+# Funkcje RPC, które tylko czytają dane - nie unieważniają mapy tożsamości
+READ_ONLY_RPCS = {"get_user_snapshot"}
+
+# Grupa handlera zamykającego jednostkę pracy - po wszystkich grupach handlerów bota
+UNIT_OF_WORK_FLUSH_GROUP = 1000
+
+class UnitOfWork:
+    """
+    Zakres jednej aktualizacji Telegrama
+
+    Mapa tożsamości zwraca wynik identycznego odczytu wykonanego wcześniej
+    w tej samej aktualizacji, a zarejestrowane wstawienia są wysyłane
+    do kolejki zapisów w tle po zakończeniu handlerów.
+    """
+
+    def __init__(self, update_id: Optional[int] = None):
+        self.update_id = update_id
+        self.closed = False
+        self._identity_map: Dict[Tuple, List[Dict]] = {}
+        self._inserts: List[Tuple[str, Dict[str, Any], Optional[RowCallback]]] = []
+        self.stats = {"queries": 0, "rpc": 0, "deduplicated": 0, "deferred_writes": 0}
+
+    @staticmethod
+    def _key(table: str, columns: str, filters: Optional[Dict], order_by: Optional[str], limit: Optional[int]) -> Tuple:
+        return (table, columns, tuple(sorted((filters or {}).items(), key=lambda item: item[0])), order_by, limit)
+
+    def get(self, key: Tuple) -> Optional[List[Dict]]:
+        """Zwraca kopię wyniku odczytu (from_dict modyfikuje przekazane słowniki)"""
+        if key in self._identity_map:
+            self.stats["deduplicated"] += 1
+            return copy.deepcopy(self._identity_map[key])
+        return None
+
+    def remember(self, key: Tuple, result: List[Dict]) -> None:
+        self._identity_map[key] = copy.deepcopy(result)
+
+    def invalidate(self, table: Optional[str] = None) -> None:
+        """Usuwa z mapy odczyty tabeli (lub wszystkie, gdy tabela nie jest znana)"""
+        if table is None:
+            self._identity_map.clear()
+            return
+        for key in [key for key in self._identity_map if key[0] == table]:
+            del self._identity_map[key]
+
+    def register_insert(self, table: str, row: Dict[str, Any], on_saved: Optional[RowCallback] = None) -> None:
+        """Odkłada wstawienie wiersza do końca aktualizacji"""
+        self._inserts.append((table, row, on_saved))
+        self.invalidate(table)
+        self.stats["deferred_writes"] += 1
+
+    @property
+    def pending_writes(self) -> int:
+        return len(self._inserts)
+
+    def take_inserts(self) -> List[Tuple[str, Dict[str, Any], Optional[RowCallback]]]:
+        """Zwraca odłożone wstawienia (w kolejności rejestracji) i czyści listę"""
+        inserts, self._inserts = self._inserts, []
+        return inserts
+
+_current_unit_of_work: ContextVar[Optional[UnitOfWork]] = ContextVar("unit_of_work", default=None)
+
+def current_unit_of_work() -> Optional[UnitOfWork]:
+    """Zwraca otwartą jednostkę pracy bieżącej aktualizacji"""
+    unit_of_work = _current_unit_of_work.get()
+    if unit_of_work is not None and not unit_of_work.closed:
+        return unit_of_work
+    return None
+
+class UnitOfWorkClient:
+    """
+    Klient Supabase dla repozytoriów, korzystający z jednostki pracy bieżącej aktualizacji
+
+    Poza aktualizacją (np. zadania w tle po jej zakończeniu) działa jak zwykły klient.
+    """
+
+    def __init__(self, client: SupabaseClient, write_behind: Optional[WriteBehindQueue] = None):
+        self.client = client
+        self.write_behind = write_behind
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.client, name)
+
+    async def query(self, table: str, query_type: str = "select",
+                    columns: str = "*", filters: Optional[Dict] = None,
+                    data: Optional[Union[Dict, List[Dict]]] = None, order_by: Optional[str] = None,
+                    limit: Optional[int] = None, on_conflict: Optional[str] = None) -> List[Dict]:
+        unit_of_work = current_unit_of_work()
+        if unit_of_work is None:
+            return await self.client.query(table, query_type, columns, filters, data, order_by, limit, on_conflict)
+
+        if query_type == "select":
+            key = UnitOfWork._key(table, columns, filters, order_by, limit)
+            cached = unit_of_work.get(key)
+            if cached is not None:
+                return cached
+
+            unit_of_work.stats["queries"] += 1
+            result = await self.client.query(table, query_type, columns, filters, data, order_by, limit)
+            unit_of_work.remember(key, result)
+            return result
+
+        unit_of_work.stats["queries"] += 1
+        unit_of_work.invalidate(table)
+        return await self.client.query(table, query_type, columns, filters, data, order_by, limit, on_conflict)
+
+    async def rpc(self, function_name: str, params: Optional[Dict[str, Any]] = None) -> Any:
+        unit_of_work = current_unit_of_work()
+        if unit_of_work is not None:
+            unit_of_work.stats["rpc"] += 1
+            if function_name not in READ_ONLY_RPCS:
+                # Funkcja mogła zmienić dowolną tabelę
+                unit_of_work.invalidate()
+        return await self.client.rpc(function_name, params)
+
+    def defer_insert(self, table: str, row: Dict[str, Any], on_saved: Optional[RowCallback] = None) -> bool:
+        """
+        Odkłada wstawienie do końca aktualizacji lub przekazuje je do kolejki zapisów w tle
+
+        Returns:
+            bool: False, gdy zapisu nie można odłożyć - wtedy trzeba go wykonać od razu
+        """
+        unit_of_work = current_unit_of_work()
+        if unit_of_work is not None:
+            unit_of_work.register_insert(table, row, on_saved)
+            return True
+        if self.write_behind is not None:
+            return self.write_behind.try_put(table, row, on_saved)
+        return False
+
 class RepositoryService:
     """Centralny serwis zapewniający dostęp do wszystkich repozytoriów"""
     
     def __init__(self, supabase_client: SupabaseClient):
-        self.user_repository = UserRepository(supabase_client)
-        self.conversation_repository = ConversationRepository(supabase_client)
-        self.message_repository = MessageRepository(supabase_client)
-        self.credit_repository = CreditRepository(supabase_client)
+        self.supabase_client = supabase_client
+        
+        # Wstawienia, na które użytkownik nie musi czekać, zapisywane zbiorczo w tle
+        self.write_behind = WriteBehindQueue(
+            supabase_client,
+            flush_interval_ms=WRITE_BEHIND_FLUSH_INTERVAL_MS,
+            batch_rows=WRITE_BEHIND_BATCH_ROWS,
+            max_rows=WRITE_BEHIND_MAX_ROWS,
+            max_retries=WRITE_BEHIND_MAX_RETRIES,
+            spill_path=WRITE_BEHIND_SPILL_FILE,
+            dead_letter_path=WRITE_BEHIND_DEAD_LETTER_FILE
+        )
+        
+        # Repozytoria korzystają z mapy tożsamości i jednostki pracy bieżącej aktualizacji
+        client = UnitOfWorkClient(supabase_client, self.write_behind)
+        self.user_repository = UserRepository(client)
+        self.conversation_repository = ConversationRepository(client)
+        self.message_repository = MessageRepository(client, on_message_saved=self.conversation_repository.touch)
+        self.conversation_repository.on_conversation_reset = self.message_repository.history_cache.invalidate
+        self.credit_repository = CreditRepository(client)
+        self.user_snapshot_loader = UserSnapshotLoader(client, self.credit_repository, self.conversation_repository)
+        
+        # Zmiany sald wykonane poza procesem (inne instancje, webhooki Stripe) unieważniają cache sald
+        self.balance_feed = self._create_balance_feed(supabase_client)
+        self.balance_feed.subscribe(self.credit_repository.on_balance_change)
+        
+        logger.info("Serwis Repozytorium zainicjalizowany")
+    
+    def _create_balance_feed(self, supabase_client: SupabaseClient) -> LocalChangeFeed:
+        """Tworzy strumień zmian tabeli user_credits"""
+        table = self.credit_repository.credits_table
+        if BALANCE_INVALIDATION == "realtime" and supabase_client.http is not None:
+            return RealtimeChangeFeed(
+                supabase_client.url, supabase_client.key, table,
+                heartbeat_interval=REALTIME_HEARTBEAT_INTERVAL
+            )
         
-        logger.info("Serwis Repozytorium zainicjalizowany")
\ No newline at end of file
+        logger.info("Supabase Realtime wyłączony - saldo w cache wygasa po TTL")
+        return LocalChangeFeed(table)
+    
+    async def start(self) -> None:
+        """Uruchamia nasłuchiwanie zmian, zapisy w tle i zwalnianie wygasłych rezerwacji"""
+        await self.write_behind.start()
+        await self.conversation_repository.start()
+        await self.credit_repository.start()
+        await self.balance_feed.start()
+    
+    async def close(self) -> None:
+        """Zatrzymuje nasłuchiwanie zmian i zapisuje oczekujące wiersze"""
+        await self.end_unit_of_work()
+        await self.write_behind.close()
+        await self.conversation_repository.close()
+        await self.credit_repository.close()
+        await self.balance_feed.stop()
+    
+    async def begin_unit_of_work(self, update_id: Optional[int] = None) -> UnitOfWork:
+        """Otwiera jednostkę pracy dla aktualizacji"""
+        # Aktualizacja przerwana przez ApplicationHandlerStop mogła zostawić niewysłane zapisy
+        await self.end_unit_of_work()
+        
+        unit_of_work = UnitOfWork(update_id)
+        _current_unit_of_work.set(unit_of_work)
+        return unit_of_work
+    
+    async def end_unit_of_work(self) -> None:
+        """Wysyła odłożone zapisy i zamyka jednostkę pracy bieżącej aktualizacji"""
+        unit_of_work = current_unit_of_work()
+        if unit_of_work is None:
+            return
+        
+        unit_of_work.closed = True
+        _current_unit_of_work.set(None)
+        
+        for table, row, on_saved in unit_of_work.take_inserts():
+            await self.write_behind.put(table, row, on_saved)
+        
+        stats = unit_of_work.stats
+        logger.debug(
+            f"Aktualizacja {unit_of_work.update_id}: {stats['queries']} zapytań, {stats['rpc']} wywołań RPC, "
+            f"{stats['deduplicated']} odczytów z mapy tożsamości, "
+            f"{stats['deferred_writes']} zapisów przekazanych do kolejki w tle"
+        )
+
+async def begin_update_unit_of_work(update, context) -> None:
+    """Handler wstępny - otwiera jednostkę pracy przed wszystkimi handlerami aktualizacji"""
+    from services.container import container
+    await container.repository_service.begin_unit_of_work(getattr(update, 'update_id', None))
+
+async def end_update_unit_of_work(update, context) -> None:
+    """Handler końcowy - zapisuje zmiany odłożone przez handlery aktualizacji"""
+    from services.container import container
+    await container.repository_service.end_unit_of_work()
@@ -0,0 +1,474 @@
+# services/sharding.py
+"""
+Nadzorca procesów roboczych bota (shardów)
+
+Nadzorca jako jedyny odbiera aktualizacje (long polling lub webhook) i kieruje je
+do procesów roboczych według spójnego haszowania ID użytkownika - aktualizacje
+użytkownika zawsze trafiają do tego samego procesu, więc context.chat_data
+i pamięci podręczne procesu pozostają lokalne. Każdy proces roboczy uruchamia
+pełną aplikację (handlery, kontener serwisów) i korzysta z własnego rdzenia CPU.
+
+Z dziennikiem (UpdateInbox) nadzorca zapisuje aktualizację, zanim potwierdzi ją
+Telegramowi (odpowiedź webhooka, przesunięcie offsetu getUpdates). Wpis jest
+oznaczany jako przekazany dopiero wtedy, gdy proces roboczy zapisze aktualizację
+we własnej skrzynce - po awarii nadzorcy aktualizacje z buforów i kolejek
+procesów roboczych są kierowane ponownie przy starcie.
+"""
+import asyncio
+import bisect
+import hashlib
+import importlib
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import sys
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Liczba punktów każdego shardu na pierścieniu (równomierność rozkładu)
+RING_REPLICAS = 100
+# Zmienna środowiskowa z numerem shardu procesu roboczego (np. osobne pliki zrzutu)
+SHARD_ENV = "BOT_SHARD_ID"
+# Sygnał zakończenia procesu roboczego
+STOP_SIGNAL = None
+# Co ile sekund nadzorca sprawdza procesy robocze
+MONITOR_INTERVAL = 1.0
+# Maksymalna przerwa między kolejnymi restartami procesu roboczego (sekundy)
+MAX_RESTART_BACKOFF = 30.0
+# Czas oczekiwania long pollingu (sekundy)
+POLL_TIMEOUT = 30
+
+def _hash(value: str) -> int:
+    # Stabilny skrót (hash() w Pythonie jest losowany per proces)
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+
+class ConsistentHashRing:
+    """Pierścień spójnego haszowania - usunięcie shardu przenosi tylko jego klucze"""
+
+    def __init__(self, shards: Iterable[int] = (), replicas: int = RING_REPLICAS):
+        self.replicas = replicas
+        self.shards = set()
+        self._points: List[int] = []
+        self._owners: Dict[int, int] = {}
+        for shard in shards:
+            self.add(shard)
+
+    def add(self, shard: int) -> None:
+        if shard in self.shards:
+            return
+        self.shards.add(shard)
+        for replica in range(self.replicas):
+            point = _hash(f"shard-{shard}-{replica}")
+            self._owners[point] = shard
+            bisect.insort(self._points, point)
+
+    def remove(self, shard: int) -> None:
+        if shard not in self.shards:
+            return
+        self.shards.discard(shard)
+        self._points = [point for point in self._points if self._owners[point] != shard]
+        self._owners = {point: owner for point, owner in self._owners.items() if owner != shard}
+
+    def shard_for(self, key: Any) -> Optional[int]:
+        """Zwraca shard odpowiedzialny za klucz"""
+        if not self._points:
+            return None
+        index = bisect.bisect(self._points, _hash(str(key))) % len(self._points)
+        return self._owners[self._points[index]]
+
+def routing_key(data: Dict[str, Any]) -> Any:
+    """Klucz routingu aktualizacji (JSON): ID użytkownika, a gdy go brak - ID czatu lub update_id"""
+    for value in data.values():
+        if not isinstance(value, dict):
+            continue
+        user = value.get("from") or value.get("user")
+        if isinstance(user, dict) and "id" in user:
+            return user["id"]
+        chat = value.get("chat") or (value.get("message") or {}).get("chat")
+        if isinstance(chat, dict) and "id" in chat:
+            return chat["id"]
+    return data.get("update_id")
+
+# --- proces roboczy ---
+
+def _load_application(spec: str):
+    module_name, _, attribute = spec.partition(":")
+    # Proces spawn wykonuje skrypt startowy nadzorcy jako __mp_main__ - aplikacja jest już zbudowana
+    main_module = sys.modules.get("__mp_main__")
+    main_file = getattr(main_module, "__file__", None) or ""
+    if main_module is not None and os.path.splitext(os.path.basename(main_file))[0] == module_name:
+        return getattr(main_module, attribute)
+    return getattr(importlib.import_module(module_name), attribute)
+
+def worker_main(shard_id: int, updates, ready, app_spec: str, acks=None) -> None:
+    """Punkt wejścia procesu roboczego"""
+    # Zatrzymaniem procesów roboczych steruje nadzorca (STOP_SIGNAL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    logging.basicConfig(level=logging.INFO, format=f"[shard {shard_id}] %(levelname)s:%(name)s:%(message)s")
+    application = _load_application(app_spec)
+    asyncio.run(_run_worker(shard_id, application, updates, ready, acks))
+
+def _next_update(updates, parent_pid: int):
+    """Blokujący odczyt kolejki; kończy proces, gdy nadzorca przestał działać"""
+    while True:
+        try:
+            return updates.get(timeout=1.0)
+        except queue.Empty:
+            if os.getppid() != parent_pid:
+                return STOP_SIGNAL
+
+async def _run_worker(shard_id: int, application, updates, ready, acks=None) -> None:
+    from telegram import Update
+    from services.app_lifecycle import running_application
+
+    loop = asyncio.get_running_loop()
+    parent_pid = os.getppid()
+    async with running_application(application):
+        ready.set()
+        logger.info(f"Proces roboczy shardu {shard_id} gotowy (pid {os.getpid()})")
+        while True:
+            data = await loop.run_in_executor(None, _next_update, updates, parent_pid)
+            if data is STOP_SIGNAL:
+                break
+            try:
+                # Kolejka aplikacji zapisuje aktualizację w skrzynce shardu
+                await application.update_queue.put(Update.de_json(data, application.bot))
+            except Exception as e:
+                logger.error(f"Niepoprawna aktualizacja w shardzie {shard_id}: {e}")
+            if acks is not None:
+                # Nadzorca może oznaczyć aktualizację w dzienniku jako przekazaną
+                acks.put(data.get("update_id"))
+    logger.info(f"Proces roboczy shardu {shard_id} zakończony")
+
+# --- nadzorca ---
+
+class ShardWorker:
+    """Proces roboczy shardu wraz z kolejką aktualizacji i buforem na czas restartu"""
+
+    def __init__(self, shard_id: int, ctx, app_spec: str, max_queue: int, acks=None):
+        self.shard_id = shard_id
+        self.acks = acks
+        self.ctx = ctx
+        self.app_spec = app_spec
+        self.max_queue = max_queue
+        self.process = None
+        self.updates = None
+        self.ready = None
+        # Aktualizacje czekające na (ponowne) uruchomienie procesu
+        self.buffer: Deque[Dict[str, Any]] = deque()
+        self.down_since: Optional[float] = None
+        self.next_restart = 0.0
+        self.consecutive_failures = 0
+        self.stats = {"routed": 0, "restarts": 0, "dropped": 0}
+
+    def start(self) -> None:
+        self.updates = self.ctx.Queue(self.max_queue)
+        self.ready = self.ctx.Event()
+        self.process = self.ctx.Process(
+            target=worker_main,
+            args=(self.shard_id, self.updates, self.ready, self.app_spec, self.acks),
+            name=f"bot-shard-{self.shard_id}"
+        )
+        # Proces potomny dziedziczy środowisko - numer shardu rozdziela jego pliki lokalne
+        os.environ[SHARD_ENV] = str(self.shard_id)
+        try:
+            self.process.start()
+        finally:
+            os.environ.pop(SHARD_ENV, None)
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.is_alive()
+
+    @property
+    def available(self) -> bool:
+        return self.alive and self.ready.is_set()
+
+    def send(self, data: Dict[str, Any]) -> bool:
+        try:
+            self.updates.put_nowait(data)
+        except queue.Full:
+            return False
+        self.stats["routed"] += 1
+        return True
+
+    def flush_buffer(self) -> None:
+        while self.buffer and self.send(self.buffer[0]):
+            self.buffer.popleft()
+
+    def recover_queue(self) -> None:
+        """Przenosi do bufora aktualizacje, których zakończony proces nie odebrał"""
+        pending: List[Dict[str, Any]] = []
+        while True:
+            try:
+                data = self.updates.get_nowait()
+            except (queue.Empty, OSError, ValueError):
+                break
+            if data is not STOP_SIGNAL:
+                pending.append(data)
+        self.buffer.extendleft(reversed(pending))
+
+    def metrics(self) -> Dict[str, Any]:
+        try:
+            depth = self.updates.qsize() if self.updates is not None else 0
+        except NotImplementedError:  # macOS
+            depth = -1
+        return {
+            "alive": self.alive,
+            "ready": bool(self.ready is not None and self.ready.is_set()),
+            "queue": depth,
+            "buffered": len(self.buffer),
+            **self.stats
+        }
+
+class ShardSupervisor:
+    """Uruchamia procesy robocze, kieruje do nich aktualizacje i restartuje te, które się zakończyły"""
+
+    def __init__(self, workers: int, app_spec: str = "main:application", max_queue: int = 1000,
+                 rebalance_after: float = 30.0, buffer_limit: int = 10000, metrics_interval: float = 60.0,
+                 inbox=None):
+        self.ctx = multiprocessing.get_context("spawn")
+        # Dziennik aktualizacji nadzorcy (UpdateInbox) i potwierdzenia zapisu od procesów roboczych
+        self.inbox = inbox
+        self.acks = self.ctx.Queue() if inbox is not None else None
+        self.shards = {
+            shard: ShardWorker(shard, self.ctx, app_spec, max_queue, self.acks) for shard in range(workers)
+        }
+        self.ring = ConsistentHashRing(self.shards)
+        self.rebalance_after = rebalance_after
+        self.buffer_limit = buffer_limit
+        self.metrics_interval = metrics_interval
+        self._stopping = False
+        self._tasks: List[asyncio.Task] = []
+
+    async def start(self) -> None:
+        for worker in self.shards.values():
+            worker.start()
+        self._tasks = [asyncio.create_task(self._monitor()), asyncio.create_task(self._log_metrics())]
+        logger.info(f"Uruchomiono {len(self.shards)} procesów roboczych")
+        if self.inbox is not None:
+            await self._resume()
+
+    async def _resume(self) -> None:
+        """Kieruje ponownie aktualizacje zapisane w dzienniku, których procesy robocze nie potwierdziły"""
+        unfinished = self.inbox.unfinished(include_own=True)
+        for _, data in unfinished:
+            await self.route(data)
+        if unfinished:
+            logger.warning(f"Ponownie skierowano {len(unfinished)} aktualizacji z dziennika nadzorcy")
+
+    def accept(self, data: Dict[str, Any]) -> bool:
+        """Zapisuje aktualizację w dzienniku przed jej potwierdzeniem; False dla duplikatu"""
+        if self.inbox is None or self.inbox.record(data["update_id"], data):
+            return True
+        self.inbox.stats["duplicates"] += 1
+        return False
+
+    def _drain_acks(self) -> None:
+        """Oznacza w dzienniku aktualizacje zapisane przez procesy robocze"""
+        if self.acks is None:
+            return
+        while True:
+            try:
+                update_id = self.acks.get_nowait()
+            except (queue.Empty, OSError, ValueError):
+                return
+            if update_id is not None:
+                self.inbox.acknowledge(update_id)
+
+    async def route(self, data: Dict[str, Any]) -> None:
+        """Kieruje aktualizację do shardu użytkownika (z backpressure, gdy kolejka shardu jest pełna)"""
+        key = routing_key(data)
+        while True:
+            worker = self.shards[self.ring.shard_for(key)]
+            if not worker.available or worker.buffer:
+                # Proces jest uruchamiany ponownie - zachowaj kolejność w buforze
+                if len(worker.buffer) >= self.buffer_limit:
+                    worker.buffer.popleft()
+                    worker.stats["dropped"] += 1
+                    logger.error(f"Bufor shardu {worker.shard_id} jest pełny - pominięto najstarszą aktualizację")
+                worker.buffer.append(data)
+                return
+            if worker.send(data):
+                return
+            await asyncio.sleep(0.05)
+
+    async def _monitor(self) -> None:
+        while True:
+            await asyncio.sleep(MONITOR_INTERVAL)
+            if self._stopping:
+                return
+            now = time.monotonic()
+            for worker in self.shards.values():
+                self._check(worker, now)
+            self._drain_acks()
+
+    def _check(self, worker: ShardWorker, now: float) -> None:
+        if not worker.alive:
+            if worker.down_since is None:
+                worker.down_since = now
+                logger.error(f"Proces roboczy shardu {worker.shard_id} zakończył się (kod {worker.process.exitcode})")
+                worker.recover_queue()
+            if now >= worker.next_restart:
+                worker.stats["restarts"] += 1
+                worker.consecutive_failures += 1
+                worker.next_restart = now + min(MAX_RESTART_BACKOFF, 2 ** worker.consecutive_failures)
+                worker.start()
+
+        if worker.down_since is not None:
+            if worker.available:
+                logger.info(f"Proces roboczy shardu {worker.shard_id} ponownie gotowy "
+                            f"(przerwa {now - worker.down_since:.1f}s)")
+                worker.down_since = None
+                worker.consecutive_failures = 0
+                if worker.shard_id not in self.ring.shards:
+                    # Użytkownicy shardu wracają do niego z pozostałych procesów
+                    self.ring.add(worker.shard_id)
+            elif now - worker.down_since > self.rebalance_after and worker.shard_id in self.ring.shards \
+                    and len(self.ring.shards) > 1:
+                # Proces długo niedostępny - jego użytkownicy trafiają do sąsiednich shardów
+                self.ring.remove(worker.shard_id)
+                logger.warning(f"Shard {worker.shard_id} niedostępny od {self.rebalance_after:.0f}s - "
+                               f"przeniesiono jego użytkowników do pozostałych shardów")
+                buffered, worker.buffer = list(worker.buffer), deque()
+                asyncio.create_task(self._reroute(buffered))
+
+        if worker.available and worker.buffer:
+            worker.flush_buffer()
+
+    async def _reroute(self, buffered: List[Dict[str, Any]]) -> None:
+        for data in buffered:
+            await self.route(data)
+
+    async def _log_metrics(self) -> None:
+        while True:
+            await asyncio.sleep(self.metrics_interval)
+            logger.info(f"Shardy: {self.metrics()}")
+
+    def metrics(self) -> Dict[int, Dict[str, Any]]:
+        """Zwraca metryki każdego shardu"""
+        return {shard: worker.metrics() for shard, worker in self.shards.items()}
+
+    async def stop(self, timeout: float = 30.0) -> None:
+        """Przekazuje zbuforowane aktualizacje i zatrzymuje procesy robocze"""
+        self._stopping = True
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+        loop = asyncio.get_running_loop()
+        for worker in self.shards.values():
+            if worker.available:
+                worker.flush_buffer()
+            if worker.buffer:
+                logger.warning(f"Shard {worker.shard_id}: {len(worker.buffer)} aktualizacji nie zostało przekazanych")
+            if worker.alive:
+                await loop.run_in_executor(None, worker.updates.put, STOP_SIGNAL)
+
+        deadline = time.monotonic() + timeout
+        for worker in self.shards.values():
+            if worker.process is None:
+                continue
+            await loop.run_in_executor(None, worker.process.join, max(0.0, deadline - time.monotonic()))
+            if worker.process.is_alive():
+                logger.warning(f"Proces roboczy shardu {worker.shard_id} nie zakończył się - wymuszam zakończenie")
+                worker.process.terminate()
+        # Niepotwierdzone aktualizacje zostają w dzienniku i zostaną skierowane ponownie przy starcie
+        self._drain_acks()
+        logger.info(f"Procesy robocze zatrzymane: {self.metrics()}")
+
+async def _poll_updates(bot, supervisor: ShardSupervisor, stop_event: asyncio.Event) -> None:
+    """Long polling w nadzorcy - jedyny konsument getUpdates"""
+    from telegram import Update
+
+    offset = None
+    failures = 0
+    while not stop_event.is_set():
+        try:
+            updates = await bot.get_updates(offset=offset, timeout=POLL_TIMEOUT, allowed_updates=Update.ALL_TYPES)
+            failures = 0
+        except Exception as e:
+            failures += 1
+            logger.error(f"Błąd pobierania aktualizacji: {e}")
+            await asyncio.sleep(min(MAX_RESTART_BACKOFF, 2 ** failures))
+            continue
+        for update in updates:
+            data = update.to_dict()
+            try:
+                accepted = supervisor.accept(data)
+            except Exception as e:
+                # Offset nie jest przesuwany - Telegram dostarczy aktualizację ponownie
+                logger.error(f"Nie udało się zapisać aktualizacji {update.update_id} w dzienniku: {e}")
+                await asyncio.sleep(1.0)
+                break
+            if accepted:
+                await supervisor.route(data)
+            offset = update.update_id + 1
+
+async def serve_sharded(token: str, workers: int, app_spec: str = "main:application", max_queue: int = 1000,
+                        rebalance_after: float = 30.0, buffer_limit: int = 10000, metrics_interval: float = 60.0,
+                        webhook: Optional[Dict[str, Any]] = None, inbox_file: Optional[str] = None) -> None:
+    """
+    Uruchamia nadzorcę z procesami roboczymi do otrzymania SIGINT/SIGTERM
+
+    Args:
+        webhook: parametry serwera webhooka (url, path, secret_token, host, port, workers,
+            max_queue, max_connections, register); bez nich nadzorca używa long pollingu
+        inbox_file: plik dziennika nadzorcy; bez niego aktualizacje w buforach i kolejkach
+            procesów roboczych giną przy awarii nadzorcy
+    """
+    from telegram import Bot
+    from services.app_lifecycle import stop_on_signals
+
+    secret_token = None
+    if webhook:
+        from services.webhook_server import resolve_webhook_secret
+        # Błędna konfiguracja sekretu zatrzymuje start przed uruchomieniem procesów roboczych
+        secret_token = resolve_webhook_secret(
+            webhook.get("secret_token"), webhook.get("register", True), webhook.get("instances", 1)
+        )
+
+    inbox = None
+    if inbox_file:
+        from services.update_inbox import UpdateInbox
+        inbox = UpdateInbox(inbox_file, owner="supervisor")
+        inbox.open()
+        inbox.prune()
+
+    supervisor = ShardSupervisor(
+        workers, app_spec, max_queue, rebalance_after, buffer_limit, metrics_interval, inbox
+    )
+    stop_event = asyncio.Event()
+    stop_on_signals(stop_event)
+
+    async with Bot(token) as bot:
+        await supervisor.start()
+        server = None
+        try:
+            if webhook:
+                from services.webhook_server import WebhookServer, register_webhook
+                server = WebhookServer(
+                    supervisor.route, webhook["path"], secret_token,
+                    webhook["host"], webhook["port"], webhook["workers"], webhook["max_queue"],
+                    record=supervisor.accept
+                )
+                await server.start()
+                if webhook.get("register", True):
+                    await register_webhook(bot, webhook["url"], server, webhook["max_connections"])
+                await stop_event.wait()
+            else:
+                poller = asyncio.create_task(_poll_updates(bot, supervisor, stop_event))
+                await stop_event.wait()
+                poller.cancel()
+                await asyncio.gather(poller, return_exceptions=True)
+        finally:
+            if server is not None:
+                await server.stop()
+            await supervisor.stop()
+            if inbox is not None:
+                await inbox.close()
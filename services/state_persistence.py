@@ -0,0 +1,319 @@
+# services/state_persistence.py
+"""
+Trwały stan użytkowników bota (PTB BasePersistence w SQLite)
+
+Ustawienia z context.chat_data['user_data'][user_id] (tryb, model, język,
+temat, onboarding, menu, oczekująca wiadomość) przetrwają restart. Każdy
+użytkownik czatu to jeden wiersz z kolumnami dla znanych pól - pozostałe
+wartości trafiają do kolumny extra (JSON). Dane czatu są wczytywane przy
+pierwszej aktualizacji czatu, a czaty bezczynne są usuwane z pamięci.
+"""
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from typing import Any, Dict, List, Optional, Set, Tuple
+from telegram.ext import BasePersistence, PersistenceInput
+
+logger = logging.getLogger(__name__)
+
+# Co ile sekund sprawdzane są czaty bezczynne
+EVICT_INTERVAL = 60.0
+
+# Pola użytkownika zapisywane w osobnych kolumnach (nazwa: typ)
+USER_COLUMNS: Dict[str, type] = {
+    "language": str,
+    "current_mode": str,
+    "current_model": str,
+    "current_theme_id": int,
+    "current_theme_name": str,
+    "onboarding_state": int,
+    "tips_enabled": bool,
+    "menu_state": str,
+    "menu_message_id": int,
+    "pending_message": str,
+}
+
+_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS user_state (
+    chat_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    {", ".join(f"{name} {'TEXT' if kind is str else 'INTEGER'}" for name, kind in USER_COLUMNS.items())},
+    extra TEXT,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (chat_id, user_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS chat_state (
+    chat_id INTEGER PRIMARY KEY,
+    extra TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+_USER_FIELDS = ("chat_id", "user_id", *USER_COLUMNS, "extra", "updated_at")
+_INSERT_USER = f"INSERT INTO user_state ({', '.join(_USER_FIELDS)}) VALUES ({', '.join('?' * len(_USER_FIELDS))})"
+_SELECT_USERS = f"SELECT user_id, {', '.join(USER_COLUMNS)}, extra FROM user_state WHERE chat_id = ?"
+
+ChatRows = Tuple[List[Tuple], Optional[str]]
+
+def _fits(value: Any, kind: type) -> bool:
+    if kind is int:
+        return isinstance(value, int) and not isinstance(value, bool)
+    return isinstance(value, kind)
+
+def _extra_json(values: Dict[str, Any], where: str) -> Optional[str]:
+    """Serializuje pozostałe wartości; pomija te, których nie da się zapisać w JSON"""
+    if not values:
+        return None
+    try:
+        return json.dumps(values, ensure_ascii=False)
+    except (TypeError, ValueError):
+        serializable = {}
+        for key, value in values.items():
+            try:
+                json.dumps(value)
+                serializable[key] = value
+            except (TypeError, ValueError):
+                logger.warning(f"Pominięto wartość {key} ({where}) - nie można jej zapisać")
+        return json.dumps(serializable, ensure_ascii=False) if serializable else None
+
+def encode_chat(chat_id: int, chat_data: Dict[str, Any], now: float) -> ChatRows:
+    """Zamienia chat_data na wiersze user_state i wartość extra dla chat_state"""
+    rows = []
+    for user_id, user_data in (chat_data.get("user_data") or {}).items():
+        if not isinstance(user_id, int) or not isinstance(user_data, dict):
+            logger.warning(f"Pominięto niepoprawny wpis user_data czatu {chat_id}: {user_id!r}")
+            continue
+        columns = []
+        extra = {}
+        for name, kind in USER_COLUMNS.items():
+            value = user_data.get(name)
+            columns.append(value if value is None or _fits(value, kind) else None)
+        for key, value in user_data.items():
+            if key not in USER_COLUMNS or not _fits(value, USER_COLUMNS[key]):
+                extra[str(key)] = value
+        rows.append((chat_id, user_id, *columns, _extra_json(extra, f"użytkownik {user_id}"), now))
+
+    chat_extra = {str(key): value for key, value in chat_data.items() if key != "user_data"}
+    return rows, _extra_json(chat_extra, f"czat {chat_id}")
+
+def decode_user(row: Tuple) -> Tuple[int, Dict[str, Any]]:
+    user_id, *values, extra = row
+    user_data: Dict[str, Any] = {}
+    for (name, kind), value in zip(USER_COLUMNS.items(), values):
+        if value is not None:
+            user_data[name] = bool(value) if kind is bool else value
+    if extra:
+        user_data.update(json.loads(extra))
+    return user_id, user_data
+
+class SqlitePersistence(BasePersistence):
+    """
+    Persystencja chat_data w SQLite
+
+    Application wywołuje update_chat_data co update_interval sekund tylko dla
+    czatów zmienionych od poprzedniego zapisu - wszystkie trafiają do jednej
+    transakcji wykonywanej poza pętlą zdarzeń.
+    """
+
+    def __init__(self, path: str, update_interval: float = 5.0, idle_timeout: float = 1800.0):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=True, user_data=False, callback_data=False),
+            update_interval=update_interval
+        )
+        self.path = path
+        self.idle_timeout = idle_timeout
+        # Odczyty w pętli zdarzeń, zapisy w wątku wykonawcy - osobne połączenia (WAL)
+        self._db = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SCHEMA)
+        self._writer = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self._writer.execute("PRAGMA synchronous=NORMAL")
+
+        self.application = None
+        # Czaty wczytane do pamięci i czas ostatniego użycia (monotonic)
+        self._last_used: Dict[int, float] = {}
+        # Czaty usunięte z pamięci - ich drop_chat_data nie usuwa danych z pliku
+        self._evicted: Set[int] = set()
+        # Zmiany czekające na zapis i zapisywane w tej chwili (None - usunięcie czatu)
+        self._pending: Dict[int, Optional[ChatRows]] = {}
+        self._writing: Dict[int, Optional[ChatRows]] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        self._write_lock = asyncio.Lock()
+        self._evict_task: Optional[asyncio.Task] = None
+        self.stats = {"loaded": 0, "written": 0, "flushes": 0, "evicted": 0}
+
+    # --- cykl życia ---
+
+    def start(self, application) -> None:
+        """Uruchamia usuwanie z pamięci czatów bezczynnych"""
+        self.application = application
+        if self._evict_task is None and self.idle_timeout > 0:
+            self._evict_task = asyncio.create_task(self._evict_periodically())
+
+    async def flush(self) -> None:
+        """Zapisuje oczekujące zmiany i zamyka plik (wywoływane przez Application przy zatrzymaniu)"""
+        if self._evict_task is not None:
+            self._evict_task.cancel()
+            await asyncio.gather(self._evict_task, return_exceptions=True)
+            self._evict_task = None
+        if self._flush_task is not None:
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+        await self._write_pending()
+        self._db.close()
+        self._writer.close()
+        logger.info(f"Stan użytkowników zapisany: {self.stats}")
+
+    # --- chat_data ---
+
+    async def get_chat_data(self) -> Dict[int, Dict[str, Any]]:
+        # Dane czatów są wczytywane leniwie w refresh_chat_data
+        return {}
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: Dict[str, Any]) -> None:
+        """Wczytuje dane czatu przy pierwszym użyciu (wywoływane przed każdym handlerem)"""
+        if chat_id in self._last_used:
+            self._last_used[chat_id] = time.monotonic()
+            return
+        self._last_used[chat_id] = time.monotonic()
+
+        unsaved = self._pending if chat_id in self._pending else self._writing
+        if chat_id in unsaved:
+            # Dane czatu czekają na zapis - nie wczytuj starszych z pliku
+            rows, chat_extra = unsaved[chat_id] or ([], None)
+            users = [decode_user(row[1:-1]) for row in rows]
+        else:
+            users = [decode_user(row) for row in self._db.execute(_SELECT_USERS, (chat_id,))]
+            row = self._db.execute("SELECT extra FROM chat_state WHERE chat_id = ?", (chat_id,)).fetchone()
+            chat_extra = row[0] if row else None
+
+        if chat_extra:
+            for key, value in json.loads(chat_extra).items():
+                chat_data.setdefault(key, value)
+        if users:
+            stored = chat_data.setdefault("user_data", {})
+            for user_id, user_data in users:
+                # Wartości ustawione przed wczytaniem mają pierwszeństwo
+                stored[user_id] = {**user_data, **stored.get(user_id, {})}
+        self.stats["loaded"] += 1
+
+    async def update_chat_data(self, chat_id: int, data: Dict[str, Any]) -> None:
+        self._pending[chat_id] = encode_chat(chat_id, data, time.time())
+        self._schedule_flush()
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        if chat_id in self._evicted:
+            # Usunięcie z pamięci, nie z pliku
+            self._evicted.discard(chat_id)
+            if chat_id in self._last_used and self.application is not None:
+                # Czat wczytany ponownie przed zapisem - Application pominęła jego zmiany
+                self.application.mark_data_for_update_persistence(chat_ids=chat_id)
+            return
+        self._last_used.pop(chat_id, None)
+        self._pending[chat_id] = None
+        self._schedule_flush()
+
+    # --- zapis ---
+
+    def _schedule_flush(self) -> None:
+        # Zadanie uruchomi się po wszystkich update_chat_data bieżącego zapisu Application
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._write_pending())
+
+    async def _write_pending(self) -> None:
+        async with self._write_lock:
+            if not self._pending:
+                return
+            batch = self._writing = self._pending
+            self._pending = {}
+            loop = asyncio.get_running_loop()
+            try:
+                await loop.run_in_executor(None, self._write, batch)
+            except sqlite3.Error as e:
+                logger.error(f"Błąd zapisu stanu {len(batch)} czatów: {e}")
+                # Nowsze zmiany z kolejnego zapisu mają pierwszeństwo
+                self._pending = {**batch, **self._pending}
+                return
+            finally:
+                self._writing = {}
+            self.stats["written"] += len(batch)
+            self.stats["flushes"] += 1
+
+    def _write(self, batch: Dict[int, Optional[ChatRows]]) -> None:
+        now = time.time()
+        db = self._writer
+        with db:
+            db.execute("BEGIN")
+            for chat_id, encoded in batch.items():
+                db.execute("DELETE FROM user_state WHERE chat_id = ?", (chat_id,))
+                if encoded is None:
+                    db.execute("DELETE FROM chat_state WHERE chat_id = ?", (chat_id,))
+                    continue
+                rows, chat_extra = encoded
+                db.executemany(_INSERT_USER, rows)
+                if chat_extra:
+                    db.execute(
+                        "INSERT OR REPLACE INTO chat_state (chat_id, extra, updated_at) VALUES (?, ?, ?)",
+                        (chat_id, chat_extra, now)
+                    )
+                else:
+                    db.execute("DELETE FROM chat_state WHERE chat_id = ?", (chat_id,))
+
+    # --- usuwanie z pamięci ---
+
+    async def _evict_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(EVICT_INTERVAL)
+            self.evict_idle()
+
+    def evict_idle(self) -> int:
+        """Usuwa z pamięci czaty nieużywane dłużej niż idle_timeout (zapisane już w pliku)"""
+        if self.application is None:
+            return 0
+        cutoff = time.monotonic() - self.idle_timeout
+        idle = [chat_id for chat_id, used in self._last_used.items()
+                if used < cutoff and chat_id not in self._pending and chat_id not in self._writing]
+        for chat_id in idle:
+            del self._last_used[chat_id]
+            self._evicted.add(chat_id)
+            self.application.drop_chat_data(chat_id)
+        if idle:
+            self.stats["evicted"] += len(idle)
+            logger.info(f"Usunięto z pamięci dane {len(idle)} bezczynnych czatów")
+        return len(idle)
+
+    # --- dane nieprzechowywane (store_data) ---
+
+    async def get_user_data(self) -> Dict[int, Dict[str, Any]]:
+        return {}
+
+    async def get_bot_data(self) -> Dict[str, Any]:
+        return {}
+
+    async def get_callback_data(self) -> None:
+        return None
+
+    async def get_conversations(self, name: str) -> Dict:
+        return {}
+
+    async def update_conversation(self, name: str, key, new_state) -> None:
+        pass
+
+    async def update_user_data(self, user_id: int, data: Dict[str, Any]) -> None:
+        pass
+
+    async def update_bot_data(self, data: Dict[str, Any]) -> None:
+        pass
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def drop_user_data(self, user_id: int) -> None:
+        pass
+
+    async def refresh_user_data(self, user_id: int, user_data: Dict[str, Any]) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: Dict[str, Any]) -> None:
+        pass
@@ -0,0 +1,362 @@
+# services/update_inbox.py
+"""
+Trwała skrzynka aktualizacji (SQLite WAL) - idempotentna obsługa aktualizacji
+
+update_id jest zapisywany przy odbiorze (przed potwierdzeniem żądania webhooka
+i przed umieszczeniem pobranej aktualizacji w kolejce aplikacji), a po
+zakończeniu obsługi oznaczany jako obsłużony. Powtórnie dostarczona aktualizacja (Telegram po awarii procesu,
+ponowienie webhooka) jest pomijana, więc kredyty nie są pobierane dwa razy.
+Aktualizacje przyjęte lub niedokończone przed awarią są obsługiwane ponownie przy starcie.
+
+Każdy wpis ma właściciela (instancję bota, która go obsługuje). Kilka instancji
+może dzielić plik skrzynki (np. lider i rezerwa na jednym hoście) - instancja
+przejmuje niedokończone aktualizacje innej tylko wtedy, gdy tamta już nie działa.
+Instancje na różnych hostach mają osobne pliki, więc nie widzą nawzajem swoich
+wpisów - skrzynka nie daje wtedy gwarancji dokładnie jednokrotnej obsługi.
+"""
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+from telegram import Update
+from telegram.ext import ApplicationHandlerStop, ContextTypes
+
+logger = logging.getLogger(__name__)
+
+# Grupy handlerów: zapis przed wszystkimi handlerami, potwierdzenie po zapisie jednostki pracy
+UPDATE_INBOX_GROUP = -4
+UPDATE_INBOX_COMPLETE_GROUP = 1001
+
+PENDING = 0
+DONE = 1
+FAILED = 2
+
+# Co ile sekund usuwane są stare wpisy obsłużonych aktualizacji
+PRUNE_INTERVAL = 3600
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS updates (
+    update_id INTEGER PRIMARY KEY,
+    status INTEGER NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 1,
+    received_at REAL NOT NULL,
+    finished_at REAL,
+    payload TEXT,
+    owner TEXT
+) WITHOUT ROWID
+"""
+
+# Sprawdza, czy instancja (właściciel wpisów) nadal działa
+OwnerLiveness = Callable[[str], Awaitable[bool]]
+
+class _Claim:
+    """Aktualizacja obsługiwana w tym procesie wraz z zadaniami w tle, które ją wstrzymują"""
+    __slots__ = ("update_id", "holds", "handled")
+
+    def __init__(self, update_id: int):
+        self.update_id = update_id
+        self.holds: Set[asyncio.Task] = set()
+        # Handlery zakończone - potwierdzenie czeka tylko na zadania w tle
+        self.handled = False
+
+_current_claim: ContextVar[Optional[_Claim]] = ContextVar("update_inbox_claim", default=None)
+
+class UpdateInbox:
+    """
+    Skrzynka aktualizacji w lokalnym pliku SQLite
+
+    Zapisy wykonywane są synchronicznie w pętli zdarzeń: w trybie WAL
+    z synchronous=NORMAL zatwierdzenie nie wymaga fsync, więc kosztuje
+    dziesiątki mikrosekund i przetrwa awarię procesu (nie zasilania).
+    """
+
+    def __init__(self, path: str, retention: float = 86400.0, max_attempts: int = 3, owner: str = "local"):
+        self.path = path
+        self.owner = owner
+        # Telegram ponawia dostarczenie aktualizacji najdłużej przez dobę
+        self.retention = retention
+        self.max_attempts = max_attempts
+        self._db: Optional[sqlite3.Connection] = None
+        self._active: Dict[int, _Claim] = {}
+        self._prune_task: Optional[asyncio.Task] = None
+        # True do pierwszego zapisu lub wznowienia - własne niedokończone wpisy pochodzą z poprzedniego uruchomienia
+        self._fresh = True
+        self.stats = {"claimed": 0, "completed": 0, "duplicates": 0, "resumed": 0, "abandoned": 0}
+
+    # --- cykl życia ---
+
+    def open(self) -> None:
+        if self._db is not None:
+            return
+        self._db = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(_SCHEMA)
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(updates)")}
+        if "owner" not in columns:
+            self._db.execute("ALTER TABLE updates ADD COLUMN owner TEXT")
+
+    async def start(self, application, resume: bool = True) -> None:
+        """
+        Otwiera skrzynkę i ponownie kolejkuje aktualizacje niedokończone przed restartem
+
+        Wznowienie bez sprawdzania właścicieli zakłada, że plik skrzynki należy tylko
+        do tej instancji (wcześniejsze uruchomienia) - przy pliku współdzielonym
+        wznawia lider z funkcją is_alive (resume=False).
+
+        Args:
+            resume: False, gdy wznowienie nastąpi później (np. po wyborze na lidera)
+        """
+        self.open()
+        if resume:
+            await self.resume(application)
+        self.prune()
+        self._prune_task = asyncio.create_task(self._prune_periodically())
+
+    async def resume(self, application, is_alive: Optional[OwnerLiveness] = None) -> int:
+        """
+        Przejmuje niedokończone aktualizacje innych instancji i kolejkuje je w aplikacji
+
+        Przy pierwszym wywołaniu, zanim instancja cokolwiek zapisała, wznawiane są też
+        jej własne wpisy - po restarcie ze stałym BOT_INSTANCE_ID właściciel się nie zmienia.
+
+        Args:
+            is_alive: sprawdza, czy właściciel wpisów działa; bez niej przejmowane są wszystkie
+
+        Returns:
+            int: liczba wznowionych aktualizacji
+        """
+        live_owners = await self._live_owners(is_alive) if is_alive is not None else []
+        include_own, self._fresh = self._fresh, False
+        resumed = 0
+        for update_id, payload in self.unfinished(live_owners, include_own):
+            # Przejęcie przed kolejkowaniem - kolejne wywołanie nie wznowi aktualizacji drugi raz
+            self._db.execute("UPDATE updates SET owner = ? WHERE update_id = ?", (self.owner, update_id))
+            try:
+                await application.update_queue.put(Update.de_json(payload, application.bot))
+                resumed += 1
+            except Exception as e:
+                logger.error(f"Nie udało się wznowić aktualizacji {update_id}: {e}")
+        if resumed:
+            logger.warning(f"Wznowiono {resumed} aktualizacji niedokończonych przez zakończone instancje")
+        return resumed
+
+    async def _live_owners(self, is_alive: OwnerLiveness) -> List[str]:
+        owners = [owner for (owner,) in self._db.execute(
+            "SELECT DISTINCT owner FROM updates WHERE status = ? AND owner IS NOT NULL AND owner != ?",
+            (PENDING, self.owner)
+        ).fetchall()]
+        return [owner for owner in owners if await is_alive(owner)]
+
+    async def close(self) -> None:
+        if self._prune_task is not None:
+            self._prune_task.cancel()
+            await asyncio.gather(self._prune_task, return_exceptions=True)
+            self._prune_task = None
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+        logger.info(f"Skrzynka aktualizacji zamknięta: {self.stats}")
+
+    # --- obsługa aktualizacji ---
+
+    def record(self, update_id: int, payload: Dict[str, Any]) -> bool:
+        """
+        Zapisuje aktualizację przy odbiorze, zanim trafi do kolejki w pamięci
+
+        Wpis ma zero prób obsługi - claim() rozpoczyna pierwszą. Przy zamkniętej
+        skrzynce nic nie jest zapisywane (o duplikatach decyduje wtedy claim()).
+
+        Returns:
+            bool: False, gdy aktualizacja została już obsłużona lub obsługuje ją inna instancja
+        """
+        if self._db is None:
+            return True
+        self._fresh = False
+        cursor = self._db.execute(
+            "INSERT OR IGNORE INTO updates (update_id, status, attempts, received_at, payload, owner) "
+            "VALUES (?, ?, 0, ?, ?, ?)",
+            (update_id, PENDING, time.time(), json.dumps(payload, ensure_ascii=False), self.owner)
+        )
+        if cursor.rowcount == 1:
+            return True
+        status, owner = self._db.execute(
+            "SELECT status, owner FROM updates WHERE update_id = ?", (update_id,)
+        ).fetchone()
+        # Niedokończona aktualizacja tej instancji (wznowienie) - limit prób sprawdza claim()
+        return status == PENDING and (owner is None or owner == self.owner)
+
+    def claim(self, update: Update) -> Optional[_Claim]:
+        """
+        Zapisuje aktualizację przed obsługą
+
+        Returns:
+            Optional[_Claim]: None, gdy aktualizacja została już obsłużona lub jest obsługiwana
+        """
+        update_id = update.update_id
+        if update_id in self._active:
+            return None
+        self._fresh = False
+
+        cursor = self._db.execute(
+            "INSERT OR IGNORE INTO updates (update_id, status, received_at, payload, owner) VALUES (?, ?, ?, ?, ?)",
+            (update_id, PENDING, time.time(), json.dumps(update.to_dict(), ensure_ascii=False), self.owner)
+        )
+        if cursor.rowcount == 0:
+            row = self._db.execute(
+                "SELECT status, attempts, owner FROM updates WHERE update_id = ?", (update_id,)
+            ).fetchone()
+            status, attempts, owner = row
+            if status != PENDING:
+                return None
+            if owner is not None and owner != self.owner:
+                # Obsługuje ją inna instancja - przejęcie tylko przez resume() po jej zakończeniu
+                return None
+            if attempts == 0:
+                # Zapisana przy odbiorze (record) - pierwsza próba obsługi
+                self._db.execute("UPDATE updates SET attempts = 1 WHERE update_id = ?", (update_id,))
+            else:
+                # Aktualizacja niedokończona przed restartem - wznowienie lub ponowne dostarczenie
+                if attempts >= self.max_attempts:
+                    self._finish(update_id, FAILED)
+                    self.stats["abandoned"] += 1
+                    logger.error(f"Porzucono aktualizację {update_id} po {attempts} nieudanych próbach obsługi")
+                    return None
+                self._db.execute("UPDATE updates SET attempts = attempts + 1 WHERE update_id = ?", (update_id,))
+                self.stats["resumed"] += 1
+
+        claim = _Claim(update_id)
+        self._active[update_id] = claim
+        self.stats["claimed"] += 1
+        return claim
+
+    def acknowledge(self, update_id: int) -> None:
+        """Oznacza zapisaną aktualizację jako obsłużoną poza tym procesem (np. przekazaną do procesu roboczego)"""
+        if self._db is None:
+            return
+        self._finish(update_id, DONE)
+        self.stats["completed"] += 1
+
+    def complete(self, claim: _Claim) -> None:
+        """Oznacza aktualizację jako obsłużoną, gdy zakończą się też wstrzymujące ją zadania w tle"""
+        claim.handled = True
+        if claim.holds:
+            return
+        if self._active.pop(claim.update_id, None) is None:
+            return
+        if self._db is not None:
+            self._finish(claim.update_id, DONE)
+        self.stats["completed"] += 1
+
+    def hold(self, claim: _Claim, task: asyncio.Task) -> None:
+        """Wstrzymuje potwierdzenie aktualizacji do zakończenia zadania w tle"""
+        claim.holds.add(task)
+
+        def _done(finished: asyncio.Task) -> None:
+            claim.holds.discard(finished)
+            if claim.handled:
+                self.complete(claim)
+
+        task.add_done_callback(_done)
+
+    def _finish(self, update_id: int, status: int) -> None:
+        # Treść nie jest już potrzebna - w pliku zostaje tylko update_id do wykrywania duplikatów
+        self._db.execute(
+            "UPDATE updates SET status = ?, finished_at = ?, payload = NULL WHERE update_id = ?",
+            (status, time.time(), update_id)
+        )
+
+    def unfinished(self, live_owners: List[str] = (), include_own: bool = False) -> List[Tuple[int, Dict[str, Any]]]:
+        """
+        Zwraca niedokończone aktualizacje innych instancji poza działającymi (w kolejności update_id)
+
+        Args:
+            include_own: zwraca też wpisy tej instancji (z poprzedniego uruchomienia)
+        """
+        rows = self._db.execute(
+            "SELECT update_id, payload, owner FROM updates "
+            "WHERE status = ? AND payload IS NOT NULL ORDER BY update_id",
+            (PENDING,)
+        ).fetchall()
+        return [
+            (update_id, json.loads(payload)) for update_id, payload, owner in rows
+            if (owner != self.owner or include_own) and owner not in live_owners
+        ]
+
+    def prune(self) -> int:
+        """Usuwa wpisy zakończonych aktualizacji starsze niż okres przechowywania"""
+        cursor = self._db.execute(
+            "DELETE FROM updates WHERE status != ? AND finished_at < ?", (PENDING, time.time() - self.retention)
+        )
+        return cursor.rowcount
+
+    async def _prune_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(PRUNE_INTERVAL)
+            try:
+                removed = self.prune()
+                if removed:
+                    logger.info(f"Usunięto {removed} starych wpisów skrzynki aktualizacji")
+            except sqlite3.Error as e:
+                logger.error(f"Błąd czyszczenia skrzynki aktualizacji: {e}")
+
+def record_update(data: Dict[str, Any]) -> bool:
+    """Zapisuje aktualizację (JSON) w skrzynce przy odbiorze; False dla duplikatu"""
+    from services.container import container
+    inbox = container.update_inbox
+    if inbox is None or inbox.record(data["update_id"], data):
+        return True
+    inbox.stats["duplicates"] += 1
+    logger.info(f"Pominięto powtórnie dostarczoną aktualizację {data['update_id']}")
+    return False
+
+class InboxUpdateQueue(asyncio.Queue):
+    """
+    Kolejka aktualizacji aplikacji zapisująca je w skrzynce przed kolejkowaniem
+
+    Pobrane przez long polling aktualizacje są zatwierdzane w Telegramie przy
+    kolejnym getUpdates - bez zapisu przy odbiorze awaria przed ich obsługą
+    oznaczałaby utratę aktualizacji czekających w kolejce. Queue.put() kończy się
+    wywołaniem put_nowait(), więc zapis obejmuje obie metody.
+    """
+
+    def put_nowait(self, item: Any) -> None:
+        if isinstance(item, Update) and not record_update(item.to_dict()):
+            return
+        super().put_nowait(item)
+
+def hold_current_update(task: asyncio.Task) -> None:
+    """Wstrzymuje potwierdzenie bieżącej aktualizacji do zakończenia zadania w tle (np. generacji)"""
+    claim = _current_claim.get()
+    if claim is None:
+        return
+    from services.container import container
+    inbox = container.update_inbox
+    if inbox is not None:
+        inbox.hold(claim, task)
+
+async def claim_update(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Handler wstępny - zapisuje aktualizację w skrzynce i pomija duplikaty"""
+    from services.container import container
+    inbox = container.update_inbox
+    if inbox is None or not isinstance(update, Update):
+        return
+    claim = inbox.claim(update)
+    if claim is None:
+        inbox.stats["duplicates"] += 1
+        logger.info(f"Pominięto powtórnie dostarczoną aktualizację {update.update_id}")
+        raise ApplicationHandlerStop
+    _current_claim.set(claim)
+
+async def complete_update(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Handler końcowy - oznacza aktualizację jako obsłużoną"""
+    from services.container import container
+    claim = _current_claim.get()
+    inbox = container.update_inbox
+    if claim is None or inbox is None:
+        return
+    _current_claim.set(None)
+    inbox.complete(claim)
@@ -0,0 +1,159 @@
+# services/update_processor.py
+"""
+Procesor aktualizacji Telegrama - aktualizacje jednego użytkownika są obsługiwane
+po kolei (zachowana kolejność, brak wyścigów o kredyty), różni użytkownicy równolegle
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Deque, Dict, Hashable, Set
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+# Liczba ostatnich czasów oczekiwania używanych do percentyli
+WAIT_SAMPLES = 1000
+# Oczekiwanie w kolejce, powyżej którego aktualizacja jest logowana jako opóźniona (sekundy)
+SLOW_WAIT_WARNING = 5.0
+
+class _Turn:
+    __slots__ = ("granted", "enqueued_at")
+
+    def __init__(self):
+        self.granted = asyncio.get_running_loop().create_future()
+        self.enqueued_at = time.monotonic()
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """
+    Kolejka aktualizacji per użytkownik z globalnym limitem współbieżności
+
+    Użytkownicy z oczekującymi aktualizacjami są obsługiwani cyklicznie (round-robin):
+    po każdej obsłużonej aktualizacji użytkownik trafia na koniec kolejki, więc
+    użytkownik wysyłający wiele wiadomości nie blokuje pozostałych.
+    """
+
+    def __init__(self, concurrency: int = 64, max_queued_updates: int = 4096):
+        # Semafor klasy bazowej (max_concurrent_updates) ogranicza liczbę przyjętych aktualizacji -
+        # oczekujących w kolejkach i obsługiwanych; liczbę obsługiwanych jednocześnie ogranicza concurrency
+        super().__init__(max(max_queued_updates, concurrency))
+        if concurrency < 1:
+            raise ValueError("concurrency musi być dodatnią liczbą całkowitą")
+        self.concurrency = concurrency
+
+        self._queues: Dict[Hashable, Deque[_Turn]] = {}
+        # Użytkownicy z oczekującymi aktualizacjami, bez aktualizacji w trakcie obsługi
+        self._ready: Deque[Hashable] = deque()
+        self._busy: Set[Hashable] = set()
+        self._running = 0
+        self._waits: Deque[float] = deque(maxlen=WAIT_SAMPLES)
+        self.stats = {"processed": 0, "failed": 0, "max_wait": 0.0, "max_user_depth": 0}
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        logger.info(f"Procesor aktualizacji zatrzymany: {self.metrics()}")
+
+    @staticmethod
+    def _key(update: Any, turn: _Turn) -> Hashable:
+        user = getattr(update, "effective_user", None)
+        if user is not None:
+            return ("user", user.id)
+        chat = getattr(update, "effective_chat", None)
+        if chat is not None:
+            return ("chat", chat.id)
+        # Aktualizacje bez użytkownika i czatu nie wymagają kolejności
+        return ("update", id(turn))
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        turn = _Turn()
+        key = self._key(update, turn)
+
+        queue = self._queues.setdefault(key, deque())
+        queue.append(turn)
+        self.stats["max_user_depth"] = max(self.stats["max_user_depth"], len(queue))
+        if len(queue) == 1 and key not in self._busy:
+            self._ready.append(key)
+        self._dispatch()
+
+        try:
+            await turn.granted
+        except asyncio.CancelledError:
+            if turn.granted.done() and not turn.granted.cancelled():
+                # Kolej została już przydzielona - zwolnij ją
+                self._release(key)
+            else:
+                self._withdraw(key, turn)
+            if asyncio.iscoroutine(coroutine):
+                coroutine.close()
+            raise
+
+        wait = time.monotonic() - turn.enqueued_at
+        self._waits.append(wait)
+        self.stats["max_wait"] = max(self.stats["max_wait"], wait)
+        if wait > SLOW_WAIT_WARNING:
+            logger.warning(f"Aktualizacja czekała w kolejce {wait:.1f}s ({key[0]} {key[1]})")
+
+        try:
+            await coroutine
+            self.stats["processed"] += 1
+        except Exception:
+            # Błędy handlerów obsługuje Application - tu tylko liczymy
+            self.stats["failed"] += 1
+            raise
+        finally:
+            self._release(key)
+
+    def _dispatch(self) -> None:
+        """Przydziela wolne miejsca kolejnym użytkownikom (round-robin)"""
+        while self._running < self.concurrency and self._ready:
+            key = self._ready.popleft()
+            queue = self._queues.get(key)
+            if not queue:
+                self._queues.pop(key, None)
+                continue
+            turn = queue.popleft()
+            self._busy.add(key)
+            self._running += 1
+            turn.granted.set_result(None)
+
+    def _release(self, key: Hashable) -> None:
+        self._running -= 1
+        self._busy.discard(key)
+        if self._queues.get(key):
+            # Kolejna aktualizacja użytkownika - na koniec kolejki, po innych użytkownikach
+            self._ready.append(key)
+        else:
+            self._queues.pop(key, None)
+        self._dispatch()
+
+    def _withdraw(self, key: Hashable, turn: _Turn) -> None:
+        """Usuwa z kolejki aktualizację przerwaną przed obsługą"""
+        queue = self._queues.get(key)
+        if queue is None or turn not in queue:
+            return
+        queue.remove(turn)
+        if not queue:
+            del self._queues[key]
+            if key in self._ready:
+                self._ready.remove(key)
+
+    def metrics(self) -> Dict[str, Any]:
+        """Zwraca stan kolejek i czasy oczekiwania (sekundy)"""
+        waits = sorted(self._waits)
+
+        def percentile(p: float) -> float:
+            if not waits:
+                return 0.0
+            return waits[min(len(waits) - 1, int(len(waits) * p))]
+
+        return {
+            "running": self._running,
+            "queued": sum(len(queue) for queue in self._queues.values()),
+            "waiting_users": len(self._ready),
+            "concurrency": self.concurrency,
+            "wait_p50": round(percentile(0.5), 4),
+            "wait_p95": round(percentile(0.95), 4),
+            **self.stats
+        }
@@ -0,0 +1,128 @@
+# services/user_snapshot.py
+"""
+Migawka użytkownika (język, kredyty, subskrypcja, tryb/model, aktywna konwersacja)
+pobierana jednym wywołaniem RPC i dostępna przez context.user_snapshot
+"""
+import logging
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+from telegram import Update
+from telegram.ext import ContextTypes
+from api.supabase_client import SupabaseClient
+from database.models import Conversation, UserSnapshot
+from config import CHAT_MODES, CREDIT_COSTS, DEFAULT_MODEL
+
+logger = logging.getLogger(__name__)
+
+def resolve_chat_settings(context, user_id: int) -> Tuple[str, str, int]:
+    """
+    Ustala tryb czatu, model i koszt wiadomości na podstawie ustawień użytkownika
+
+    Returns:
+        tuple: (tryb, model, koszt w kredytach)
+    """
+    current_mode = "no_mode"
+    credit_cost = 1
+
+    user_data = context.chat_data.get('user_data', {}).get(user_id, {}) if context.chat_data is not None else {}
+
+    if user_data.get('current_mode') in CHAT_MODES:
+        current_mode = user_data['current_mode']
+        credit_cost = CHAT_MODES[current_mode]["credit_cost"]
+
+    model_to_use = CHAT_MODES[current_mode].get("model", DEFAULT_MODEL)
+
+    # Wybrany model ma pierwszeństwo przed modelem trybu
+    if user_data.get('current_model'):
+        model_to_use = user_data['current_model']
+        credit_cost = CREDIT_COSTS["message"].get(model_to_use, CREDIT_COSTS["message"]["default"])
+
+    return current_mode, model_to_use, credit_cost
+
+def _parse_datetime(value: Any) -> Optional[datetime]:
+    if isinstance(value, str) and value:
+        return datetime.fromisoformat(value.replace('Z', '+00:00'))
+    return None
+
+class UserSnapshotLoader:
+    """Ładuje migawkę użytkownika funkcją get_user_snapshot w bazie"""
+
+    def __init__(self, client: SupabaseClient, credit_repository=None, conversation_repository=None):
+        self.client = client
+        self.credit_repository = credit_repository
+        self.conversation_repository = conversation_repository
+        self.stats = {"loaded": 0, "failed": 0}
+
+    async def load(self, context, user_id: int) -> UserSnapshot:
+        """
+        Pobiera migawkę użytkownika
+
+        Gdy baza jest niedostępna, zwraca migawkę zbudowaną tylko z danych
+        kontekstu (loaded=False), aby handlery mogły użyć własnych odczytów awaryjnych.
+        """
+        current_mode, current_model, credit_cost = resolve_chat_settings(context, user_id)
+        snapshot = UserSnapshot(
+            user_id=user_id,
+            current_mode=current_mode,
+            current_model=current_model,
+            credit_cost=credit_cost
+        )
+
+        user_data = context.chat_data.get('user_data', {}).get(user_id, {}) if context.chat_data is not None else {}
+        context_language = user_data.get('language')
+
+        try:
+            data: Dict[str, Any] = await self.client.rpc("get_user_snapshot", {"p_user_id": user_id}) or {}
+        except Exception as e:
+            logger.warning(f"Nie udało się pobrać migawki użytkownika {user_id}: {e}")
+            self.stats["failed"] += 1
+            snapshot.language = context_language or "pl"
+            return snapshot
+
+        user = data.get('user') or {}
+        snapshot.language = context_language or user.get('language') or user.get('language_code') or "pl"
+        snapshot.subscription_end_date = _parse_datetime(user.get('subscription_end_date'))
+        snapshot.credits = data.get('credits')
+        if data.get('conversation'):
+            snapshot.conversation = Conversation.from_dict(data['conversation'])
+        
+        if self.conversation_repository is not None:
+            # Konwersacja z cache jest aktualniejsza (last_message_at zapisywany jest zbiorczo)
+            cached = self.conversation_repository.active_cache.get(user_id)
+            if cached is not None:
+                snapshot.conversation = cached
+            elif snapshot.conversation is not None:
+                self.conversation_repository.active_cache.set(user_id, None, snapshot.conversation)
+        snapshot.loaded = True
+        self.stats["loaded"] += 1
+
+        # Zapisz język w kontekście, tak jak get_user_language
+        if not context_language and context.chat_data is not None:
+            context.chat_data.setdefault('user_data', {}).setdefault(user_id, {})['language'] = snapshot.language
+
+        if self.credit_repository is not None and snapshot.credits is not None:
+            self.credit_repository.balance_cache.set(user_id, snapshot.credits, data.get('credits_updated_at'))
+
+        return snapshot
+
+def get_user_snapshot(context, user_id: int) -> Optional[UserSnapshot]:
+    """Zwraca migawkę użytkownika załadowaną dla bieżącej aktualizacji"""
+    snapshot = getattr(context, 'user_snapshot', None)
+    if snapshot is not None and snapshot.user_id == user_id:
+        return snapshot
+    return None
+
+async def ensure_user_snapshot(context, user_id: int) -> UserSnapshot:
+    """Zwraca migawkę bieżącej aktualizacji, ładując ją, jeśli jeszcze jej nie ma"""
+    snapshot = get_user_snapshot(context, user_id)
+    if snapshot is None:
+        from services.container import container
+        snapshot = await container.repository_service.user_snapshot_loader.load(context, user_id)
+        context.user_snapshot = snapshot
+    return snapshot
+
+async def load_user_snapshot(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Handler wstępny (grupa -1) - ładuje migawkę użytkownika raz na aktualizację"""
+    if update.effective_user is None:
+        return
+    await ensure_user_snapshot(context, update.effective_user.id)
@@ -0,0 +1,202 @@
+# services/webhook_server.py
+"""
+Serwer webhooka Telegrama (aiohttp)
+
+Żądanie jest potwierdzane (200) zaraz po weryfikacji sekretu i umieszczeniu treści
+w kolejce wejściowej; parsowanie i przekazanie aktualizacji dalej (do Application
+lub do procesów roboczych) wykonują zadania robocze. Z funkcją record aktualizacja
+jest zapisywana w trwałej skrzynce przed potwierdzeniem - awaria procesu nie gubi
+aktualizacji czekających w kolejce, a duplikaty nie są do niej dodawane. Wiele instancji może działać
+za load balancerem.
+"""
+import asyncio
+import hmac
+import json
+import logging
+import secrets
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Union
+from aiohttp import web
+from telegram import Update
+from telegram.ext import Application
+from services.app_lifecycle import running_application, stop_on_signals
+from services.update_inbox import record_update
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+# Przekazuje zdekodowaną aktualizację (JSON) do przetwarzania
+UpdateDispatcher = Callable[[Dict[str, Any]], Awaitable[None]]
+# Zapisuje aktualizację (JSON) przed potwierdzeniem; False dla duplikatu
+UpdateRecorder = Callable[[Dict[str, Any]], bool]
+
+class WebhookServer:
+    """Przyjmuje aktualizacje z webhooka i przekazuje je funkcji dispatch"""
+
+    def __init__(self, dispatch: UpdateDispatcher, path: str, secret_token: str, host: str = "0.0.0.0",
+                 port: int = 8080, workers: int = 4, max_queue: int = 10000,
+                 record: Optional[UpdateRecorder] = None):
+        self.dispatch = dispatch
+        self.record = record
+        self.path = path if path.startswith("/") else f"/{path}"
+        self.secret_token = secret_token
+        self.host = host
+        self.port = port
+        self.workers = max(1, workers)
+        # Treść żądania (bytes) lub aktualizacja zdekodowana już przy zapisie w skrzynce
+        self._queue: "asyncio.Queue[Union[bytes, Dict[str, Any]]]" = asyncio.Queue(maxsize=max_queue)
+        self._tasks: List[asyncio.Task] = []
+        self._runner: Optional[web.AppRunner] = None
+        self.stats = {"received": 0, "rejected": 0, "overloaded": 0, "invalid": 0, "dispatched": 0, "duplicates": 0}
+
+    async def start(self) -> None:
+        """Uruchamia zadania robocze i nasłuchiwanie HTTP"""
+        app = web.Application()
+        app.router.add_post(self.path, self._handle_update)
+        app.router.add_get("/healthz", self._handle_health)
+
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        # reuse_port pozwala uruchomić kilka procesów na tym samym porcie
+        site = web.TCPSite(self._runner, self.host, self.port, reuse_port=True)
+        await site.start()
+        logger.info(f"Serwer webhooka nasłuchuje na {self.host}:{self.port}{self.path} ({self.workers} zadań roboczych)")
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """Zatrzymuje przyjmowanie żądań i przekazuje aktualizacje pozostałe w kolejce"""
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Nie przekazano {self._queue.qsize()} aktualizacji przed zamknięciem serwera webhooka")
+
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _handle_update(self, request: web.Request) -> web.Response:
+        token = request.headers.get(SECRET_HEADER, "")
+        if not hmac.compare_digest(token, self.secret_token):
+            self.stats["rejected"] += 1
+            return web.Response(status=403)
+
+        body = await request.read()
+        if self._queue.full():
+            # Telegram ponowi dostarczenie aktualizacji
+            self.stats["overloaded"] += 1
+            return web.Response(status=503)
+
+        item: Union[bytes, Dict[str, Any]] = body
+        if self.record is not None:
+            try:
+                item = self._decode(body)
+            except ValueError as e:
+                # Ponowienie niczego nie zmieni - potwierdzenie bez przekazania
+                self.stats["invalid"] += 1
+                logger.error(f"Niepoprawna aktualizacja z webhooka: {e}")
+                return web.Response(status=200)
+            try:
+                if not self.record(item):
+                    self.stats["duplicates"] += 1
+                    return web.Response(status=200)
+            except Exception as e:
+                # Bez zapisu nie ma potwierdzenia - Telegram ponowi dostarczenie
+                logger.error(f"Nie udało się zapisać aktualizacji {item['update_id']} w skrzynce: {e}")
+                return web.Response(status=503)
+
+        try:
+            self._queue.put_nowait(item)
+        except asyncio.QueueFull:
+            # Telegram ponowi dostarczenie aktualizacji
+            self.stats["overloaded"] += 1
+            return web.Response(status=503)
+
+        self.stats["received"] += 1
+        return web.Response(status=200)
+
+    async def _handle_health(self, request: web.Request) -> web.Response:
+        return web.json_response({"ok": self._runner is not None, **self.metrics()})
+
+    @staticmethod
+    def _decode(body: bytes) -> Dict[str, Any]:
+        data = json.loads(body)
+        if not isinstance(data, dict) or "update_id" not in data:
+            raise ValueError("brak update_id")
+        return data
+
+    async def _worker(self) -> None:
+        while True:
+            item = await self._queue.get()
+            try:
+                data = self._decode(item) if isinstance(item, bytes) else item
+                await self.dispatch(data)
+                self.stats["dispatched"] += 1
+            except Exception as e:
+                self.stats["invalid"] += 1
+                logger.error(f"Niepoprawna aktualizacja z webhooka: {e}")
+            finally:
+                self._queue.task_done()
+
+    def metrics(self) -> Dict[str, Any]:
+        """Zwraca głębokość kolejki wejściowej i liczniki żądań"""
+        return {"queue": self._queue.qsize(), "workers": self.workers, **self.stats}
+
+def resolve_webhook_secret(secret_token: Optional[str], register: bool = True, instances: int = 1) -> str:
+    """
+    Zwraca sekret webhooka; bez konfiguracji generuje jednorazowy
+
+    Wygenerowany sekret zna tylko ta instancja i tylko ona rejestruje go w Telegramie.
+    Gdy webhook rejestruje inna instancja (register=False) lub instancji jest kilka,
+    sekrety by się nie zgadzały i aktualizacje byłyby odrzucane - wtedy zgłaszany jest błąd.
+
+    Raises:
+        ValueError: brak WEBHOOK_SECRET przy wyłączonej rejestracji lub wielu instancjach
+    """
+    if secret_token:
+        return secret_token
+    if not register or instances > 1:
+        raise ValueError(
+            "Brak WEBHOOK_SECRET - wspólny sekret jest wymagany, gdy webhook rejestruje inna instancja "
+            f"(WEBHOOK_REGISTER=false) lub działa wiele instancji (WEBHOOK_INSTANCES={instances})"
+        )
+    logger.warning("Brak WEBHOOK_SECRET - wygenerowano jednorazowy sekret dla tej instancji")
+    return secrets.token_urlsafe(32)
+
+async def register_webhook(bot, url: str, server: WebhookServer, max_connections: int) -> None:
+    """Rejestruje adres serwera webhooka w Telegramie"""
+    await bot.set_webhook(
+        url=url.rstrip("/") + server.path,
+        secret_token=server.secret_token,
+        allowed_updates=Update.ALL_TYPES,
+        max_connections=max_connections
+    )
+    logger.info("Zarejestrowano webhook w Telegramie")
+
+async def serve_webhook(application: Application, url: str, path: str, secret_token: Optional[str],
+                        host: str, port: int, workers: int, max_queue: int, max_connections: int,
+                        register: bool = True, instances: int = 1) -> None:
+    """Uruchamia bota w trybie webhook do otrzymania SIGINT/SIGTERM"""
+    async def dispatch(data: Dict[str, Any]) -> None:
+        await application.update_queue.put(Update.de_json(data, application.bot))
+
+    secret_token = resolve_webhook_secret(secret_token, register, instances)
+    server = WebhookServer(dispatch, path, secret_token, host, port, workers, max_queue, record=record_update)
+
+    stop_event = asyncio.Event()
+    stop_on_signals(stop_event)
+
+    async with running_application(application):
+        try:
+            await server.start()
+            if register:
+                await register_webhook(application.bot, url, server, max_connections)
+            await stop_event.wait()
+        finally:
+            # Webhook nie jest usuwany - pozostałe instancje nadal przyjmują aktualizacje
+            await server.stop()
@@ -0,0 +1,373 @@
+# services/write_behind.py
+"""
+Kolejka zapisów w tle (write-behind) - wstawienia, na które użytkownik nie musi
+czekać, są łączone w wielowierszowe żądania PostgREST co N ms lub co M wierszy
+
+Wiersze z kluczem idempotencji (kolumna client_id) są wstawiane z pominięciem
+duplikatów, więc ponowienie żądania, które dotarło do bazy, nie zapisze ich drugi raz.
+"""
+import asyncio
+import json
+import logging
+import os
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+from api.retry import classify_error
+from api.supabase_client import SupabaseClient
+
+logger = logging.getLogger(__name__)
+
+RowCallback = Callable[[Dict[str, Any]], Any]
+
+class _PendingRow:
+    __slots__ = ("seq", "table", "row", "on_saved", "attempts", "done")
+
+    def __init__(self, seq: int, table: str, row: Dict[str, Any], on_saved: Optional[RowCallback] = None):
+        self.seq = seq
+        self.table = table
+        self.row = row
+        self.on_saved = on_saved
+        self.attempts = 0
+        # Zapisany lub odrzucony (potwierdzony w pliku zrzutu)
+        self.done = False
+
+class WriteBehindQueue:
+    """
+    Ograniczona kolejka wstawień zapisywanych zbiorczo w tle
+
+    Każdy wiersz trafia najpierw do pliku zrzutu (JSONL), a po zapisaniu w bazie
+    jest w nim potwierdzany. Wiersze niepotwierdzone - po awarii procesu lub po
+    wyczerpaniu ponowień przy błędach przejściowych - są wczytywane ponownie przy
+    następnym starcie. Partia odrzucona błędem trwałym (np. naruszenie ograniczenia)
+    jest dzielona na połowy, aż do wyodrębnienia wadliwych wierszy, które trafiają
+    do pliku odrzuconych wierszy (dead letter) i nie są ponawiane.
+    """
+
+    def __init__(self, client: SupabaseClient, flush_interval_ms: int = 200, batch_rows: int = 100,
+                 max_rows: int = 10000, max_retries: int = 5, spill_path: Optional[str] = None,
+                 dead_letter_path: Optional[str] = None, idempotency_column: Optional[str] = "client_id"):
+        self.client = client
+        self.flush_interval = flush_interval_ms / 1000
+        self.batch_rows = batch_rows
+        self.max_rows = max_rows
+        self.max_retries = max_retries
+        self.spill_path = spill_path or None
+        self.dead_letter_path = dead_letter_path or None
+        self.idempotency_column = idempotency_column
+
+        self._queue: Deque[_PendingRow] = deque()
+        # Wiersze, dla których wyczerpano ponowienia błędów przejściowych - czekają w pliku zrzutu na restart
+        self._parked: List[_PendingRow] = []
+        self._seq = 0
+        self._in_flight = 0
+        self._acked_since_compaction = 0
+        self._spill = None
+        self._wakeup = asyncio.Event()
+        self._space = asyncio.Event()
+        self._space.set()
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {
+            "enqueued": 0, "written": 0, "batches": 0, "failed_batches": 0,
+            "retries": 0, "replayed": 0, "max_depth": 0, "bisections": 0, "dead_lettered": 0,
+            "duplicates": 0
+        }
+
+    # --- dodawanie wierszy ---
+
+    def try_put(self, table: str, row: Dict[str, Any], on_saved: Optional[RowCallback] = None) -> bool:
+        """Dodaje wiersz do kolejki; zwraca False, gdy kolejka jest pełna lub nie działa"""
+        if self._task is None or len(self._queue) >= self.max_rows:
+            return False
+        self._append(table, row, on_saved)
+        return True
+
+    async def put(self, table: str, row: Dict[str, Any], on_saved: Optional[RowCallback] = None) -> None:
+        """Dodaje wiersz do kolejki, czekając na wolne miejsce (backpressure)"""
+        if self._task is None:
+            # Kolejka nie działa (np. przed startem) - zapisz od razu
+            saved = await self._insert(table, [row])
+            if saved and on_saved is not None:
+                on_saved(saved[0])
+            return
+
+        while len(self._queue) >= self.max_rows:
+            self._space.clear()
+            self._wakeup.set()
+            await self._space.wait()
+        self._append(table, row, on_saved)
+
+    def _append(self, table: str, row: Dict[str, Any], on_saved: Optional[RowCallback]) -> None:
+        self._seq += 1
+        pending = _PendingRow(self._seq, table, row, on_saved)
+        self._spill_write({"seq": pending.seq, "table": table, "row": row})
+        self._queue.append(pending)
+        self.stats["enqueued"] += 1
+        self.stats["max_depth"] = max(self.stats["max_depth"], len(self._queue))
+        if len(self._queue) >= self.batch_rows:
+            self._wakeup.set()
+
+    # --- cykl życia ---
+
+    async def start(self) -> None:
+        """Wczytuje niepotwierdzone wiersze z pliku zrzutu i uruchamia zapis w tle"""
+        if self._task is not None:
+            return
+        if self.spill_path:
+            self._replay_spill()
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self, timeout: float = 10.0) -> None:
+        """Zatrzymuje zapis w tle i próbuje zapisać wszystkie oczekujące wiersze"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        try:
+            await asyncio.wait_for(self._drain(), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Nie zapisano {len(self._queue)} wierszy przed zamknięciem - pozostają w pliku zrzutu")
+
+        # Przepisanie zamyka plik zrzutu, zostawiając w nim tylko niezapisane wiersze
+        self._compact()
+
+    async def _drain(self) -> None:
+        while self._queue:
+            if not await self._flush_batch():
+                # Baza niedostępna - nie ponawiaj w nieskończoność przy zamykaniu
+                break
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+            while self._queue:
+                if not await self._flush_batch():
+                    # Odczekaj przed kolejną próbą, aby nie obciążać niedostępnej bazy
+                    attempts = self._queue[0].attempts if self._queue else 0
+                    await asyncio.sleep(min(30.0, self.flush_interval * 2 ** min(attempts, 8)))
+                    break
+                if len(self._queue) < self.batch_rows:
+                    break
+
+            if self._spill is not None:
+                await asyncio.get_running_loop().run_in_executor(None, self._spill_sync)
+                if not self._queue and not self._in_flight and self._acked_since_compaction:
+                    self._compact()
+
+    # --- zapis ---
+
+    async def _flush_batch(self) -> bool:
+        """Zapisuje kolejne wiersze tej samej tabeli o tych samych kolumnach jednym żądaniem"""
+        first = self._queue[0]
+        columns = set(first.row)
+        batch: List[_PendingRow] = []
+        while self._queue and len(batch) < self.batch_rows:
+            pending = self._queue[0]
+            if pending.table != first.table or set(pending.row) != columns:
+                break
+            batch.append(self._queue.popleft())
+        self._notify_space()
+
+        self._in_flight += len(batch)
+        try:
+            unwritten, error = await self._write(first.table, batch)
+        except asyncio.CancelledError:
+            # Przerwane przy zamykaniu - niezapisane wiersze zostaną zapisane w _drain
+            self._queue.extendleft(reversed([p for p in batch if not p.done]))
+            raise
+        finally:
+            self._in_flight -= len(batch)
+
+        if not unwritten:
+            return True
+
+        # Błąd przejściowy (baza niedostępna, przekroczony czas) - ponów później
+        self.stats["failed_batches"] += 1
+        retry: List[_PendingRow] = []
+        for pending in unwritten:
+            pending.attempts += 1
+            if pending.attempts < self.max_retries:
+                retry.append(pending)
+            else:
+                self._parked.append(pending)
+        if retry:
+            self.stats["retries"] += 1
+            # Zachowaj kolejność - ponawiane wiersze wracają na początek kolejki
+            self._queue.extendleft(reversed(retry))
+        logger.error(
+            f"Błąd zapisu {len(unwritten)} wierszy do {first.table} w tle: {error} "
+            f"(ponowienie: {len(retry)}, odłożone do pliku zrzutu: {len(unwritten) - len(retry)})"
+        )
+        return False
+
+    async def _write(self, table: str, batch: List[_PendingRow]) -> Tuple[List[_PendingRow], Optional[Exception]]:
+        """
+        Zapisuje partię, dzieląc ją na połowy po błędzie trwałym
+
+        Returns:
+            Tuple: wiersze niezapisane z powodu błędu przejściowego (od pierwszego takiego) i ten błąd
+        """
+        try:
+            saved = await self._insert(table, [p.row for p in batch])
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if classify_error(e).retryable:
+                return batch, e
+            if len(batch) == 1:
+                self._dead_letter(batch[0], e)
+                return [], None
+            self.stats["bisections"] += 1
+            middle = len(batch) // 2
+            unwritten, error = await self._write(table, batch[:middle])
+            if unwritten:
+                return unwritten + batch[middle:], error
+            return await self._write(table, batch[middle:])
+
+        self.stats["batches"] += 1
+        self.stats["written"] += len(batch)
+        self._acknowledge(batch)
+        self._saved(batch, saved or [])
+        return [], None
+
+    async def _insert(self, table: str, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        key = self.idempotency_column
+        if key and all(row.get(key) is not None for row in rows):
+            # Ponowienie (tu lub w kliencie) wiersza zapisanego wcześniej jest pomijane przez bazę
+            return await self.client.query(table, query_type="insert", data=rows, on_conflict=key)
+        return await self.client.query(table, query_type="insert", data=rows)
+
+    def _saved(self, batch: List[_PendingRow], saved: List[Dict[str, Any]]) -> None:
+        key = self.idempotency_column
+        if key and all(p.row.get(key) is not None for p in batch):
+            # Pominięte duplikaty nie są zwracane - dopasuj zapisane wiersze po kluczu
+            saved_by_key = {str(data.get(key)): data for data in saved}
+            matched = [(saved_by_key.get(str(p.row[key])), p) for p in batch]
+            self.stats["duplicates"] += len(batch) - len(saved_by_key)
+        else:
+            matched = list(zip(saved, batch))
+
+        for data, pending in matched:
+            if data is None or pending.on_saved is None:
+                continue
+            try:
+                pending.on_saved(data)
+            except Exception as e:
+                logger.error(f"Błąd obsługi zapisanego wiersza {pending.table}: {e}")
+
+    def _acknowledge(self, batch: List[_PendingRow]) -> None:
+        for pending in batch:
+            pending.done = True
+        self._spill_write({"ack": [p.seq for p in batch]})
+        self._acked_since_compaction += len(batch)
+
+    def _dead_letter(self, pending: _PendingRow, error: Exception) -> None:
+        """Odrzuca wiersz z błędem trwałym - zapisuje go do pliku odrzuconych wierszy bez ponawiania"""
+        self.stats["dead_lettered"] += 1
+        logger.error(f"Odrzucono wiersz {pending.table} (błąd trwały: {error}): {pending.row}")
+        if self.dead_letter_path:
+            entry = {"table": pending.table, "row": pending.row, "error": str(error), "attempts": pending.attempts}
+            try:
+                with open(self.dead_letter_path, "a", encoding="utf-8") as dead_letter:
+                    dead_letter.write(json.dumps(entry, ensure_ascii=False, default=str) + "\n")
+            except OSError as e:
+                logger.error(f"Błąd zapisu pliku odrzuconych wierszy {self.dead_letter_path}: {e}")
+        self._acknowledge([pending])
+
+    def _notify_space(self) -> None:
+        if len(self._queue) < self.max_rows:
+            self._space.set()
+
+    # --- plik zrzutu ---
+
+    def _spill_write(self, entry: Dict[str, Any]) -> None:
+        if not self.spill_path:
+            return
+        try:
+            if self._spill is None:
+                self._spill = open(self.spill_path, "a", encoding="utf-8")
+            self._spill.write(json.dumps(entry, ensure_ascii=False, default=str) + "\n")
+            # Bufor systemu operacyjnego przetrwa awarię procesu; fsync raz na cykl zapisu
+            self._spill.flush()
+        except OSError as e:
+            logger.error(f"Błąd zapisu pliku zrzutu {self.spill_path}: {e}")
+
+    def _spill_sync(self) -> None:
+        try:
+            if self._spill is not None:
+                os.fsync(self._spill.fileno())
+        except (OSError, ValueError) as e:
+            logger.error(f"Błąd synchronizacji pliku zrzutu {self.spill_path}: {e}")
+
+    def _replay_spill(self) -> None:
+        if not os.path.exists(self.spill_path):
+            return
+
+        entries: Dict[int, Dict[str, Any]] = {}
+        try:
+            with open(self.spill_path, encoding="utf-8") as spill:
+                for line in spill:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Niepełna ostatnia linia po awarii
+                        continue
+                    if "ack" in entry:
+                        for seq in entry["ack"]:
+                            entries.pop(seq, None)
+                    else:
+                        entries[entry["seq"]] = entry
+        except OSError as e:
+            logger.error(f"Błąd odczytu pliku zrzutu {self.spill_path}: {e}")
+            return
+
+        for seq in sorted(entries):
+            entry = entries[seq]
+            self._queue.append(_PendingRow(seq, entry["table"], entry["row"]))
+            self._seq = max(self._seq, seq)
+
+        if entries:
+            self.stats["replayed"] += len(entries)
+            logger.info(f"Wczytano {len(entries)} niezapisanych wierszy z pliku zrzutu {self.spill_path}")
+        self._compact()
+
+    def _compact(self) -> None:
+        """Przepisuje plik zrzutu, pozostawiając tylko niepotwierdzone wiersze"""
+        if not self.spill_path:
+            return
+        pending = self._parked + list(self._queue)
+        temp_path = f"{self.spill_path}.tmp"
+        try:
+            if self._spill is not None:
+                self._spill.close()
+                self._spill = None
+            with open(temp_path, "w", encoding="utf-8") as spill:
+                for row in pending:
+                    spill.write(json.dumps({"seq": row.seq, "table": row.table, "row": row.row},
+                                           ensure_ascii=False, default=str) + "\n")
+                spill.flush()
+                os.fsync(spill.fileno())
+            os.replace(temp_path, self.spill_path)
+            self._acked_since_compaction = 0
+        except OSError as e:
+            logger.error(f"Błąd przepisywania pliku zrzutu {self.spill_path}: {e}")
+
+    # --- metryki ---
+
+    def metrics(self) -> Dict[str, Any]:
+        """Zwraca głębokość kolejki i liczniki zapisów"""
+        return {
+            "depth": len(self._queue),
+            "in_flight": self._in_flight,
+            "parked": len(self._parked),
+            "capacity": self.max_rows,
+            **self.stats
+        }
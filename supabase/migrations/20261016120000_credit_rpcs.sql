@@ -0,0 +1,253 @@
+-- Atomowe operacje na kredytach wykonywane w jednym wywołaniu RPC.
+-- Sprawdzenie salda, zmiana salda i wpis do historii transakcji odbywają się
+-- w jednej transakcji, więc równoległe wiadomości nie mogą wydać kredytów dwukrotnie.
+
+-- Klucz idempotencji pozwala bezpiecznie ponowić wywołanie po zerwanym połączeniu
+alter table public.credit_transactions
+    add column if not exists request_id uuid;
+
+create unique index if not exists credit_transactions_request_id_key
+    on public.credit_transactions (request_id)
+    where request_id is not null;
+
+-- Rekord salda tworzony jest przez insert ... on conflict (user_id), co wymaga unikalnego user_id
+create unique index if not exists user_credits_user_id_key
+    on public.user_credits (user_id);
+
+-- Czas ostatniej zmiany salda - bot porównuje go przed zastosowaniem zmiany z Realtime,
+-- aby spóźnione powiadomienie nie nadpisało nowszego salda z wyniku funkcji.
+-- clock_timestamp() w wyzwalaczu jest liczony po zablokowaniu wiersza, więc rośnie
+-- w kolejności zmian (now() to początek transakcji).
+alter table public.user_credits
+    add column if not exists updated_at timestamptz not null default now();
+
+create or replace function public.touch_user_credits_updated_at()
+returns trigger
+language plpgsql
+set search_path = public
+as $$
+begin
+    new.updated_at := clock_timestamp();
+    return new;
+end;
+$$;
+
+drop trigger if exists user_credits_touch_updated_at on public.user_credits;
+create trigger user_credits_touch_updated_at
+    before insert or update on public.user_credits
+    for each row execute function public.touch_user_credits_updated_at();
+
+-- Odejmuje kredyty, jeśli saldo jest wystarczające
+create or replace function public.deduct_credits(
+    p_user_id bigint,
+    p_amount integer,
+    p_description text default null,
+    p_request_id uuid default null
+)
+returns jsonb
+language plpgsql
+security definer
+set search_path = public
+as $$
+declare
+    v_before integer;
+    v_after integer;
+    v_updated_at timestamptz;
+    v_existing public.credit_transactions%rowtype;
+begin
+    if p_amount < 0 then
+        raise exception 'amount must not be negative' using errcode = '22023';
+    end if;
+
+    if p_request_id is not null then
+        -- Równoległe wywołania z tym samym kluczem (np. ponowienie, gdy pierwsze żądanie
+        -- nadal trwa) czekają na siebie - drugie widzi zatwierdzony wynik pierwszego
+        -- zamiast kończyć się błędem unikalności (23505, HTTP 409)
+        perform pg_advisory_xact_lock(hashtext(p_request_id::text));
+        select * into v_existing from public.credit_transactions where request_id = p_request_id;
+        if found then
+            return jsonb_build_object(
+                'success', true,
+                'duplicate', true,
+                'credits_before', v_existing.credits_before,
+                'credits_after', v_existing.credits_after
+            );
+        end if;
+    end if;
+
+    update public.user_credits
+       set credits_amount = credits_amount - p_amount
+     where user_id = p_user_id
+       and credits_amount >= p_amount
+    returning credits_amount + p_amount, credits_amount, updated_at
+      into v_before, v_after, v_updated_at;
+
+    if not found then
+        select credits_amount, updated_at into v_after, v_updated_at from public.user_credits where user_id = p_user_id;
+        return jsonb_build_object(
+            'success', false,
+            'credits_before', coalesce(v_after, 0),
+            'credits_after', coalesce(v_after, 0),
+            'updated_at', v_updated_at
+        );
+    end if;
+
+    if p_amount > 0 then
+        insert into public.credit_transactions
+            (user_id, transaction_type, amount, credits_before, credits_after, description, request_id, created_at)
+        values
+            (p_user_id, 'deduct', p_amount, v_before, v_after, p_description, p_request_id, now());
+    end if;
+
+    return jsonb_build_object(
+        'success', true,
+        'credits_before', v_before,
+        'credits_after', v_after,
+        'updated_at', v_updated_at
+    );
+end;
+$$;
+
+-- Dodaje kredyty (tworzy rekord salda, jeśli nie istnieje).
+-- Jedno polecenie insert ... on conflict: dwa równoległe pierwsze doładowania nie kończą się
+-- błędem unikalności, a drugie nie nadpisuje salda ustawionego przez pierwsze.
+create or replace function public.add_credits(
+    p_user_id bigint,
+    p_amount integer,
+    p_description text default null,
+    p_request_id uuid default null
+)
+returns jsonb
+language plpgsql
+security definer
+set search_path = public
+as $$
+declare
+    v_before integer;
+    v_after integer;
+    v_updated_at timestamptz;
+    v_existing public.credit_transactions%rowtype;
+begin
+    if p_request_id is not null then
+        -- Równoległe wywołania z tym samym kluczem (np. ponowienie, gdy pierwsze żądanie
+        -- nadal trwa) czekają na siebie - drugie widzi zatwierdzony wynik pierwszego
+        -- zamiast kończyć się błędem unikalności (23505, HTTP 409)
+        perform pg_advisory_xact_lock(hashtext(p_request_id::text));
+        select * into v_existing from public.credit_transactions where request_id = p_request_id;
+        if found then
+            return jsonb_build_object(
+                'success', true,
+                'duplicate', true,
+                'credits_before', v_existing.credits_before,
+                'credits_after', v_existing.credits_after
+            );
+        end if;
+    end if;
+
+    insert into public.user_credits as c
+        (user_id, credits_amount, total_credits_purchased, total_spent, last_purchase_date)
+    values
+        (p_user_id, p_amount, p_amount, 0, now())
+    on conflict (user_id) do update
+       set credits_amount = c.credits_amount + excluded.credits_amount,
+           total_credits_purchased = coalesce(c.total_credits_purchased, 0) + excluded.total_credits_purchased,
+           last_purchase_date = excluded.last_purchase_date
+    returning c.credits_amount - p_amount, c.credits_amount, c.updated_at
+      into v_before, v_after, v_updated_at;
+
+    if p_amount <> 0 then
+        insert into public.credit_transactions
+            (user_id, transaction_type, amount, credits_before, credits_after, description, request_id, created_at)
+        values
+            (p_user_id, 'add', p_amount, v_before, v_after, p_description, p_request_id, now());
+    end if;
+
+    return jsonb_build_object(
+        'success', true,
+        'credits_before', v_before,
+        'credits_after', v_after,
+        'updated_at', v_updated_at
+    );
+end;
+$$;
+
+-- Zakup pakietu kredytów: dodanie kredytów, aktualizacja sumy wydatków i wpis transakcji
+create or replace function public.purchase_credits(
+    p_user_id bigint,
+    p_package_id bigint,
+    p_request_id uuid default null
+)
+returns jsonb
+language plpgsql
+security definer
+set search_path = public
+as $$
+declare
+    v_package public.credit_packages%rowtype;
+    v_before integer;
+    v_after integer;
+    v_updated_at timestamptz;
+    v_existing public.credit_transactions%rowtype;
+begin
+    select * into v_package
+      from public.credit_packages
+     where id = p_package_id
+       and is_active = true;
+
+    if not found then
+        return jsonb_build_object('success', false);
+    end if;
+
+    if p_request_id is not null then
+        -- Równoległe wywołania z tym samym kluczem (np. ponowienie, gdy pierwsze żądanie
+        -- nadal trwa) czekają na siebie - drugie widzi zatwierdzony wynik pierwszego
+        -- zamiast kończyć się błędem unikalności (23505, HTTP 409)
+        perform pg_advisory_xact_lock(hashtext(p_request_id::text));
+        select * into v_existing from public.credit_transactions where request_id = p_request_id;
+        if found then
+            return jsonb_build_object(
+                'success', true,
+                'duplicate', true,
+                'credits_before', v_existing.credits_before,
+                'credits_after', v_existing.credits_after,
+                'package', to_jsonb(v_package)
+            );
+        end if;
+    end if;
+
+    insert into public.user_credits as c
+        (user_id, credits_amount, total_credits_purchased, total_spent, last_purchase_date)
+    values
+        (p_user_id, v_package.credits, v_package.credits, v_package.price, now())
+    on conflict (user_id) do update
+       set credits_amount = c.credits_amount + excluded.credits_amount,
+           total_credits_purchased = coalesce(c.total_credits_purchased, 0) + excluded.total_credits_purchased,
+           total_spent = coalesce(c.total_spent, 0) + excluded.total_spent,
+           last_purchase_date = excluded.last_purchase_date
+    returning c.credits_amount - v_package.credits, c.credits_amount, c.updated_at
+      into v_before, v_after, v_updated_at;
+
+    insert into public.credit_transactions
+        (user_id, transaction_type, amount, credits_before, credits_after, description, request_id, created_at)
+    values
+        (p_user_id, 'purchase', v_package.credits, v_before, v_after,
+         'Zakup pakietu ' || v_package.name, p_request_id, now());
+
+    return jsonb_build_object(
+        'success', true,
+        'credits_before', v_before,
+        'credits_after', v_after,
+        'updated_at', v_updated_at,
+        'package', to_jsonb(v_package)
+    );
+end;
+$$;
+
+-- Funkcje zmieniające saldo może wywołać tylko backend bota (klucz service_role)
+revoke all on function public.deduct_credits(bigint, integer, text, uuid) from public, anon, authenticated;
+revoke all on function public.add_credits(bigint, integer, text, uuid) from public, anon, authenticated;
+revoke all on function public.purchase_credits(bigint, bigint, uuid) from public, anon, authenticated;
+
+grant execute on function public.deduct_credits(bigint, integer, text, uuid) to service_role;
+grant execute on function public.add_credits(bigint, integer, text, uuid) to service_role;
+grant execute on function public.purchase_credits(bigint, bigint, uuid) to service_role;
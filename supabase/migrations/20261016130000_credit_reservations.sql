@@ -0,0 +1,246 @@
+-- Rezerwacje kredytów dla długotrwałych operacji AI.
+-- reserve_credits blokuje kwotę od razu (saldo jest pomniejszane), a po zakończeniu
+-- operacji settle_credit_reservation rozlicza faktyczny koszt i zapisuje transakcję,
+-- natomiast release_credit_reservation zwraca całą zablokowaną kwotę.
+
+create table if not exists public.credit_reservations (
+    id uuid primary key default gen_random_uuid(),
+    user_id bigint not null,
+    amount integer not null check (amount >= 0),
+    charged_amount integer,
+    description text,
+    status text not null default 'held' check (status in ('held', 'settled', 'released')),
+    created_at timestamptz not null default now(),
+    expires_at timestamptz not null,
+    finished_at timestamptz
+);
+
+-- Klucz idempotencji - ponowione po zerwanym połączeniu reserve_credits nie blokuje kredytów drugi raz
+alter table public.credit_reservations
+    add column if not exists request_id uuid;
+
+create unique index if not exists credit_reservations_request_id_key
+    on public.credit_reservations (request_id)
+    where request_id is not null;
+
+create index if not exists credit_reservations_held_expires_idx
+    on public.credit_reservations (expires_at)
+    where status = 'held';
+
+-- Poprzednia wersja bez klucza idempotencji
+drop function if exists public.reserve_credits(bigint, integer, text, integer);
+
+-- Blokuje kredyty, jeśli saldo jest wystarczające
+create or replace function public.reserve_credits(
+    p_user_id bigint,
+    p_amount integer,
+    p_description text default null,
+    p_ttl_seconds integer default 900,
+    p_request_id uuid default null
+)
+returns jsonb
+language plpgsql
+security definer
+set search_path = public
+as $$
+declare
+    v_after integer;
+    v_updated_at timestamptz;
+    v_reservation_id uuid;
+    v_existing public.credit_reservations%rowtype;
+begin
+    if p_amount < 0 then
+        raise exception 'amount must not be negative' using errcode = '22023';
+    end if;
+
+    if p_request_id is not null then
+        -- Równoległe wywołania z tym samym kluczem czekają na siebie (jak w deduct_credits)
+        perform pg_advisory_xact_lock(hashtext(p_request_id::text));
+        select * into v_existing from public.credit_reservations where request_id = p_request_id;
+        if found then
+            select credits_amount into v_after from public.user_credits where user_id = v_existing.user_id;
+            return jsonb_build_object(
+                'success', true,
+                'duplicate', true,
+                'reservation_id', v_existing.id,
+                'status', v_existing.status,
+                'credits_after', coalesce(v_after, 0)
+            );
+        end if;
+    end if;
+
+    update public.user_credits
+       set credits_amount = credits_amount - p_amount
+     where user_id = p_user_id
+       and credits_amount >= p_amount
+    returning credits_amount, updated_at into v_after, v_updated_at;
+
+    if not found then
+        select credits_amount, updated_at into v_after, v_updated_at from public.user_credits where user_id = p_user_id;
+        return jsonb_build_object('success', false, 'credits_after', coalesce(v_after, 0), 'updated_at', v_updated_at);
+    end if;
+
+    insert into public.credit_reservations (user_id, amount, description, expires_at, request_id)
+    values (p_user_id, p_amount, p_description, now() + make_interval(secs => p_ttl_seconds), p_request_id)
+    returning id into v_reservation_id;
+
+    return jsonb_build_object(
+        'success', true,
+        'reservation_id', v_reservation_id,
+        'credits_after', v_after,
+        'updated_at', v_updated_at
+    );
+end;
+$$;
+
+-- Rozlicza rezerwację: pobiera p_amount (domyślnie całą kwotę), resztę zwraca na saldo
+create or replace function public.settle_credit_reservation(
+    p_reservation_id uuid,
+    p_amount integer default null
+)
+returns jsonb
+language plpgsql
+security definer
+set search_path = public
+as $$
+declare
+    v_reservation public.credit_reservations%rowtype;
+    v_charge integer;
+    v_after integer;
+    v_updated_at timestamptz;
+begin
+    select * into v_reservation
+      from public.credit_reservations
+     where id = p_reservation_id
+       for update;
+
+    if not found then
+        return jsonb_build_object('success', false);
+    end if;
+
+    -- Rozliczenie jest idempotentne - ponowione wywołanie zwraca bieżący stan
+    if v_reservation.status <> 'held' then
+        select credits_amount, updated_at into v_after, v_updated_at
+          from public.user_credits where user_id = v_reservation.user_id;
+        return jsonb_build_object(
+            'success', v_reservation.status = 'settled',
+            'status', v_reservation.status,
+            'charged', coalesce(v_reservation.charged_amount, 0),
+            'credits_after', coalesce(v_after, 0),
+            'updated_at', v_updated_at
+        );
+    end if;
+
+    v_charge := least(greatest(coalesce(p_amount, v_reservation.amount), 0), v_reservation.amount);
+
+    update public.user_credits
+       set credits_amount = credits_amount + (v_reservation.amount - v_charge)
+     where user_id = v_reservation.user_id
+    returning credits_amount, updated_at into v_after, v_updated_at;
+
+    update public.credit_reservations
+       set status = 'settled',
+           charged_amount = v_charge,
+           finished_at = now()
+     where id = p_reservation_id;
+
+    if v_charge > 0 then
+        insert into public.credit_transactions
+            (user_id, transaction_type, amount, credits_before, credits_after, description, request_id, created_at)
+        values
+            (v_reservation.user_id, 'deduct', v_charge, v_after + v_charge, v_after,
+             v_reservation.description, p_reservation_id, now());
+    end if;
+
+    return jsonb_build_object(
+        'success', true,
+        'status', 'settled',
+        'charged', v_charge,
+        'credits_after', v_after,
+        'updated_at', v_updated_at
+    );
+end;
+$$;
+
+-- Zwalnia rezerwację i oddaje całą zablokowaną kwotę
+create or replace function public.release_credit_reservation(
+    p_reservation_id uuid
+)
+returns jsonb
+language plpgsql
+security definer
+set search_path = public
+as $$
+declare
+    v_reservation public.credit_reservations%rowtype;
+    v_after integer;
+    v_updated_at timestamptz;
+begin
+    select * into v_reservation
+      from public.credit_reservations
+     where id = p_reservation_id
+       for update;
+
+    if not found then
+        return jsonb_build_object('success', false);
+    end if;
+
+    if v_reservation.status <> 'held' then
+        select credits_amount, updated_at into v_after, v_updated_at
+          from public.user_credits where user_id = v_reservation.user_id;
+        return jsonb_build_object(
+            'success', v_reservation.status = 'released',
+            'status', v_reservation.status,
+            'credits_after', coalesce(v_after, 0),
+            'updated_at', v_updated_at
+        );
+    end if;
+
+    update public.user_credits
+       set credits_amount = credits_amount + v_reservation.amount
+     where user_id = v_reservation.user_id
+    returning credits_amount, updated_at into v_after, v_updated_at;
+
+    update public.credit_reservations
+       set status = 'released',
+           finished_at = now()
+     where id = p_reservation_id;
+
+    return jsonb_build_object('success', true, 'status', 'released', 'credits_after', v_after, 'updated_at', v_updated_at);
+end;
+$$;
+
+-- Zwalnia rezerwacje porzucone np. po restarcie bota (wywoływana okresowo przez instancje bota,
+-- CreditRepository.start; rozliczenia nieudane z powodu błędu bazy bot ponawia przed wygaśnięciem)
+create or replace function public.release_expired_credit_reservations()
+returns integer
+language plpgsql
+security definer
+set search_path = public
+as $$
+declare
+    v_reservation record;
+    v_count integer := 0;
+begin
+    for v_reservation in
+        select id from public.credit_reservations
+         where status = 'held' and expires_at < now()
+         for update skip locked
+    loop
+        perform public.release_credit_reservation(v_reservation.id);
+        v_count := v_count + 1;
+    end loop;
+
+    return v_count;
+end;
+$$;
+
+revoke all on function public.reserve_credits(bigint, integer, text, integer, uuid) from public, anon, authenticated;
+revoke all on function public.settle_credit_reservation(uuid, integer) from public, anon, authenticated;
+revoke all on function public.release_credit_reservation(uuid) from public, anon, authenticated;
+revoke all on function public.release_expired_credit_reservations() from public, anon, authenticated;
+
+grant execute on function public.reserve_credits(bigint, integer, text, integer, uuid) to service_role;
+grant execute on function public.settle_credit_reservation(uuid, integer) to service_role;
+grant execute on function public.release_credit_reservation(uuid) to service_role;
+grant execute on function public.release_expired_credit_reservations() to service_role;
@@ -0,0 +1,16 @@
+-- Publikuje zmiany tabeli user_credits przez Supabase Realtime, aby instancje bota
+-- mogły aktualizować swoje pamięci podręczne sald, gdy saldo zmieni się gdzie indziej
+-- (np. webhook Stripe lub inna instancja bota).
+do $$
+begin
+    if not exists (
+        select 1
+          from pg_publication_tables
+         where pubname = 'supabase_realtime'
+           and schemaname = 'public'
+           and tablename = 'user_credits'
+    ) then
+        alter publication supabase_realtime add table public.user_credits;
+    end if;
+end;
+$$;
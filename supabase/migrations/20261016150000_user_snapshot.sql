@@ -0,0 +1,47 @@
+-- Migawka użytkownika pobierana jednym wywołaniem na początku obsługi aktualizacji:
+-- język, stan subskrypcji, saldo kredytów i ostatnia aktywna konwersacja.
+create or replace function public.get_user_snapshot(p_user_id bigint)
+returns jsonb
+language sql
+stable
+security definer
+set search_path = public
+as $$
+    select jsonb_build_object(
+        'user', (
+            select jsonb_build_object(
+                'language', u.language,
+                'language_code', u.language_code,
+                'subscription_end_date', u.subscription_end_date,
+                'is_active', u.is_active
+            )
+              from public.users u
+             where u.id = p_user_id
+        ),
+        'credits', (
+            select uc.credits_amount
+              from public.user_credits uc
+             where uc.user_id = p_user_id
+        ),
+        'credits_updated_at', (
+            select uc.updated_at
+              from public.user_credits uc
+             where uc.user_id = p_user_id
+        ),
+        'conversation', (
+            select jsonb_build_object(
+                'id', c.id,
+                'user_id', c.user_id,
+                'created_at', c.created_at,
+                'last_message_at', c.last_message_at
+            )
+              from public.conversations c
+             where c.user_id = p_user_id
+             order by c.last_message_at desc nulls last
+             limit 1
+        )
+    );
+$$;
+
+revoke all on function public.get_user_snapshot(bigint) from public, anon, authenticated;
+grant execute on function public.get_user_snapshot(bigint) to service_role;
@@ -0,0 +1,25 @@
+-- Zbiorcza aktualizacja last_message_at wielu konwersacji jednym wywołaniem.
+-- Bot grupuje znaczniki czasu ostatnich wiadomości i zapisuje je okresowo;
+-- wartość nigdy nie jest cofana (greatest), więc kolejność wywołań nie ma znaczenia.
+create or replace function public.touch_conversations(p_updates jsonb)
+returns integer
+language sql
+security definer
+set search_path = public
+as $$
+    with updates as (
+        select (u->>'id')::bigint as id,
+               (u->>'last_message_at')::timestamptz as last_message_at
+          from jsonb_array_elements(p_updates) as u
+    ), touched as (
+        update public.conversations c
+           set last_message_at = greatest(coalesce(c.last_message_at, u.last_message_at), u.last_message_at)
+          from updates u
+         where c.id = u.id
+        returning c.id
+    )
+    select count(*)::integer from touched;
+$$;
+
+revoke all on function public.touch_conversations(jsonb) from public, anon, authenticated;
+grant execute on function public.touch_conversations(jsonb) to service_role;
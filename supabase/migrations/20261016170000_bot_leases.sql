@@ -0,0 +1,64 @@
+-- Dzierżawy (lease) wyboru lidera: tylko lider pobiera aktualizacje (getUpdates).
+-- Blokady doradcze (pg_advisory_lock) są związane z sesją, a PostgREST nie utrzymuje
+-- sesji między żądaniami, dlatego dzierżawa jest wierszem z czasem wygaśnięcia.
+-- Czas liczony jest zegarem bazy, więc różnice zegarów instancji nie mają znaczenia.
+create table if not exists public.bot_leases (
+    name text primary key,
+    holder text not null,
+    expires_at timestamptz not null
+);
+
+alter table public.bot_leases enable row level security;
+
+-- Przejmuje lub odnawia dzierżawę; zwraca true, gdy p_holder jest jej właścicielem
+create or replace function public.acquire_bot_lease(p_name text, p_holder text, p_ttl_seconds double precision)
+returns boolean
+language sql
+security definer
+set search_path = public
+as $$
+    with acquired as (
+        insert into public.bot_leases as l (name, holder, expires_at)
+        values (p_name, p_holder, now() + make_interval(secs => p_ttl_seconds))
+        on conflict (name) do update
+           set holder = excluded.holder,
+               expires_at = excluded.expires_at
+         where l.holder = excluded.holder
+            or l.expires_at < now()
+        returning 1
+    )
+    select exists (select 1 from acquired);
+$$;
+
+-- Zwalnia dzierżawę (tylko właściciel), aby następca przejął ją bez czekania na wygaśnięcie
+create or replace function public.release_bot_lease(p_name text, p_holder text)
+returns boolean
+language sql
+security definer
+set search_path = public
+as $$
+    with released as (
+        delete from public.bot_leases
+         where name = p_name and holder = p_holder
+        returning 1
+    )
+    select exists (select 1 from released);
+$$;
+
+-- Aktualny właściciel niewygasłej dzierżawy (null, gdy brak)
+create or replace function public.bot_lease_holder(p_name text)
+returns text
+language sql
+stable
+security definer
+set search_path = public
+as $$
+    select holder from public.bot_leases where name = p_name and expires_at >= now();
+$$;
+
+revoke all on function public.acquire_bot_lease(text, text, double precision) from public, anon, authenticated;
+revoke all on function public.release_bot_lease(text, text) from public, anon, authenticated;
+revoke all on function public.bot_lease_holder(text) from public, anon, authenticated;
+grant execute on function public.acquire_bot_lease(text, text, double precision) to service_role;
+grant execute on function public.release_bot_lease(text, text) to service_role;
+grant execute on function public.bot_lease_holder(text) to service_role;
@@ -0,0 +1,9 @@
+-- Klucz idempotencji wiadomości zapisywanych w tle (kolejka write-behind).
+-- Ponowione wstawienie (np. po przekroczeniu czasu odpowiedzi, gdy zapis dotarł do bazy)
+-- jest pomijane przez on_conflict=client_id z resolution=ignore-duplicates.
+-- Indeks nie może być częściowy - PostgREST wskazuje go samą listą kolumn.
+alter table public.messages
+    add column if not exists client_id uuid;
+
+create unique index if not exists messages_client_id_key
+    on public.messages (client_id);
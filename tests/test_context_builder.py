@@ -0,0 +1,33 @@
+# tests/test_context_builder.py
+import pytest
+
+pytest.importorskip("dotenv")
+
+from utils.context_builder import TRUNCATION_MARKER, build_context
+
+MODEL = "gpt-4o"
+
+def _history(*messages):
+    return [
+        {"id": index, "content": content, "is_from_user": from_user}
+        for index, (content, from_user) in enumerate(messages)
+    ]
+
+@pytest.mark.parametrize("repeat, budget", [
+    (1, 4000),
+    # Wiadomość ponad budżet jest skracana - duplikat w historii nadal jest pomijany
+    (2000, 300),
+])
+def test_current_message_saved_in_history_is_sent_once(repeat, budget):
+    user_message = "długa wiadomość " * repeat
+    history = _history(("pytanie", True), ("odpowiedź", False), (user_message, True))
+    messages = build_context(history, user_message, "system", MODEL, max_prompt_tokens=budget)
+    current = [message for message in messages if message["content"].startswith("długa")]
+    assert current == [messages[-1]]
+    assert messages[-1]["role"] == "user"
+
+def test_over_budget_message_is_truncated():
+    user_message = "długa wiadomość " * 2000
+    messages = build_context([], user_message, "system", MODEL, max_prompt_tokens=300)
+    assert messages[-1]["content"].endswith(TRUNCATION_MARKER)
+    assert len(messages[-1]["content"]) < len(user_message)
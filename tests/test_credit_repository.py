@@ -0,0 +1,57 @@
+# tests/test_credit_repository.py
+import asyncio
+import pytest
+
+pytest.importorskip("httpx")
+pytest.importorskip("aiohttp")
+pytest.importorskip("dotenv")
+
+from repositories.credit_repository import CreditRepository
+
+class _Conflict(Exception):
+    status_code = 409
+
+class _ConcurrentDuplicateClient:
+    """
+    Symuluje dwa równoległe wywołania z tym samym p_request_id: zmiana zatwierdzona
+    przez pierwsze, drugie kończy się błędem unikalności (HTTP 409)
+    """
+
+    def __init__(self, balance=100):
+        self.balance = balance
+        self.applied = {}
+        self.calls = 0
+
+    async def rpc(self, function_name, params):
+        self.calls += 1
+        request_id = params["p_request_id"]
+        if request_id in self.applied:
+            return {**self.applied[request_id], "duplicate": True}
+        before = self.balance
+        sign = -1 if function_name == "deduct_credits" else 1
+        self.balance += sign * params["p_amount"]
+        self.applied[request_id] = {"success": True, "credits_before": before, "credits_after": self.balance}
+        raise _Conflict("duplicate key value violates unique constraint")
+
+@pytest.mark.parametrize("method, expected_balance", [
+    ("deduct_user_credits", 90),
+    ("add_user_credits", 110),
+])
+def test_concurrent_duplicate_reports_committed_change(method, expected_balance):
+    client = _ConcurrentDuplicateClient()
+    repository = CreditRepository(client)
+    assert asyncio.run(getattr(repository, method)(1, 10, "test")) is True
+    assert client.balance == expected_balance
+    assert client.calls == 2
+
+def test_other_errors_are_not_retried():
+    class _Failing:
+        calls = 0
+
+        async def rpc(self, function_name, params):
+            self.calls += 1
+            raise RuntimeError("boom")
+
+    client = _Failing()
+    assert asyncio.run(CreditRepository(client).deduct_user_credits(1, 10)) is False
+    assert client.calls == 1
@@ -0,0 +1,64 @@
+# tests/test_markdown_stream.py
+import pytest
+from utils.markdown_stream import MarkdownStreamRenderer, render_markdown
+
+RENDER_CASES = [
+    # (tekst modelu, Markdown Telegrama)
+    ("zwykły tekst", "zwykły tekst"),
+    ("**pogrubienie**", "*pogrubienie*"),
+    ("__pogrubienie__", "*pogrubienie*"),
+    ("*kursywa*", "_kursywa_"),
+    ("_kursywa_", "_kursywa_"),
+    ("***oba***", "*oba*"),
+    ("**a *b* c**", "*a b c*"),
+    ("`kod`", "`kod`"),
+    ("```\nblok\n```", "```\nblok\n```"),
+    ("`a*b_c`", "`a*b_c`"),
+    ("**a `kod` b**", "*a *`kod`* b*"),
+    # Znaki bez pary są poprzedzane znakiem ucieczki
+    ("2*3", "2\\*3"),
+    ("snake_case", "snake\\_case"),
+    ("[link", "\\[link"),
+    ("``", "\\`\\`"),
+    ("\\*dosłownie\\*", "\\*dosłownie\\*"),
+    # Znacznik encji wewnątrz niej - zamknięcie, znak ucieczki i ponowne otwarcie
+    ("**2*3 = 6**", "*2*\\**3 = 6*"),
+    ("**a*b*c**", "*a*\\**b*\\**c*"),
+    ("_ital_ic_", "_ital_\\__ic_"),
+    ("*snake_case*", "_snake_\\__case_"),
+    ("**a\\*b**", "*a*\\**b*"),
+    # Niedomknięte encje są domykane, puste pomijane
+    ("**niedomknięte", "*niedomknięte*"),
+    ("`kod", "`kod`"),
+    ("****", ""),
+    ("tekst **", "tekst \\*\\*"),
+]
+
+CHUNK_SIZES = [1, 2, 3, 5, 8]
+
+@pytest.mark.parametrize("text, expected", RENDER_CASES)
+def test_render_markdown(text, expected):
+    assert render_markdown(text) == expected
+
+@pytest.mark.parametrize("chunk_size", CHUNK_SIZES)
+@pytest.mark.parametrize("text, expected", RENDER_CASES)
+def test_feed_in_chunks_matches_render(text, expected, chunk_size):
+    renderer = MarkdownStreamRenderer()
+    for start in range(0, len(text), chunk_size):
+        renderer.feed(text[start:start + chunk_size])
+        renderer.snapshot()
+    assert renderer.finish() == expected
+
+@pytest.mark.parametrize("chunks, snapshot", [
+    (["**pogr"], "*pogr*"),
+    (["*"], ""),
+    (["`ko"], "`ko`"),
+    # Dwa ostatnie znaki mogą być początkiem zamknięcia bloku
+    (["```py\nxyz"], "```py\nx```"),
+    (["tekst _kurs"], "tekst _kurs_"),
+])
+def test_snapshot_closes_open_entities(chunks, snapshot):
+    renderer = MarkdownStreamRenderer()
+    for chunk in chunks:
+        renderer.feed(chunk)
+    assert renderer.snapshot() == snapshot
@@ -0,0 +1,39 @@
+# tests/test_message_pager.py
+import pytest
+
+pytest.importorskip("telegram")
+
+from utils.message_pager import find_split
+
+def _fits(limit):
+    return lambda length: length <= limit
+
+@pytest.mark.parametrize("text, limit, expected", [
+    # Granica akapitu ma pierwszeństwo przed linią i zdaniem
+    ("Pierwszy akapit.\n\nDrugi. Trzeci\nczwarty", 30, "Pierwszy akapit.\n\n"),
+    # Akapit skróciłby stronę o ponad połowę - podział na końcu linii
+    ("aaaa\n\nbbbb\ncccc dddd", 18, "aaaa\n\nbbbb\n"),
+    ("aaaa bbbb\ncccc dddd", 17, "aaaa bbbb\n"),
+    ("Ala ma kota. Kot ma Alę i psa", 20, "Ala ma kota. "),
+    ("słowo słowo słowo", 14, "słowo słowo "),
+    # Brak granicy - podział na limicie
+    ("abcdefghij", 6, "abcdef"),
+    ("ab cdefghijkl", 10, "ab cdefghi"),
+    # Granica poza blokiem kodu ma pierwszeństwo przed granicą wewnątrz bloku
+    ("tekst\n```\nkod kod kod\n```\nkoniec", 30, "tekst\n```\nkod kod kod\n```\n"),
+    # Tylko granice wewnątrz bloku kodu - użyta najlepsza z nich
+    ("tekst\n\n```\nkod\n\nkod\n```\nkoniec", 22, "tekst\n\n```\nkod\n\n"),
+    # Spacja wewnątrz bloku kodu nie jest granicą zastępczą
+    ("```\nkod\nkod kod kod\n", 16, "```\nkod\nkod kod "),
+])
+def test_find_split(text, limit, expected):
+    assert text[:find_split(text, _fits(limit))] == expected
+
+@pytest.mark.parametrize("text, limit", [
+    ("a" * 100, 40),
+    ("zdanie. " * 20, 50),
+    ("linia\n" * 30, 64),
+])
+def test_find_split_never_exceeds_limit(text, limit):
+    split = find_split(text, _fits(limit))
+    assert 0 < split <= limit
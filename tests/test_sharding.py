@@ -0,0 +1,111 @@
+# tests/test_sharding.py
+import pytest
+from services.sharding import ConsistentHashRing, routing_key
+
+KEYS = range(2000)
+
+def _assignment(ring):
+    return {key: ring.shard_for(key) for key in KEYS}
+
+@pytest.mark.parametrize("shards", [[0], [0, 1], [0, 1, 2, 3], [3, 7, 11]])
+def test_shard_for_is_stable(shards):
+    # Kolejność dodawania i osobna instancja pierścienia nie zmieniają przydziału
+    assert _assignment(ConsistentHashRing(shards)) == _assignment(ConsistentHashRing(reversed(shards)))
+
+@pytest.mark.parametrize("shards", [[0], [0, 1], [0, 1, 2, 3], [3, 7, 11]])
+def test_shard_for_returns_known_shard(shards):
+    assert set(_assignment(ConsistentHashRing(shards)).values()) == set(shards)
+
+def test_empty_ring_returns_none():
+    assert ConsistentHashRing().shard_for(42) is None
+
+@pytest.mark.parametrize("shards", [[0, 1], [0, 1, 2, 3], list(range(8))])
+def test_distribution_is_balanced(shards):
+    counts = {shard: 0 for shard in shards}
+    for shard in _assignment(ConsistentHashRing(shards)).values():
+        counts[shard] += 1
+    expected = len(KEYS) / len(shards)
+    # Przy 100 punktach na shard odchylenie mieści się w połowie średniej
+    assert all(0.5 * expected <= count <= 1.5 * expected for count in counts.values())
+
+@pytest.mark.parametrize("shards, removed", [([0, 1], 1), ([0, 1, 2, 3], 2), (list(range(8)), 0)])
+def test_remove_moves_only_removed_shard_keys(shards, removed):
+    ring = ConsistentHashRing(shards)
+    before = _assignment(ring)
+    ring.remove(removed)
+    after = _assignment(ring)
+    for key in KEYS:
+        if before[key] != removed:
+            assert after[key] == before[key]
+        else:
+            assert after[key] != removed
+
+@pytest.mark.parametrize("shards, added", [([0], 1), ([0, 1, 2], 3), (list(range(7)), 7)])
+def test_add_moves_keys_only_to_new_shard(shards, added):
+    ring = ConsistentHashRing(shards)
+    before = _assignment(ring)
+    ring.add(added)
+    after = _assignment(ring)
+    moved = [key for key in KEYS if after[key] != before[key]]
+    assert moved and all(after[key] == added for key in moved)
+
+def test_remove_and_add_restores_assignment():
+    ring = ConsistentHashRing([0, 1, 2])
+    before = _assignment(ring)
+    ring.remove(1)
+    ring.add(1)
+    assert _assignment(ring) == before
+
+@pytest.mark.parametrize("operation", ["add", "remove"])
+def test_repeated_operation_is_noop(operation):
+    ring = ConsistentHashRing([0, 1])
+    getattr(ring, operation)(1)
+    before = (set(ring.shards), _assignment(ring))
+    getattr(ring, operation)(1)
+    assert (set(ring.shards), _assignment(ring)) == before
+
+@pytest.mark.parametrize("data, expected", [
+    ({"update_id": 1, "message": {"from": {"id": 10}, "chat": {"id": -5}}}, 10),
+    ({"update_id": 2, "callback_query": {"from": {"id": 11}, "message": {"chat": {"id": -6}}}}, 11),
+    ({"update_id": 3, "message_reaction": {"user": {"id": 12}, "chat": {"id": -7}}}, 12),
+    # Brak użytkownika - ID czatu
+    ({"update_id": 4, "channel_post": {"chat": {"id": -8}}}, -8),
+    ({"update_id": 5, "poll": {"id": "abc"}}, 5),
+])
+def test_routing_key(data, expected):
+    assert routing_key(data) == expected
+
+def test_supervisor_journal_replays_unacknowledged_updates(tmp_path):
+    pytest.importorskip("telegram")
+    import asyncio
+    import time
+    from services.sharding import ShardSupervisor
+    from services.update_inbox import UpdateInbox
+
+    async def scenario():
+        path = str(tmp_path / "supervisor.sqlite3")
+        inbox = UpdateInbox(path, owner="supervisor")
+        inbox.open()
+        supervisor = ShardSupervisor(2, inbox=inbox)
+        updates = [{"update_id": update_id, "message": {"from": {"id": update_id}}} for update_id in (1, 2)]
+        for data in updates:
+            assert supervisor.accept(data)
+            await supervisor.route(data)
+        # Powtórnie dostarczona aktualizacja nie jest przyjmowana drugi raz po potwierdzeniu
+        supervisor.acks.put(1)
+        deadline = time.monotonic() + 5
+        while inbox.stats["completed"] == 0 and time.monotonic() < deadline:
+            supervisor._drain_acks()
+            await asyncio.sleep(0.01)
+        assert not supervisor.accept(updates[0])
+        await inbox.close()
+
+        # Po awarii nadzorcy niepotwierdzona aktualizacja wraca do bufora shardu
+        restarted = UpdateInbox(path, owner="supervisor")
+        restarted.open()
+        supervisor = ShardSupervisor(2, inbox=restarted)
+        await supervisor._resume()
+        buffered = [data["update_id"] for worker in supervisor.shards.values() for data in worker.buffer]
+        assert buffered == [2]
+        await restarted.close()
+    asyncio.run(scenario())
@@ -0,0 +1,83 @@
+# tests/test_update_inbox.py
+import asyncio
+import pytest
+
+pytest.importorskip("telegram")
+
+from telegram import Update
+from services.update_inbox import UpdateInbox
+
+def _update(update_id):
+    return Update.de_json({
+        "update_id": update_id,
+        "message": {"message_id": 1, "date": 0, "chat": {"id": 1, "type": "private"}, "text": "x"}
+    }, None)
+
+class _Application:
+    bot = None
+
+    def __init__(self):
+        self.update_queue = asyncio.Queue()
+
+def _inbox(tmp_path, owner):
+    inbox = UpdateInbox(str(tmp_path / "inbox.sqlite3"), owner=owner)
+    inbox.open()
+    return inbox
+
+async def _restart(tmp_path, previous, owner, is_alive=None):
+    await previous.close()
+    inbox = _inbox(tmp_path, owner)
+    application = _Application()
+    await inbox.resume(application, is_alive)
+    resumed = []
+    while not application.update_queue.empty():
+        resumed.append(application.update_queue.get_nowait().update_id)
+    return inbox, resumed
+
+@pytest.mark.parametrize("handled", [False, True])
+def test_restart_with_same_owner_resumes_recorded_updates(tmp_path, handled):
+    async def scenario():
+        inbox = _inbox(tmp_path, "A")
+        update = _update(1)
+        assert inbox.record(1, update.to_dict())
+        if handled:
+            inbox.claim(update)
+        inbox, resumed = await _restart(tmp_path, inbox, "A")
+        assert resumed == [1]
+        # Wznowiona aktualizacja jest obsługiwana, a nie pomijana jako duplikat
+        assert inbox.claim(update) is not None
+        await inbox.close()
+    asyncio.run(scenario())
+
+def test_completed_update_is_not_resumed(tmp_path):
+    async def scenario():
+        inbox = _inbox(tmp_path, "A")
+        inbox.complete(inbox.claim(_update(1)))
+        inbox, resumed = await _restart(tmp_path, inbox, "A")
+        assert resumed == []
+        await inbox.close()
+    asyncio.run(scenario())
+
+def test_own_rows_resumed_only_once(tmp_path):
+    async def scenario():
+        inbox = _inbox(tmp_path, "A")
+        inbox.record(1, _update(1).to_dict())
+        inbox, resumed = await _restart(tmp_path, inbox, "A")
+        assert resumed == [1]
+        # Kolejne wywołania (np. przejmowanie przez lidera) nie kolejkują własnych wpisów ponownie
+        assert await inbox.resume(_Application()) == 0
+        await inbox.close()
+    asyncio.run(scenario())
+
+@pytest.mark.parametrize("alive, expected", [(True, []), (False, [1])])
+def test_resume_respects_owner_liveness(tmp_path, alive, expected):
+    async def is_alive(owner):
+        return alive
+
+    async def scenario():
+        inbox = _inbox(tmp_path, "A")
+        inbox.record(1, _update(1).to_dict())
+        inbox, resumed = await _restart(tmp_path, inbox, "B", is_alive)
+        assert resumed == expected
+        await inbox.close()
+    asyncio.run(scenario())
@@ -0,0 +1,46 @@
+# utils/background.py
+"""
+Uruchamianie zadań w tle (fire-and-forget) poza ścieżką krytyczną obsługi aktualizacji
+"""
+import asyncio
+import logging
+from typing import Any, Awaitable, Set
+
+logger = logging.getLogger(__name__)
+
+# Silne referencje do uruchomionych zadań - asyncio trzyma tylko słabe
+_background_tasks: Set[asyncio.Task] = set()
+
+def run_in_background(coro: Awaitable[Any], description: str = "zadanie w tle") -> asyncio.Task:
+    """
+    Uruchamia korutynę w tle i loguje ewentualny błąd
+
+    Args:
+        coro: Korutyna do wykonania
+        description: Opis zadania używany w logach
+
+    Returns:
+        asyncio.Task: Zadanie, na które można opcjonalnie poczekać (asyncio.wait)
+    """
+    task = asyncio.ensure_future(coro)
+    _background_tasks.add(task)
+
+    def _done(finished: asyncio.Task) -> None:
+        _background_tasks.discard(finished)
+        if finished.cancelled():
+            return
+        error = finished.exception()
+        if error is not None:
+            logger.error(f"Błąd w tle ({description}): {error}")
+
+    task.add_done_callback(_done)
+    return task
+
+def pending_background_tasks() -> int:
+    """Liczba niezakończonych zadań w tle"""
+    return len(_background_tasks)
+
+async def wait_for_background_tasks(timeout: float = 10.0) -> None:
+    """Czeka na zakończenie zadań w tle (np. przy zamykaniu aplikacji)"""
+    if _background_tasks:
+        await asyncio.wait(list(_background_tasks), timeout=timeout)
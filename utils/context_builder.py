@@ -0,0 +1,151 @@
+# utils/context_builder.py
+"""
+Budowanie kontekstu rozmowy dla API OpenAI z uwzględnieniem budżetu tokenów modelu
+"""
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+from config import MODEL_CONTEXT_BUDGETS
+
+logger = logging.getLogger(__name__)
+
+try:
+    import tiktoken
+except ImportError:  # Opcjonalna zależność - bez niej liczymy tokeny w przybliżeniu
+    tiktoken = None
+
+# Narzut tokenów na każdą wiadomość w formacie czatu (rola, separatory)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# Minimalna liczba tokenów, dla której opłaca się dołączyć skróconą starszą wiadomość
+MIN_TRUNCATED_TOKENS = 64
+
+TRUNCATION_MARKER = "\n…[wiadomość skrócona]"
+
+class TokenCounter:
+    """Licznik tokenów z pamięcią podręczną per ID wiadomości"""
+    
+    def __init__(self, max_cached: int = 10000):
+        self.max_cached = max_cached
+        self._cache: "OrderedDict[Tuple[Any, str], int]" = OrderedDict()
+        self._encodings: Dict[str, Any] = {}
+    
+    def _encoding_for(self, model: str) -> Any:
+        if tiktoken is None:
+            return None
+        if model not in self._encodings:
+            try:
+                self._encodings[model] = tiktoken.encoding_for_model(model)
+            except KeyError:
+                self._encodings[model] = tiktoken.get_encoding("cl100k_base")
+        return self._encodings[model]
+    
+    def count(self, text: str, model: str) -> int:
+        """Liczy tokeny tekstu"""
+        encoding = self._encoding_for(model)
+        if encoding is None:
+            return len(text) // 4 + 1
+        return len(encoding.encode(text))
+    
+    def count_message(self, message_id: Any, text: str, model: str) -> int:
+        """Liczy tokeny wiadomości, korzystając z pamięci podręcznej dla zapisanych wiadomości"""
+        if message_id is None:
+            return self.count(text, model) + MESSAGE_OVERHEAD_TOKENS
+        
+        key = (message_id, model)
+        cached = self._cache.get(key)
+        if cached is not None:
+            self._cache.move_to_end(key)
+            return cached
+        
+        tokens = self.count(text, model) + MESSAGE_OVERHEAD_TOKENS
+        self._cache[key] = tokens
+        if len(self._cache) > self.max_cached:
+            self._cache.popitem(last=False)
+        return tokens
+    
+    def truncate(self, text: str, max_tokens: int, model: str) -> str:
+        """Skraca tekst do podanej liczby tokenów, zachowując początek"""
+        encoding = self._encoding_for(model)
+        if encoding is None:
+            return text[:max_tokens * 4] + TRUNCATION_MARKER
+        return encoding.decode(encoding.encode(text)[:max_tokens]) + TRUNCATION_MARKER
+
+token_counter = TokenCounter()
+
+def get_prompt_budget(model: str) -> int:
+    """Zwraca budżet tokenów promptu dla modelu"""
+    budget = MODEL_CONTEXT_BUDGETS.get(model) or MODEL_CONTEXT_BUDGETS["default"]
+    return budget["max_prompt_tokens"]
+
+def _history_item(item: Any) -> Tuple[Any, str, bool]:
+    """Zwraca (id, treść, czy_od_użytkownika) dla obiektu Message lub słownika"""
+    if isinstance(item, dict):
+        return item.get("id"), item.get("content") or "", bool(item.get("is_from_user"))
+    return getattr(item, "id", None), getattr(item, "content", "") or "", bool(getattr(item, "is_from_user", False))
+
+def build_context(history: List[Any], user_message: str, system_prompt: str, model: str,
+                  max_prompt_tokens: Optional[int] = None) -> List[Dict[str, str]]:
+    """
+    Buduje listę wiadomości mieszczącą się w budżecie tokenów modelu
+    
+    Wiadomości są dobierane od najnowszej do najstarszej. Wiadomość, która nie
+    mieści się w całości, jest skracana (jeśli zostało dość miejsca), a starsze
+    są pomijane.
+    
+    Args:
+        history: Historia konwersacji (od najstarszej), obiekty Message lub słowniki
+        user_message: Bieżąca wiadomość użytkownika
+        system_prompt: Prompt systemowy trybu czatu
+        model: Model, dla którego budowany jest kontekst
+        max_prompt_tokens: Nadpisanie budżetu tokenów promptu
+        
+    Returns:
+        List[Dict]: Wiadomości w formacie API OpenAI
+    """
+    budget = max_prompt_tokens or get_prompt_budget(model)
+    
+    items = list(history or [])
+    
+    # Bieżąca wiadomość mogła zostać już zapisana i trafić do historii - porównanie
+    # z pełną treścią, przed ewentualnym skróceniem jej do budżetu
+    if items:
+        _, last_content, last_from_user = _history_item(items[-1])
+        if last_from_user and last_content == user_message:
+            items.pop()
+    
+    system_tokens = token_counter.count(system_prompt, model) + MESSAGE_OVERHEAD_TOKENS
+    user_tokens = token_counter.count(user_message, model) + MESSAGE_OVERHEAD_TOKENS
+    
+    remaining = budget - system_tokens
+    if user_tokens > remaining:
+        user_message = token_counter.truncate(user_message, max(remaining - MESSAGE_OVERHEAD_TOKENS, 1), model)
+        user_tokens = remaining
+    remaining -= user_tokens
+    
+    selected: List[Dict[str, str]] = []
+    for item in reversed(items):
+        message_id, content, is_from_user = _history_item(item)
+        if not content:
+            continue
+        
+        tokens = token_counter.count_message(message_id, content, model)
+        if tokens > remaining:
+            available = remaining - MESSAGE_OVERHEAD_TOKENS
+            if available >= MIN_TRUNCATED_TOKENS:
+                selected.append({
+                    "role": "user" if is_from_user else "assistant",
+                    "content": token_counter.truncate(content, available, model)
+                })
+            break
+        
+        selected.append({"role": "user" if is_from_user else "assistant", "content": content})
+        remaining -= tokens
+    
+    if len(selected) < len(items):
+        logger.debug(f"Kontekst dla {model}: {len(selected)}/{len(items)} wiadomości historii w budżecie {budget} tokenów")
+    
+    messages = [{"role": "system", "content": system_prompt}]
+    messages.extend(reversed(selected))
+    messages.append({"role": "user", "content": user_message})
+    return messages
@@ -117,7 +117,7 @@ def format_credit_usage_report(operation, cost, credits_before, credits_after, l
     """
     return get_text("credit_usage_report", language, operation=operation, cost=cost, credits_after=credits_after)
 
-def get_credit_recommendation(user_id, context):
+async def get_credit_recommendation(user_id, context):
     """
     Analyzes user's credit usage pattern and recommends a package
     
@@ -133,7 +133,7 @@ def get_credit_recommendation(user_id, context):
     
     # Get credit usage history from context or database
     from database.credits_client import get_user_credit_stats
-    stats = get_user_credit_stats(user_id)
+    stats = await get_user_credit_stats(user_id)
     
     if not stats or not stats.get('usage_history'):
         return None
@@ -0,0 +1,292 @@
+# utils/edit_scheduler.py
+"""
+Centralny harmonogram edycji wiadomości z uwzględnieniem limitów Telegrama
+(ok. 1 edycja/s na czat, ok. 30 wiadomości/s globalnie)
+"""
+import asyncio
+import logging
+import time
+from typing import Any, Dict, Optional
+from telegram.constants import ParseMode
+from telegram.error import BadRequest, NetworkError, RetryAfter
+from config import EDIT_RATE_PER_CHAT, EDIT_RATE_GLOBAL
+
+logger = logging.getLogger(__name__)
+
+# Maksymalna liczba prób dostarczenia ostatniej edycji przy błędach sieci
+FINAL_EDIT_ATTEMPTS = 3
+
+def retry_after_seconds(error: RetryAfter) -> float:
+    retry_after = error.retry_after
+    if hasattr(retry_after, "total_seconds"):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+class TokenBucket:
+    """Kubełek tokenów - `rate` operacji na sekundę, z możliwością wstrzymania (RetryAfter)"""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def delay(self) -> float:
+        """Czas (s) do uzyskania tokenu"""
+        now = time.monotonic()
+        self._refill(now)
+        blocked = max(0.0, self._blocked_until - now)
+        if self._tokens >= 1:
+            return blocked
+        return max(blocked, (1 - self._tokens) / self.rate)
+
+    async def acquire(self) -> None:
+        """Czeka na token i go pobiera"""
+        async with self._lock:
+            while True:
+                wait = self.delay()
+                if wait <= 0:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep(wait)
+
+    def pause(self, seconds: float) -> None:
+        """Wstrzymuje wydawanie tokenów (np. po RetryAfter)"""
+        self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+    def idle(self) -> bool:
+        """Czy kubełek jest pełny (nieużywany od dłuższego czasu)"""
+        return self.delay() == 0 and self._tokens >= self.capacity
+
+class EditStream:
+    """
+    Strumień edycji jednej wiadomości
+
+    update() tylko podmienia oczekujący tekst (kolejne wersje są łączone),
+    a zadanie w tle wysyła najnowszą wersję, gdy pozwalają na to limity.
+    finish() zawsze dostarcza ostatnią wersję.
+    """
+
+    def __init__(self, scheduler: "EditScheduler", message, parse_mode: Optional[str] = ParseMode.MARKDOWN,
+                 sent: Optional[str] = None, reply_markup=None):
+        self.scheduler = scheduler
+        self.message = message
+        self.parse_mode = parse_mode
+        self._pending: Optional[str] = None
+        self._pending_markup = None
+        # Klawiatura pośrednich wersji (np. przycisk przerwania generacji)
+        self.reply_markup = reply_markup
+        # Treść, którą wiadomość już ma (np. nowo wysłana)
+        self._sent: Optional[str] = sent
+        self._final = False
+        self._delivered = False
+        self._changed = asyncio.Event()
+        self._last_edit = 0.0
+        self._task = asyncio.create_task(self._run())
+
+    @property
+    def chat_id(self) -> int:
+        return self.message.chat_id
+
+    def update(self, text: str) -> None:
+        """Podmienia tekst oczekujący na wysłanie (bez czekania)"""
+        if self._final:
+            return
+        if self._pending is not None:
+            self.scheduler.stats["coalesced"] += 1
+        self._pending = text
+        self._changed.set()
+
+    async def finish(self, text: str, reply_markup=None) -> bool:
+        """
+        Wysyła ostatnią wersję wiadomości i kończy strumień
+
+        Gdy formatowanie jest niepoprawne, wiadomość jest wysyłana jako zwykły tekst.
+
+        Returns:
+            bool: True, jeśli wiadomość ma ostateczną treść
+        """
+        self._final = True
+        self._pending = text
+        self._pending_markup = reply_markup
+        self._changed.set()
+        try:
+            # Przerwanie wywołującego nie może przerwać wysyłania ostatniej wersji
+            await asyncio.shield(self._task)
+        except asyncio.CancelledError:
+            if not self._task.cancelled():
+                raise
+            # Strumień przerwany wcześniej (cancel) - ostatnia wersja nie zostanie wysłana
+        return self._delivered
+
+    async def cancel(self) -> None:
+        """Przerywa strumień bez wysyłania oczekującego tekstu"""
+        self._final = True
+        self._pending = None
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+    async def _run(self) -> None:
+        self.scheduler.active_streams += 1
+        try:
+            while True:
+                await self._changed.wait()
+                self._changed.clear()
+
+                if not self._final:
+                    # Kadencja zależna od liczby równoległych strumieni
+                    wait = self._last_edit + self.scheduler.interval() - time.monotonic()
+                    if wait > 0:
+                        try:
+                            await asyncio.wait_for(self._wait_for_final(), timeout=wait)
+                        except asyncio.TimeoutError:
+                            pass
+
+                text = self._pending
+                if text is None:
+                    if self._final:
+                        return
+                    continue
+                self._pending = None
+                final = self._final
+
+                if text == self._sent and not final:
+                    continue
+
+                if final:
+                    self._delivered = await self._send_final(text)
+                    return
+
+                try:
+                    await self._send(text, reply_markup=self.reply_markup)
+                except RetryAfter:
+                    pass
+                except (BadRequest, NetworkError) as e:
+                    # Pośrednia wersja jest zbędna - kolejna ją zastąpi
+                    logger.debug(f"Pominięto pośrednią edycję wiadomości: {e}")
+        finally:
+            self.scheduler.active_streams -= 1
+
+    async def _wait_for_final(self) -> None:
+        while not self._final:
+            await self._changed.wait()
+            self._changed.clear()
+        self._changed.set()
+
+    async def _send(self, text: str, parse_mode: Any = "default", reply_markup=None) -> bool:
+        await self.scheduler.acquire(self.chat_id)
+        self._last_edit = time.monotonic()
+        try:
+            await self.message.edit_text(
+                text,
+                parse_mode=self.parse_mode if parse_mode == "default" else parse_mode,
+                reply_markup=reply_markup
+            )
+            self._sent = text
+            self.scheduler.stats["edits"] += 1
+            return True
+        except RetryAfter as e:
+            self.scheduler.retry_after(self.chat_id, retry_after_seconds(e))
+            # Wyślij tę wersję ponownie, jeśli nie pojawiła się nowsza
+            if self._pending is None:
+                self._pending = text
+                self._changed.set()
+            raise
+        except BadRequest as e:
+            if "not modified" in str(e).lower():
+                self._sent = text
+                return True
+            self.scheduler.stats["failed"] += 1
+            raise
+
+    async def _send_final(self, text: str) -> bool:
+        markup = self._pending_markup
+        parse_mode: Any = "default"
+        attempts = 0
+        while attempts < FINAL_EDIT_ATTEMPTS:
+            if text == self._sent and markup is None and self.reply_markup is None:
+                return True
+            try:
+                return await self._send(text, parse_mode, markup)
+            except RetryAfter:
+                # Limit Telegrama - kubełki są wstrzymane, spróbuj ponownie po przerwie
+                continue
+            except BadRequest as e:
+                if parse_mode is None or self.parse_mode is None:
+                    logger.error(f"Nie udało się dostarczyć ostatniej edycji wiadomości: {e}")
+                    return False
+                # Niepoprawne formatowanie - wyślij jako zwykły tekst
+                parse_mode = None
+            except NetworkError as e:
+                attempts += 1
+                logger.warning(f"Błąd sieci przy ostatniej edycji wiadomości: {e}")
+        return False
+
+class EditScheduler:
+    """Współdzielone limity edycji: kubełek na czat i kubełek globalny"""
+
+    def __init__(self, per_chat_rate: float = EDIT_RATE_PER_CHAT, global_rate: float = EDIT_RATE_GLOBAL,
+                 max_chats: int = 10000):
+        self.per_chat_rate = per_chat_rate
+        self.global_rate = global_rate
+        self.max_chats = max_chats
+        self._global: Optional[TokenBucket] = None
+        self._chats: Dict[int, TokenBucket] = {}
+        self.active_streams = 0
+        self.stats = {"edits": 0, "coalesced": 0, "retry_after": 0, "failed": 0}
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= self.max_chats:
+                # Usuń kubełki czatów, które mają pełną pulę tokenów (nieaktywne)
+                for idle_chat in [cid for cid, b in self._chats.items() if b.idle()]:
+                    del self._chats[idle_chat]
+            bucket = TokenBucket(self.per_chat_rate, capacity=1)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    def _global_bucket(self) -> TokenBucket:
+        if self._global is None:
+            self._global = TokenBucket(self.global_rate)
+        return self._global
+
+    def interval(self) -> float:
+        """Odstęp między edycjami jednego strumienia przy bieżącym obciążeniu"""
+        base = 1.0 / self.per_chat_rate
+        # Zostaw zapas globalnego limitu na zwykłe wiadomości
+        loaded = self.active_streams / (self.global_rate * 0.8)
+        return max(base, loaded)
+
+    async def acquire(self, chat_id: int) -> None:
+        """Czeka na token czatu i token globalny"""
+        await self._chat_bucket(chat_id).acquire()
+        await self._global_bucket().acquire()
+
+    def retry_after(self, chat_id: int, seconds: float) -> None:
+        """Wstrzymuje edycje po odpowiedzi RetryAfter od Telegrama"""
+        self.stats["retry_after"] += 1
+        logger.warning(f"Telegram RetryAfter {seconds:.1f}s (czat {chat_id}) - wstrzymuję edycje")
+        self._chat_bucket(chat_id).pause(seconds)
+        self._global_bucket().pause(seconds)
+
+    def stream(self, message, parse_mode: Optional[str] = ParseMode.MARKDOWN, sent: Optional[str] = None,
+               reply_markup=None) -> EditStream:
+        """Tworzy strumień edycji wiadomości (np. odpowiedzi generowanej strumieniowo)"""
+        return EditStream(self, message, parse_mode, sent, reply_markup)
+
+    async def edit(self, message, text: str, parse_mode: Optional[str] = ParseMode.MARKDOWN, reply_markup=None) -> bool:
+        """Jednorazowa edycja wiadomości w ramach limitów (np. wynik analizy dokumentu)"""
+        return await EditStream(self, message, parse_mode).finish(text, reply_markup=reply_markup)
+
+# Globalna instancja harmonogramu
+edit_scheduler = EditScheduler()
@@ -2,9 +2,36 @@
 import logging
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 from utils.translations import get_text
+from api.circuit_breaker import CircuitOpenError
 
 logger = logging.getLogger(__name__)
 
+# Komunikat o niedostępności zależny od upstreamu otwartego obwodu
+SERVICE_UNAVAILABLE_TEXTS = {
+    "openai": "service_unavailable",
+    "supabase": "service_unavailable_database",
+    "payments": "service_unavailable_payments",
+}
+
+def get_operation_error_text(error, language="pl"):
+    """
+    Zwraca tekst błędu operacji dla użytkownika
+    
+    Gdy upstream jest niedostępny (otwarty obwód), zwraca natychmiastowy
+    komunikat o niedostępności zamiast surowego tekstu wyjątku.
+    
+    Args:
+        error: Wyjątek zgłoszony podczas operacji
+        language: Kod języka
+        
+    Returns:
+        str: Komunikat do wyświetlenia
+    """
+    if isinstance(error, CircuitOpenError):
+        key = SERVICE_UNAVAILABLE_TEXTS.get(error.upstream, "service_unavailable")
+        return get_text(key, language, seconds=int(error.retry_in) or 1)
+    return get_text("response_error", language, error=str(error))
+
 async def handle_callback_error(query, error_message, full_error=None, show_retry=True, language=None):
     """
     Ulepszona obsługa błędów podczas przetwarzania callbacków
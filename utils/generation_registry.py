@@ -0,0 +1,182 @@
+# utils/generation_registry.py
+"""
+Rejestr trwających generacji odpowiedzi AI (po jednej na użytkownika)
+
+Generacja działa jako zadanie w tle, więc kolejne aktualizacje użytkownika
+(/newchat, zmiana trybu, nowa wiadomość, przycisk "⏹ Stop") mogą ją przerwać.
+Przerwanie zamyka strumień HTTP OpenAI, a kredyty są pobierane tylko za
+dostarczoną część odpowiedzi.
+"""
+import asyncio
+import logging
+import math
+from typing import Any, Awaitable, Callable, Dict, Optional
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
+from telegram.ext import ContextTypes
+from utils.background import run_in_background
+from services.update_inbox import hold_current_update
+
+logger = logging.getLogger(__name__)
+
+STOP_CALLBACK = "stop_generation"
+
+# Polecenia i przyciski, które zastępują trwającą generację
+SUPERSEDING_COMMANDS = ("/newchat", "/mode", "/restart")
+SUPERSEDING_CALLBACKS = ("quick_new_chat", "quick_last_chat", "mode_", "model_")
+
+# Maksymalny czas oczekiwania na dokończenie przerwanej generacji (rozliczenie, edycja)
+CANCEL_TIMEOUT = 5.0
+
+class Generation:
+    """Trwająca generacja odpowiedzi użytkownika"""
+
+    def __init__(self, user_id: int):
+        self.user_id = user_id
+        self.task: Optional[asyncio.Task] = None
+        # Powód przerwania (stop, newchat, superseded, ...) - None, gdy generacja trwa
+        self.cancel_reason: Optional[str] = None
+        # Tekst odpowiedzi dostarczony użytkownikowi
+        self.delivered = ""
+
+    @property
+    def cancelled(self) -> bool:
+        return self.cancel_reason is not None
+
+class GenerationRegistry:
+    """Rejestr generacji - nowa generacja użytkownika przerywa poprzednią"""
+
+    def __init__(self):
+        self._active: Dict[int, Generation] = {}
+        self.stats: Dict[str, int] = {"started": 0, "completed": 0, "cancelled": 0}
+
+    def get(self, user_id: int) -> Optional[Generation]:
+        """Zwraca trwającą generację użytkownika"""
+        generation = self._active.get(user_id)
+        if generation is not None and generation.task is not None and not generation.task.done():
+            return generation
+        return None
+
+    async def start(self, user_id: int, run: Callable[[Generation], Awaitable[Any]],
+                    description: str = "generowanie odpowiedzi") -> Generation:
+        """
+        Uruchamia generację w tle, przerywając poprzednią generację użytkownika
+
+        Args:
+            user_id: ID użytkownika
+            run: funkcja tworząca korutynę generacji; dostaje obiekt Generation
+            description: opis zadania używany w logach
+        """
+        await self.cancel(user_id, "superseded")
+
+        generation = Generation(user_id)
+        generation.task = run_in_background(run(generation), description)
+        self._active[user_id] = generation
+        self.stats["started"] += 1
+        # Aktualizacja jest obsłużona dopiero po zakończeniu generacji (wznowienie po awarii)
+        hold_current_update(generation.task)
+
+        def _done(task: asyncio.Task) -> None:
+            if self._active.get(user_id) is generation:
+                del self._active[user_id]
+            if not generation.cancelled:
+                self.stats["completed"] += 1
+
+        generation.task.add_done_callback(_done)
+        return generation
+
+    async def cancel(self, user_id: int, reason: str) -> bool:
+        """
+        Przerywa trwającą generację użytkownika i czeka na jej rozliczenie
+
+        Returns:
+            bool: True, jeśli generacja została przerwana
+        """
+        generation = self.get(user_id)
+        if generation is None:
+            return False
+
+        generation.cancel_reason = reason
+        generation.task.cancel()
+        self.stats["cancelled"] += 1
+        logger.info(f"Przerwano generację odpowiedzi użytkownika {user_id} ({reason})")
+
+        # Poczekaj, aż przerwana generacja rozliczy kredyty i zaktualizuje wiadomość
+        done, _ = await asyncio.wait([generation.task], timeout=CANCEL_TIMEOUT)
+        if not done:
+            logger.warning(f"Przerwana generacja użytkownika {user_id} nie zakończyła się w {CANCEL_TIMEOUT}s")
+        return True
+
+async def run_uninterrupted(coro: Awaitable[Any]) -> Any:
+    """
+    Wykonuje końcowe kroki generacji (ostatnia edycja, zapis odpowiedzi, rozliczenie kredytów)
+
+    Przerwanie generacji w trakcie tych kroków (np. "⏹ Stop" tuż po ostatnim
+    fragmencie) nie przerywa ich w połowie - zadanie czeka na ich zakończenie,
+    więc odpowiedź nie jest zapisywana ani rozliczana drugi raz jako przerwana.
+    """
+    task = asyncio.ensure_future(coro)
+    while True:
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if task.done():
+                raise
+
+def stop_keyboard(label: str = "⏹ Stop") -> InlineKeyboardMarkup:
+    """Klawiatura z przyciskiem przerwania generacji"""
+    return InlineKeyboardMarkup([[InlineKeyboardButton(label, callback_data=STOP_CALLBACK)]])
+
+def delivered_credit_cost(credit_cost: int, delivered: str, model: str) -> int:
+    """
+    Koszt przerwanej generacji - proporcjonalny do liczby dostarczonych tokenów
+    względem szacowanej długości odpowiedzi, co najmniej 1 kredyt, nie więcej niż pełny koszt
+    """
+    from api.openai_client import DEFAULT_COMPLETION_TOKENS_ESTIMATE
+    from utils.context_builder import token_counter
+
+    if not delivered:
+        return 0
+    tokens = token_counter.count(delivered, model)
+    ratio = min(1.0, tokens / DEFAULT_COMPLETION_TOKENS_ESTIMATE)
+    return max(1, min(credit_cost, math.ceil(credit_cost * ratio)))
+
+async def settle_cancelled_generation(reservation, credit_cost: int, delivered: str, model: str) -> int:
+    """
+    Rozlicza rezerwację przerwanej generacji
+
+    Returns:
+        int: pobrana liczba kredytów
+    """
+    from database.credits_client import settle_credit_reservation, release_credit_reservation
+
+    amount = delivered_credit_cost(credit_cost, delivered, model)
+    if amount == 0:
+        await release_credit_reservation(reservation)
+    else:
+        await settle_credit_reservation(reservation, amount)
+    return amount
+
+def _superseding_reason(update: Update) -> Optional[str]:
+    message = update.message
+    if message is not None:
+        if message.text and message.text.startswith("/"):
+            command = message.text.split()[0].split("@")[0]
+            return command[1:] if command in SUPERSEDING_COMMANDS else None
+        # Nowa wiadomość (np. poprawka pytania) zastępuje trwającą odpowiedź
+        return "new_message" if message.text else None
+
+    query = update.callback_query
+    if query is not None and query.data and query.data.startswith(SUPERSEDING_CALLBACKS):
+        return query.data
+    return None
+
+async def cancel_superseded_generation(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Handler wstępny - przerywa generację, którą zastępuje bieżąca aktualizacja"""
+    if update.effective_user is None:
+        return
+    reason = _superseding_reason(update)
+    if reason is not None:
+        await generation_registry.cancel(update.effective_user.id, reason)
+
+# Globalny rejestr generacji
+generation_registry = GenerationRegistry()
@@ -0,0 +1,249 @@
+# utils/markdown_stream.py
+"""
+Przyrostowe renderowanie odpowiedzi modelu do Markdown Telegrama (ParseMode.MARKDOWN)
+
+Znaczniki w stylu GitHuba (**pogrubienie**, __pogrubienie__, *kursywa*, _kursywa_,
+`kod`, ```blok```) są zamieniane na składnię Telegrama, a znaki, które nie tworzą
+poprawnej encji, są poprzedzane znakiem ucieczki. Każda migawka ma domknięte
+wszystkie otwarte encje, więc edycja wiadomości nie kończy się błędem
+"can't parse entities". Przetwarzany jest tylko nowy fragment tekstu.
+"""
+from typing import List, Optional
+
+BOLD = "bold"
+ITALIC = "italic"
+CODE = "code"
+PRE = "pre"
+
+# Znacznik Telegrama otwierający i zamykający encję
+_TELEGRAM_MARKERS = {BOLD: "*", ITALIC: "_", CODE: "`", PRE: "```"}
+
+class MarkdownStreamRenderer:
+    """Renderer przyjmujący kolejne fragmenty odpowiedzi (feed) i zwracający poprawne migawki"""
+
+    def __init__(self):
+        self._parts: List[str] = []
+        # Nieprzetworzony koniec tekstu - znaczniki, których znaczenie zależy od kolejnych znaków
+        self._tail = ""
+        self._mode: Optional[str] = None
+        # Znacznik źródłowy otwartej encji (np. "**" lub "_"), którym musi zostać zamknięta
+        self._source_marker = ""
+        # Pozycja w _parts znacznika otwierającego bieżącą encję
+        self._open_index = 0
+        # Encja przerwana blokiem kodu - zostanie otwarta ponownie po jego zamknięciu
+        self._resume: Optional[tuple] = None
+        self._prev = "\n"
+        self.entities = 0
+
+    @property
+    def has_entities(self) -> bool:
+        """Czy tekst zawiera jakiekolwiek formatowanie"""
+        return self.entities > 0 or self._mode is not None
+
+    def feed(self, chunk: str) -> None:
+        """Dodaje kolejny fragment odpowiedzi"""
+        self._tail += chunk
+        self._process(final=False)
+
+    def snapshot(self) -> str:
+        """Zwraca bieżący tekst z domkniętymi encjami (bez nierozstrzygniętych znaczników)"""
+        return self._closed_text()
+
+    def finish(self) -> str:
+        """Przetwarza resztę tekstu i zwraca ostateczną, poprawną wersję"""
+        self._process(final=True)
+        return self._closed_text()
+
+    # --- przetwarzanie ---
+
+    def _emit(self, text: str) -> None:
+        if text:
+            self._parts.append(text)
+            self._prev = text[-1]
+
+    def _has_content(self) -> bool:
+        return len(self._parts) > self._open_index + 1
+
+    def _open(self, mode: str, source_marker: str) -> None:
+        self._open_index = len(self._parts)
+        self._parts.append(_TELEGRAM_MARKERS[mode])
+        self._mode = mode
+        self._source_marker = source_marker
+
+    def _close(self) -> None:
+        if self._has_content():
+            self._parts.append(_TELEGRAM_MARKERS[self._mode])
+            self.entities += 1
+        else:
+            # Pusta encja jest niepoprawna - usuń znacznik otwierający
+            del self._parts[self._open_index:]
+        self._mode = None
+        self._source_marker = ""
+
+    def _literal(self, text: str) -> None:
+        """Znak formatowania użyty dosłownie - poza encją wymaga znaku ucieczki"""
+        if self._mode is None:
+            self._emit("".join("\\" + char for char in text))
+        elif _TELEGRAM_MARKERS[self._mode] in text:
+            # Wewnątrz encji znak ucieczki nie działa, a znacznik encji by ją zamknął -
+            # zamknij encję, dodaj znak poza nią i otwórz ją ponownie (*2*\**2=4*)
+            mode, source_marker = self._mode, self._source_marker
+            self._close()
+            self._emit("".join("\\" + char for char in text))
+            self._open(mode, source_marker)
+        else:
+            self._emit(text)
+
+    def _process(self, final: bool) -> None:
+        tail = self._tail
+        i = 0
+        n = len(tail)
+        plain_start = None
+
+        def flush_plain(end: int) -> None:
+            nonlocal plain_start
+            if plain_start is not None:
+                self._emit(tail[plain_start:end])
+                plain_start = None
+
+        while i < n:
+            char = tail[i]
+
+            if self._mode == PRE:
+                end = tail.find("```", i)
+                if end == -1:
+                    # Ostatnie dwa znaki mogą być początkiem zamknięcia bloku
+                    keep = 0 if final else min(2, n - i)
+                    self._emit(tail[i:n - keep])
+                    i = n - keep
+                    break
+                self._emit(tail[i:end])
+                self._close()
+                self._reopen()
+                i = end + 3
+                continue
+
+            if self._mode == CODE:
+                end = tail.find("`", i)
+                if end == -1:
+                    self._emit(tail[i:])
+                    i = n
+                    break
+                self._emit(tail[i:end])
+                self._close()
+                self._reopen()
+                i = end + 1
+                continue
+
+            if char not in "*_`[\\":
+                if plain_start is None:
+                    plain_start = i
+                i += 1
+                continue
+
+            flush_plain(i)
+
+            # Decyzja wymaga znajomości kolejnych znaków - poczekaj na następny fragment
+            if not final and not self._decidable(tail, i):
+                break
+
+            next_char = tail[i + 1] if i + 1 < n else ""
+
+            if char == "\\":
+                if not next_char:
+                    self._literal("\\")
+                    i += 1
+                elif next_char in "*_`[":
+                    self._literal(next_char)
+                    i += 2
+                else:
+                    self._emit(tail[i:i + 2])
+                    i += 2
+                continue
+
+            if char == "[":
+                self._literal("[")
+                i += 1
+                continue
+
+            if char == "`":
+                run = 1
+                while run < 3 and i + run < n and tail[i + run] == "`":
+                    run += 1
+                if run == 2:
+                    self._literal("``")
+                else:
+                    self._suspend()
+                    self._open(PRE if run == 3 else CODE, "`" * run)
+                i += run
+                continue
+
+            # '*' lub '_'
+            double = next_char == char
+            marker = char * 2 if double else char
+            after = tail[i + len(marker)] if i + len(marker) < n else ""
+
+            if self._mode is not None and self._source_marker == marker:
+                if double or not after.isalnum():
+                    self._close()
+                    if double and after == char:
+                        # Zamknięcie ***tekst*** - kursywa została pominięta przy otwarciu
+                        i += 1
+                else:
+                    self._literal(marker)
+            elif self._mode is None and after and not after.isspace() and (double or not self._prev.isalnum()):
+                self._open(BOLD if double else ITALIC, marker)
+            elif self._mode == BOLD and char == "*" and not double and self._italic_marker(after):
+                # Kursywa wewnątrz pogrubienia (***tekst***) - encje Telegrama nie mogą się zagnieżdżać
+                pass
+            else:
+                self._literal(marker)
+            i += len(marker)
+
+        flush_plain(i)
+        self._tail = tail[i:]
+
+    def _italic_marker(self, after: str) -> bool:
+        """Czy pojedyncza gwiazdka może otwierać lub zamykać kursywę (a nie jest np. mnożeniem 2*3)"""
+        opens = after and not after.isspace() and not self._prev.isalnum()
+        closes = not self._prev.isspace() and not after.isalnum()
+        return bool(opens or closes)
+
+    def _decidable(self, tail: str, i: int) -> bool:
+        """Czy znacznik na pozycji i można rozstrzygnąć bez kolejnych znaków"""
+        char = tail[i]
+        rest = tail[i + 1:i + 3]
+        if char == "`":
+            # Ciąg backticków jest kompletny, gdy ma trzy znaki lub przerywa go inny znak
+            return len(rest) == 2 or any(c != "`" for c in rest)
+        if char in "*_":
+            # Znany musi być znak następujący po znaczniku (pojedynczym lub podwójnym)
+            return len(rest) == 2 or (len(rest) == 1 and rest != char)
+        if char == "\\":
+            return len(rest) >= 1
+        return True
+
+    def _suspend(self) -> None:
+        """Zamyka encję przed blokiem kodu (encje Telegrama nie mogą się zagnieżdżać)"""
+        if self._mode in (BOLD, ITALIC):
+            self._resume = (self._mode, self._source_marker)
+            self._close()
+
+    def _reopen(self) -> None:
+        if self._resume is not None:
+            mode, source_marker = self._resume
+            self._resume = None
+            self._open(mode, source_marker)
+
+    def _closed_text(self) -> str:
+        if self._mode is None:
+            return "".join(self._parts)
+        if not self._has_content():
+            return "".join(self._parts[:self._open_index])
+        return "".join(self._parts) + _TELEGRAM_MARKERS[self._mode]
+
+def render_markdown(text: str) -> str:
+    """Renderuje cały tekst jednorazowo"""
+    renderer = MarkdownStreamRenderer()
+    renderer.feed(text)
+    return renderer.finish()
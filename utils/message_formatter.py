@@ -1,8 +1,8 @@
 """
 Moduł do formatowania wiadomości dla bota Telegram
 """
-import re
 from telegram.constants import ParseMode
+from utils.markdown_stream import MarkdownStreamRenderer
 
 def format_markdown_v2(text):
     """
@@ -63,22 +63,14 @@ def safe_send_message(message):
     Returns:
         tuple: (sformatowana_wiadomość, tryb_parsowania)
     """
-    # Sprawdź, czy wiadomość zawiera znaczniki Markdown
-    has_markdown = bool(re.search(r'[*_`\[]', message))
-    
-    # Jeśli wiadomość zawiera znaczniki Markdown, użyj trybu Markdown
-    if has_markdown:
-        # Sprawdź, czy wiadomość jest poprawna w Markdown V2
-        try:
-            # Sprawdź najczęstsze błędy w formatowaniu Markdown
-            if '**' in message or '__' in message:
-                # Konwertuj na format Markdown używany przez Telegram
-                message = message.replace('**', '*').replace('__', '_')
-            
-            return truncate_message(message), ParseMode.MARKDOWN
-        except Exception:
-            # W przypadku błędu formatowania, usuń formatowanie
-            return truncate_message(message), None
+    # Skróć przed renderowaniem - renderer domyka encje przecięte przy skracaniu
+    renderer = MarkdownStreamRenderer()
+    renderer.feed(truncate_message(message))
+    rendered = renderer.finish()
+    
+    # Jeśli wiadomość zawiera formatowanie, użyj trybu Markdown
+    if renderer.has_entities:
+        return rendered, ParseMode.MARKDOWN
     
     # Jeśli wiadomość nie zawiera formatowania, wyślij jako zwykły tekst
     return truncate_message(message), None
@@ -0,0 +1,176 @@
+# utils/message_pager.py
+"""
+Strumieniowe dzielenie długich odpowiedzi na kolejne wiadomości (limit 4096 znaków)
+
+Edytowana jest tylko ostatnia wiadomość; gdy jej treść zbliża się do limitu,
+zostaje zamknięta na bezpiecznej granicy (akapit, linia, zdanie - najlepiej poza
+blokiem kodu), a dalsza część odpowiedzi trafia do nowej wiadomości.
+"""
+import logging
+from typing import List, Optional
+from telegram.constants import ParseMode
+from telegram.error import BadRequest, NetworkError, RetryAfter
+from utils.edit_scheduler import FINAL_EDIT_ATTEMPTS, EditScheduler, EditStream, edit_scheduler, retry_after_seconds
+from utils.markdown_stream import MarkdownStreamRenderer, render_markdown
+
+logger = logging.getLogger(__name__)
+
+# Limit długości wiadomości Telegrama
+MESSAGE_LIMIT = 4096
+# Zapas na kursor i znaczniki domykające encje
+PAGE_MARGIN = 16
+# Granice podziału w kolejności preferencji
+SPLIT_BOUNDARIES = ("\n\n", "\n", ". ", "! ", "? ", " ")
+# Dzielimy dopiero, gdy granica nie skraca strony bardziej niż o połowę
+MIN_PAGE_FILL = 0.5
+
+STREAM_CURSOR = "▌"
+
+def find_split(text: str, fits) -> int:
+    """
+    Znajduje pozycję podziału tekstu źródłowego
+
+    Args:
+        text: tekst strony (przed renderowaniem)
+        fits: funkcja sprawdzająca, czy prefiks o danej długości mieści się na stronie
+
+    Returns:
+        int: długość prefiksu, który zostaje na bieżącej stronie
+    """
+    # Najdłuższy prefiks mieszczący się na stronie (wyszukiwanie binarne)
+    low, high = 1, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if fits(middle):
+            low = middle
+        else:
+            high = middle - 1
+    limit = low
+    minimum = int(limit * MIN_PAGE_FILL)
+
+    fallback = None
+    for boundary in SPLIT_BOUNDARIES:
+        position = text.rfind(boundary, 0, limit - len(boundary) + 1)
+        while position >= minimum:
+            split = position + len(boundary)
+            if text.count("```", 0, split) % 2 == 0:
+                return split
+            if fallback is None and boundary != " ":
+                # Granica wewnątrz bloku kodu - użyj, jeśli nie ma lepszej
+                fallback = split
+            position = text.rfind(boundary, 0, position)
+    return fallback or limit
+
+class PaginatedStream:
+    """
+    Strumień odpowiedzi rozkładany na wiele wiadomości
+
+    Interfejs odpowiada EditStream: feed() dodaje fragment odpowiedzi,
+    finish() dostarcza ostateczną treść wszystkich stron, cancel() przerywa.
+    """
+
+    def __init__(self, message, header: str = "", scheduler: Optional[EditScheduler] = None,
+                 parse_mode: Optional[str] = ParseMode.MARKDOWN, limit: int = MESSAGE_LIMIT, reply_markup=None):
+        self.scheduler = scheduler or edit_scheduler
+        self.parse_mode = parse_mode
+        # Klawiatura ostatniej wiadomości w trakcie generowania (np. przycisk "⏹ Stop")
+        self.reply_markup = reply_markup
+        self.limit = limit - PAGE_MARGIN
+        # Nagłówek jest już w formacie Telegrama - trafia tylko na pierwszą stronę
+        self.header = header
+        self.messages: List = [message]
+        self._stream: EditStream = self.scheduler.stream(message, parse_mode, reply_markup=reply_markup)
+        self._page = ""
+        self._renderer = MarkdownStreamRenderer()
+
+    @property
+    def pages(self) -> int:
+        return len(self.messages)
+
+    def _prefix(self) -> str:
+        return self.header if len(self.messages) == 1 else ""
+
+    def _render(self, text: str) -> str:
+        return self._prefix() + render_markdown(text)
+
+    async def feed(self, chunk: str) -> None:
+        """Dodaje fragment odpowiedzi i aktualizuje ostatnią wiadomość"""
+        self._page += chunk
+        self._renderer.feed(chunk)
+        snapshot = self._prefix() + self._renderer.snapshot()
+        while len(snapshot) + len(STREAM_CURSOR) > self.limit:
+            await self._roll_over()
+            snapshot = self._prefix() + self._renderer.snapshot()
+        self._stream.update(snapshot + STREAM_CURSOR)
+
+    async def finish(self, footer: str = "", reply_markup=None) -> bool:
+        """
+        Dostarcza ostateczną treść ostatniej strony
+
+        Args:
+            footer: tekst w formacie Telegrama dołączany na końcu (np. raport kredytów)
+            reply_markup: klawiatura ostatniej wiadomości
+
+        Returns:
+            bool: True, jeśli ostatnia wiadomość ma ostateczną treść
+        """
+        while len(self._prefix() + render_markdown(self._page)) > self.limit:
+            await self._roll_over()
+
+        text = self._prefix() + self._renderer.finish()
+        if footer and len(text) + len(footer) > self.limit:
+            # Stopka nie mieści się na ostatniej stronie - wyślij ją osobno
+            if not await self._stream.finish(text):
+                return False
+            self.reply_markup = None
+            await self._open_page(footer)
+            return await self._stream.finish(footer, reply_markup=reply_markup)
+        return await self._stream.finish(text + footer, reply_markup=reply_markup)
+
+    async def cancel(self) -> None:
+        """Przerywa aktualizację ostatniej wiadomości"""
+        await self._stream.cancel()
+
+    async def _roll_over(self) -> None:
+        """Zamyka bieżącą stronę na bezpiecznej granicy i otwiera nową wiadomość"""
+        page = self._page
+        split = find_split(page, lambda length: len(self._render(page[:length])) <= self.limit)
+        # Biała przestrzeń na granicy podziału nie jest przenoszona (Telegram odrzuca pustą treść)
+        head, rest = page[:split], page[split:].lstrip()
+
+        if head.count("```") % 2 == 1:
+            # Podział wewnątrz bloku kodu - kontynuuj blok na nowej stronie
+            rest = "```\n" + rest
+
+        await self._stream.finish(self._render(head))
+
+        self._page = rest
+        self._renderer = MarkdownStreamRenderer()
+        self._renderer.feed(rest)
+        # Nagłówek pierwszej strony nie jest powtarzany na kolejnych
+        await self._open_page(render_markdown(rest) or STREAM_CURSOR)
+
+    async def _open_page(self, text: str) -> None:
+        """Wysyła kolejną wiadomość w ramach limitów i przełącza na nią edycje"""
+        chat = self.messages[-1].chat
+        parse_mode = self.parse_mode
+        attempts = 0
+        while True:
+            await self.scheduler.acquire(chat.id)
+            try:
+                message = await chat.send_message(text, parse_mode=parse_mode, reply_markup=self.reply_markup)
+                break
+            except RetryAfter as e:
+                self.scheduler.retry_after(chat.id, retry_after_seconds(e))
+            except BadRequest as e:
+                if parse_mode is None:
+                    raise
+                # Niepoprawne formatowanie - wyślij jako zwykły tekst
+                logger.warning(f"Nie udało się wysłać kolejnej części odpowiedzi z formatowaniem: {e}")
+                parse_mode = None
+            except NetworkError:
+                attempts += 1
+                if attempts >= FINAL_EDIT_ATTEMPTS:
+                    raise
+        self.messages.append(message)
+        self._stream = self.scheduler.stream(message, self.parse_mode, sent=text, reply_markup=self.reply_markup)
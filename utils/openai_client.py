@@ -1,18 +1,33 @@
-from services.api_service import APIService
+from services.container import container
+from utils.context_builder import build_context
+from config import DEFAULT_MODEL, DEFAULT_SYSTEM_PROMPT
 
-# Utworzenie globalnej instancji
-api_service = APIService()
+def __getattr__(name):
+    """Udostępnia współdzielone serwisy pod starymi nazwami globalnymi"""
+    if name == "api_service":
+        return container.api_service
+    if name == "client":
+        return container.api_service.openai.client
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # Funkcje kompatybilne ze starym kodem
 async def chat_completion(messages, model=None):
     """Funkcja dla kompatybilności wstecznej"""
-    return await api_service.chat_completion_text(messages, model)
+    return await container.api_service.chat_completion_text(messages, model or DEFAULT_MODEL)
 
 async def chat_completion_stream(messages, model=None):
     """Funkcja dla kompatybilności wstecznej"""
-    async for chunk in api_service.chat_completion_stream(messages, model):
+    async for chunk in container.api_service.chat_completion_stream(messages, model or DEFAULT_MODEL):
         yield chunk
 
 async def generate_image_dall_e(prompt):
     """Funkcja dla kompatybilności wstecznej"""
-    return await api_service.generate_image(prompt)
\ No newline at end of file
+    return await container.api_service.generate_image(prompt)
+
+def prepare_messages_from_history(history, user_message, system_prompt=None, model=None):
+    """
+    Przygotowuje wiadomości dla API OpenAI z historii konwersacji
+    
+    Historia jest przycinana do budżetu tokenów wybranego modelu.
+    """
+    return build_context(history, user_message, system_prompt or DEFAULT_SYSTEM_PROMPT, model or DEFAULT_MODEL)
\ No newline at end of file
@@ -11,6 +11,9 @@ translations = {
         "database_error": "Wystąpił błąd bazy danych. Spróbuj ponownie później.",
         "conversation_error": "Wystąpił błąd przy pobieraniu konwersacji. Spróbuj /newchat aby utworzyć nową.",
         "response_error": "Wystąpił błąd podczas generowania odpowiedzi: {error}",
+        "service_unavailable": "Usługa AI jest chwilowo przeciążona lub niedostępna. Spróbuj ponownie za {seconds} s — kredyty nie zostały pobrane.",
+        "service_unavailable_database": "Baza danych jest chwilowo niedostępna. Spróbuj ponownie za {seconds} s — kredyty nie zostały pobrane.",
+        "service_unavailable_payments": "Usługa płatności jest chwilowo niedostępna. Spróbuj ponownie za {seconds} s.",
         
         # Teksty do start i restart
         "language_selection_neutral": "🌐 Wybierz język / Choose language / Выберите язык:",
@@ -143,6 +146,9 @@ translations = {
         "history_delete_button": "🗑️ Usuń historię",
         "history_deleted": "*Historia została wyczyszczona*\n\nRozpocznęto nową konwersację.",
         "generating_response": "⏳ Generowanie odpowiedzi...",
+        "stop_generation_btn": "⏹ Stop",
+        "generation_stopped": "⏹ _Generowanie przerwane_",
+        "generation_stopped_toast": "⏹ Zatrzymano generowanie",
         
         # Do modeli i trybów
         "model_not_available": "Wybrany model nie jest dostępny.",
@@ -477,6 +483,9 @@ translations = {
         "database_error": "A database error occurred. Please try again later.",
         "conversation_error": "An error occurred while retrieving the conversation. Try /newchat to create a new one.",
         "response_error": "An error occurred while generating the response: {error}",
+        "service_unavailable": "The AI service is temporarily overloaded or unavailable. Please try again in {seconds} s — no credits were charged.",
+        "service_unavailable_database": "The database is temporarily unavailable. Please try again in {seconds} s — no credits were charged.",
+        "service_unavailable_payments": "The payment service is temporarily unavailable. Please try again in {seconds} s.",
         
         # Teksty do start i restart
         "language_selection_neutral": "🌐 Choose language / Wybierz język / Выберите язык:",
@@ -610,6 +619,9 @@ translations = {
         "history_delete_button": "🗑️ Delete History",
         "history_deleted": "*History has been cleared*\n\nA new conversation has been started.",
         "generating_response": "⏳ Generating response...",
+        "stop_generation_btn": "⏹ Stop",
+        "generation_stopped": "⏹ _Generation stopped_",
+        "generation_stopped_toast": "⏹ Generation stopped",
         
         # Do modeli i trybów
         "model_not_available": "The selected model is not available.",
@@ -943,6 +955,9 @@ translations = {
         "database_error": "Произошла ошибка базы данных. Пожалуйста, попробуйте позже.",
         "conversation_error": "Произошла ошибка при получении разговора. Попробуйте /newchat, чтобы создать новый.",
         "response_error": "Произошла ошибка при создании ответа: {error}",
+        "service_unavailable": "Сервис ИИ временно перегружен или недоступен. Попробуйте снова через {seconds} с — кредиты не были списаны.",
+        "service_unavailable_database": "База данных временно недоступна. Попробуйте снова через {seconds} с — кредиты не были списаны.",
+        "service_unavailable_payments": "Платёжный сервис временно недоступен. Попробуйте снова через {seconds} с.",
         
         # Teksty do start i restart
         "language_selection_neutral": "🌐 Выберите язык / Choose language / Wybierz język:",
@@ -1076,6 +1091,9 @@ translations = {
         "history_delete_button": "🗑️ Удалить историю",
         "history_deleted": "*История была очищена*\n\nНачат новый разговор.",
         "generating_response": "⏳ Генерация ответа...",
+        "stop_generation_btn": "⏹ Стоп",
+        "generation_stopped": "⏹ _Генерация остановлена_",
+        "generation_stopped_toast": "⏹ Генерация остановлена",
         
         # Do modeli i trybów
         "model_not_available": "Выбранная модель недоступна.",
@@ -1,5 +1,8 @@
 # utils/user_utils.py
-from database.supabase_client import supabase
+import logging
+from database.supabase_client import get_supabase_client
+
+logger = logging.getLogger(__name__)
 
 def get_user_language(context, user_id):
     """
@@ -16,9 +19,14 @@ def get_user_language(context, user_id):
     if 'user_data' in context.chat_data and user_id in context.chat_data['user_data'] and 'language' in context.chat_data['user_data'][user_id]:
         return context.chat_data['user_data'][user_id]['language']
     
+    # Migawka użytkownika załadowana dla bieżącej aktualizacji
+    snapshot = getattr(context, 'user_snapshot', None)
+    if snapshot is not None and snapshot.user_id == user_id and snapshot.loaded:
+        return snapshot.language
+    
     # Jeśli nie, pobierz z bazy danych
     try:
-        response = supabase.table('users').select('language, language_code').eq('id', user_id).execute()
+        response = get_supabase_client().table('users').select('language, language_code').eq('id', user_id).execute()
         
         if response.data:
             user_data = response.data[0]
@@ -51,11 +59,57 @@ def get_user_language(context, user_id):
                 context.chat_data['user_data'][user_id]['language'] = language_code
                 return language_code
     except Exception as e:
-        print(f"Błąd pobierania języka z bazy: {e}")
+        logger.error(f"Błąd pobierania języka z bazy: {e}")
     
     # Domyślny język, jeśli wszystkie metody zawiodły
     return "pl"
 
+async def get_user_language_async(context, user_id):
+    """
+    Pobiera język użytkownika z kontekstu lub bazy danych bez blokowania pętli zdarzeń
+    
+    Args:
+        context: Kontekst bota
+        user_id: ID użytkownika
+        
+    Returns:
+        str: Kod języka (pl, en, ru)
+    """
+    if 'user_data' in context.chat_data and user_id in context.chat_data['user_data'] and 'language' in context.chat_data['user_data'][user_id]:
+        return context.chat_data['user_data'][user_id]['language']
+    
+    snapshot = getattr(context, 'user_snapshot', None)
+    if snapshot is not None and snapshot.user_id == user_id and snapshot.loaded:
+        return snapshot.language
+    
+    try:
+        from services.container import container
+        rows = await container.api_service.supabase.query(
+            "users",
+            query_type="select",
+            columns="language,language_code",
+            filters={"id": user_id},
+            limit=1
+        )
+    except Exception as e:
+        logger.error(f"Błąd pobierania języka z bazy: {e}")
+        return "pl"
+    
+    if rows:
+        language = rows[0].get('language') or rows[0].get('language_code')
+        if language:
+            # Zapisz w kontekście na przyszłość
+            if 'user_data' not in context.chat_data:
+                context.chat_data['user_data'] = {}
+            
+            if user_id not in context.chat_data['user_data']:
+                context.chat_data['user_data'][user_id] = {}
+            
+            context.chat_data['user_data'][user_id]['language'] = language
+            return language
+    
+    return "pl"
+
 def mark_chat_initialized(context, user_id):
     """
     Oznacza czat jako zainicjowany przez użytkownika.
@@ -76,7 +130,7 @@ def mark_chat_initialized(context, user_id):
     
     # Ustaw flagę inicjalizacji
     context.chat_data['user_data'][user_id]['chat_initialized'] = True
-    print(f"Czat został oznaczony jako zainicjowany dla użytkownika {user_id}")
+    logger.info(f"Czat został oznaczony jako zainicjowany dla użytkownika {user_id}")
 
 def is_chat_initialized(context, user_id):
     """